@@ -0,0 +1,99 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Synthetic inputs for the Calcam benchmarks.
+
+Everything the benchmarks need is generated procedurally and
+deterministically using calcam.synthetic, so the suite does not depend
+on any machine model, calibration or image files being available.
+"""
+
+import os
+
+import numpy as np
+import cv2
+
+from calcam import synthetic
+
+
+# Number of triangles in the synthetic CAD model
+default_model_size = 200000
+
+# Numbers of triangles for benchmarks looking at how things scale with CAD model size
+model_sizes = [100000,1000000]
+
+# Camera image size used for the synthetic calibration
+image_shape = (480,640)
+
+
+
+def make_calibration():
+    '''
+    Return a synthetic calibration looking in to the synthetic CAD model.
+    '''
+    return synthetic.make_calibration(image_size=image_shape[::-1])
+
+
+
+def write_scene(model_sizes=[]):
+    '''
+    Write the synthetic CAD model and calibration to the working directory
+    and return a dictionary of their paths. CAD models with the given
+    numbers of triangles are also written, if given.
+    '''
+    scene = {'cadmodels':{}}
+
+    for n_triangles in sorted(set(model_sizes + [default_model_size])):
+        scene['cadmodels'][n_triangles] = synthetic.make_cadmodel('bench_model_{:d}.ccm'.format(n_triangles),n_triangles=n_triangles)
+
+    scene['cadmodel'] = scene['cadmodels'][default_model_size]
+
+    scene['calibration'] = os.path.abspath('bench_calib.ccc')
+    make_calibration().save(scene['calibration'])
+
+    return scene
+
+
+
+def make_image(shape=image_shape,shift=(0.,0.),seed=0):
+    '''
+    Return a deterministic 8-bit greyscale test image with
+    structure on a range of scales and shot-like noise, optionally
+    translated by shift = (dx,dy) pixels.
+    '''
+    rng = np.random.RandomState(seed)
+
+    margin = 32
+    canvas = np.zeros((shape[0] + 2*margin,shape[1] + 2*margin),dtype=np.float32)
+    for scale,n_blobs in ( (40,12), (12,60), (4,300) ):
+        for _ in range(n_blobs):
+            centre = (int(rng.uniform(0,canvas.shape[1])),int(rng.uniform(0,canvas.shape[0])))
+            cv2.circle(canvas,centre,int(rng.uniform(0.5,1.5)*scale),float(rng.uniform(0.2,1.)),-1)
+    canvas = cv2.GaussianBlur(canvas,(0,0),2.)
+
+    transform = np.array([[1.,0.,shift[0]],[0.,1.,shift[1]]])
+    canvas = cv2.warpAffine(canvas,transform,(canvas.shape[1],canvas.shape[0]),flags=cv2.INTER_LINEAR)
+    image = canvas[margin:-margin,margin:-margin]
+
+    noisy = image * 150. + 20. + rng.normal(0,4.,size=image.shape)
+
+    return np.clip(noisy,0,255).astype(np.uint8)
@@ -0,0 +1,72 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Benchmarks for CAD model loading and cell locator construction.
+"""
+
+from calcam import CADModel
+
+from . import _scene
+
+
+class CADModelLoad:
+
+    params = _scene.model_sizes
+    param_names = ['n_triangles']
+    timeout = 300
+
+    def setup_cache(self):
+        return _scene.write_scene(_scene.model_sizes)
+
+    def time_load(self,scene,n_triangles):
+        CADModel(scene['cadmodels'][n_triangles],status_callback=None)
+
+    def peakmem_load(self,scene,n_triangles):
+        CADModel(scene['cadmodels'][n_triangles],status_callback=None)
+
+
+
+class CADModelOctree:
+
+    params = _scene.model_sizes
+    param_names = ['n_triangles']
+    timeout = 300
+
+    def setup_cache(self):
+        return _scene.write_scene(_scene.model_sizes)
+
+    def setup(self,scene,n_triangles):
+        # Building the locator once up-front means the meshes are already
+        # loaded, so only the locator construction itself is timed.
+        self.cadmodel = CADModel(scene['cadmodels'][n_triangles],status_callback=None)
+        self.cadmodel.build_octree()
+
+    def teardown(self,scene,n_triangles):
+        self.cadmodel.unload()
+
+    def time_build_octree(self,scene,n_triangles):
+        self.cadmodel.cell_locator = None
+        self.cadmodel.build_octree()
+
+    def peakmem_build_octree(self,scene,n_triangles):
+        self.cadmodel.cell_locator = None
+        self.cadmodel.build_octree()
@@ -0,0 +1,56 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Benchmarks for calibration sight-line and projection calculations.
+"""
+
+import numpy as np
+
+from . import _scene
+
+
+class CalibrationGeometry:
+
+    params = ['display','original']
+    param_names = ['coords']
+
+    def setup(self,coords):
+        self.calibration = _scene.make_calibration()
+
+        # Random points inside the synthetic vessel
+        rng = np.random.RandomState(0)
+        r = rng.uniform(0.6,1.4,size=100000)
+        phi = rng.uniform(0,2*np.pi,size=r.size)
+        z = rng.uniform(-0.6,0.6,size=r.size)
+        self.points = np.stack([r*np.cos(phi),r*np.sin(phi),z],axis=1)
+
+    def time_get_los_direction(self,coords):
+        self.calibration.get_los_direction(coords=coords)
+
+    def peakmem_get_los_direction(self,coords):
+        self.calibration.get_los_direction(coords=coords)
+
+    def time_project_points(self,coords):
+        self.calibration.project_points(self.points,coords=coords)
+
+    def peakmem_project_points(self,coords):
+        self.calibration.project_points(self.points,coords=coords)
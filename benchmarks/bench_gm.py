@@ -0,0 +1,123 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Benchmarks for the geometry matrix and reconstruction grid tools.
+"""
+
+import os
+
+import numpy as np
+
+from calcam import CADModel, Calibration, RayData, raycast_sightlines
+from calcam.gm import GeometryMatrix
+from calcam.synthetic import make_grid
+
+from . import _scene
+
+
+# Ray cast the synthetic scene and save the result for use by the benchmarks.
+# Building geometry matrices is slow, so by default the image is heavily binned.
+def _write_raydata(binning=8):
+
+    scene = _scene.write_scene()
+
+    cadmodel = CADModel(scene['cadmodel'],status_callback=None)
+    raydata = raycast_sightlines(Calibration(scene['calibration']),cadmodel,binning=binning,verbose=False,use_cache=False)
+    cadmodel.unload()
+
+    scene['raydata'] = os.path.abspath('bench_raydata.nc')
+    raydata.save(scene['raydata'])
+
+    return scene
+
+
+
+class GeometryMatrixBuild:
+
+    params = [200,800]
+    param_names = ['n_cells']
+    timeout = 600
+
+    def setup_cache(self):
+        return _write_raydata()
+
+    def setup(self,scene,n_cells):
+        self.grid = make_grid(n_cells)
+        self.raydata = RayData(scene['raydata'])
+
+    def time_build(self,scene,n_cells):
+        GeometryMatrix(self.grid,self.raydata,calc_status_callback=None)
+
+    def peakmem_build(self,scene,n_cells):
+        GeometryMatrix(self.grid,self.raydata,calc_status_callback=None)
+
+
+
+class GeometryMatrixBinning:
+
+    params = [2,4]
+    param_names = ['binning_factor']
+    timeout = 600
+
+    # The binning can only be increased, so each timing
+    # needs a freshly loaded matrix from setup().
+    number = 1
+    repeat = (5,10,60.)
+    warmup_time = 0.
+
+    def setup_cache(self):
+        scene = _write_raydata(binning=4)
+
+        scene['gm'] = os.path.abspath('bench_gm.npz')
+        GeometryMatrix(make_grid(200),RayData(scene['raydata']),calc_status_callback=None).save(scene['gm'])
+
+        return scene
+
+    def setup(self,scene,binning_factor):
+        self.gm = GeometryMatrix.fromfile(scene['gm'])
+
+    def time_set_binning(self,scene,binning_factor):
+        self.gm.set_binning(self.gm.binning * binning_factor)
+
+    def peakmem_set_binning(self,scene,binning_factor):
+        self.gm.set_binning(self.gm.binning * binning_factor)
+
+
+
+class GridInterpolate:
+
+    params = [200,800]
+    param_names = ['n_cells']
+
+    def setup(self,n_cells):
+        self.grid = make_grid(n_cells)
+
+        rng = np.random.RandomState(0)
+        self.data = rng.uniform(size=self.grid.n_cells)
+        self.r = rng.uniform(0.4,1.6,size=20000)
+        self.z = rng.uniform(-0.9,0.9,size=self.r.size)
+
+    def time_interpolate(self,n_cells):
+        self.grid.interpolate(self.data,self.r,self.z)
+
+    def peakmem_interpolate(self,n_cells):
+        self.grid.interpolate(self.data,self.r,self.z)
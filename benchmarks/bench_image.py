@@ -0,0 +1,72 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Benchmarks for image enhancement and camera movement detection.
+"""
+
+from calcam import image_enhancement
+from calcam.movement import detect_movement
+
+from . import _scene
+
+
+class EnhanceImage:
+
+    params = [False,True]
+    param_names = ['fast']
+
+    def setup(self,fast):
+        self.image = _scene.make_image()
+        # Results are cached by image content, which would
+        # otherwise make all but the first call a no-op.
+        self.cache_size = image_enhancement.cache_size
+        image_enhancement.cache_size = 0
+
+    def teardown(self,fast):
+        image_enhancement.cache_size = self.cache_size
+
+    def time_enhance_image(self,fast):
+        image_enhancement.enhance_image(self.image,fast=fast)
+
+    def peakmem_enhance_image(self,fast):
+        image_enhancement.enhance_image(self.image,fast=fast)
+
+
+
+class DetectMovement:
+
+    timeout = 300
+
+    def setup(self):
+        self.ref = _scene.make_image()
+        self.moved = _scene.make_image(shift=(7.5,-4.))
+        self.cache_size = image_enhancement.cache_size
+        image_enhancement.cache_size = 0
+
+    def teardown(self):
+        image_enhancement.cache_size = self.cache_size
+
+    def time_detect_movement(self):
+        detect_movement(self.ref,self.moved)
+
+    def peakmem_detect_movement(self):
+        detect_movement(self.ref,self.moved)
@@ -0,0 +1,61 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+
+"""
+Benchmarks for the time taken to import calcam.
+"""
+
+import sys
+import json
+import subprocess
+
+
+# Heavy packages which "import calcam" should not load by itself.
+heavy_modules = ['vtk','PyQt5','PyQt6','PyQt4','matplotlib','scipy','cv2','h5py','triangle']
+
+# Limit on how long "import calcam" should take in a fresh interpreter, in seconds.
+import_time_budget = 0.5
+
+
+class Import:
+
+    # Import time, measured by asv in a fresh interpreter each time.
+    def timeraw_import_calcam(self):
+        return 'import calcam'
+
+    # Number of heavy packages loaded by "import calcam", which should be 0.
+    def track_heavy_modules_imported(self):
+        code = 'import sys, json, calcam; print(json.dumps([name for name in {:} if name in sys.modules]))'.format(repr(heavy_modules))
+        return len(json.loads(subprocess.check_output([sys.executable,'-c',code])))
+
+    track_heavy_modules_imported.unit = 'modules'
+
+    # Time for "import calcam" in a fresh interpreter. This fails if it is over the
+    # budget, so regressions show up as a failed benchmark rather than only a slower one.
+    def track_import_time(self):
+        code = 'import time; t = time.perf_counter(); import calcam; print(time.perf_counter() - t)'
+        import_time = float(subprocess.check_output([sys.executable,'-c',code]))
+        if import_time > import_time_budget:
+            raise AssertionError('import calcam took {:.2f} s, more than the budget of {:.2f} s.'.format(import_time,import_time_budget))
+        return import_time
+
+    track_import_time.unit = 'seconds'
@@ -0,0 +1,52 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Benchmarks for ray casting camera sight-lines.
+"""
+
+from calcam import CADModel, Calibration, raycast_sightlines
+
+from . import _scene
+
+
+class RaycastSightlines:
+
+    params = [4,2,1]
+    param_names = ['binning']
+    timeout = 600
+
+    def setup_cache(self):
+        return _scene.write_scene()
+
+    def setup(self,scene,binning):
+        self.cadmodel = CADModel(scene['cadmodel'],status_callback=None)
+        self.cadmodel.build_octree()
+        self.calibration = Calibration(scene['calibration'])
+
+    def teardown(self,scene,binning):
+        self.cadmodel.unload()
+
+    def time_raycast_sightlines(self,scene,binning):
+        raycast_sightlines(self.calibration,self.cadmodel,binning=binning,verbose=False,use_cache=False)
+
+    def peakmem_raycast_sightlines(self,scene,binning):
+        raycast_sightlines(self.calibration,self.cadmodel,binning=binning,verbose=False,use_cache=False)
@@ -0,0 +1,51 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Benchmarks for rendering camera views of CAD models.
+"""
+
+from calcam import CADModel, Calibration, render_cam_view
+
+from . import _scene
+
+
+class RenderCamView:
+
+    params = [1,2]
+    param_names = ['oversampling']
+    timeout = 300
+
+    def setup_cache(self):
+        return _scene.write_scene()
+
+    def setup(self,scene,oversampling):
+        self.cadmodel = CADModel(scene['cadmodel'],status_callback=None)
+        self.calibration = Calibration(scene['calibration'])
+
+    def teardown(self,scene,oversampling):
+        self.cadmodel.unload()
+
+    def time_render_cam_view(self,scene,oversampling):
+        render_cam_view(self.cadmodel,self.calibration,oversampling=oversampling,verbose=False)
+
+    def peakmem_render_cam_view(self,scene,oversampling):
+        render_cam_view(self.cadmodel,self.calibration,oversampling=oversampling,verbose=False)
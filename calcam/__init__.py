@@ -24,56 +24,102 @@ CalCam package.
 """
 import os
 import sys
-import warnings
+import types
+import importlib
+import importlib.util
 
 # Calcam version
 with open(os.path.join(os.path.split(os.path.abspath(__file__))[0],'__version__'),'r') as ver_file:
     __version__ = ver_file.readline().rstrip()
 
+# To keep "import calcam" fast, the submodules and the top level "public facing" classes & functions are only imported
+# when they are first used, so e.g. VTK, Qt, matplotlib or SciPy are only loaded if something which needs them is used.
 # Calcam supports a "headless" mode which does not require VTK / PyQt. This way it can still be used for analysis
 # using calibration or raydata objects even if the GUI libraries are not available.
-no_gui_reason = None
 
-try:
-    import vtk
-    vtk.vtkObject.GlobalWarningDisplayOff()
+# Top level classes & functions, and which submodule they come from.
+_lazy_attributes = {
+                    'Calibration':'calibration',
+                    'PointPairs':'pointpairs',
+                    'RayData':'raycast',
+                    'raycast_sightlines':'raycast',
+                    'CADModel':'cadmodel',
+                    'render_cam_view':'render',
+                    'render_cam_views':'render',
+                    'render_unfolded_wall':'render',
+                    }
+
+# Submodules which can be accessed as attributes of the calcam module.
+_lazy_submodules = ['cadmodel','calibration','config','coordtransformer','gm','gui','image_enhancement','io','misc','movement','pointpairs','raycast','render','synthetic']
+
+# Names imported by "from calcam import *". Things from submodules which need VTK are only
+# included if VTK is installed, so that this still works in headless mode.
+__all__ = sorted([name for name,module in _lazy_attributes.items() if module not in ['cadmodel','render'] or importlib.util.find_spec('vtk') is not None]) + ['config','gm','movement','start_gui']
+
+
+# Check whether the GUI can be used, and if not return a string saying why not.
+def _get_no_gui_reason():
 
     try:
-        from . import gui
-        from .gui import start_gui
+        importlib.import_module('vtk')
+    except Exception as e:
+        return 'Cannot import VTK python package (error: {:})'.format(e)
 
+    try:
+        importlib.import_module('.gui',__name__)
     except Exception as e:
-        warnings.warn('Error importing GUI modules (error: {:}) - the calcam.gui module will not be available.'.format(e),ImportWarning)
-        no_gui_reason = str(e)
+        return str(e)
 
-    from .cadmodel import CADModel
-    from .raycast import raycast_sightlines
-    from .render import render_cam_view,render_unfolded_wall
+    return None
 
-except Exception as e:
-    warnings.warn('Cannot import VTK python package (error: {:}) - the calcam.gui, calcam.raycast, calcam.render and calcam.cadmodel modules will not be available.'.format(e),ImportWarning)
-    no_gui_reason = 'Cannot import VTK python package (error: {:})'.format(e)
 
-# Import the top level "public facing" classes & functions
-# which do not rely on VTK.
-from .calibration import Calibration
-from . import movement
-from .raycast import RayData
-from .pointpairs import PointPairs
+# Get the function to start the GUI. If we have no GUI available, this is a placeholder function to print
+# a message about why where the GUI launcher would normally be.
+def _get_start_gui():
 
-from . import config
-from . import gm
+    reason = _get_no_gui_reason()
 
-# If we have no GUI available, put a placeholder function to print a message about why where the GUI launcher would normally be.
-if no_gui_reason is not None:
+    if reason is None:
+        return importlib.import_module('.gui',__name__).start_gui
 
-    start_gui = lambda: print('Could not start calcam GUI: {:s}'.format(no_gui_reason))
+    start_gui = lambda: print('Could not start calcam GUI: {:s}'.format(reason))
 
     # If we're running under pythonw, that print statement won't do anything, so try to make a simple tkinter dialog box to tell the user about the error.
     if 'pythonw' in os.path.split(sys.executable)[-1]:
         try:
             from tkinter import messagebox
-            start_gui = lambda: messagebox.showerror(title='Cannot start Calcam GUI',message='Cannot start Calcam GUI: {:s}'.format(no_gui_reason))
+            start_gui = lambda: messagebox.showerror(title='Cannot start Calcam GUI',message='Cannot start Calcam GUI: {:s}'.format(reason))
         except Exception as e:
             pass
 
+    return start_gui
+
+
+class _CalcamModule(types.ModuleType):
+    """
+    Module class for the calcam package which imports things when they are first accessed.
+    """
+    def __getattr__(self,name):
+
+        if name in _lazy_attributes:
+            value = getattr(importlib.import_module('.' + _lazy_attributes[name],__name__),name)
+        elif name in _lazy_submodules:
+            value = importlib.import_module('.' + name,__name__)
+        elif name == 'no_gui_reason':
+            value = _get_no_gui_reason()
+        elif name == 'start_gui':
+            value = _get_start_gui()
+        else:
+            raise AttributeError("module '{:s}' has no attribute '{:s}'".format(__name__,name))
+
+        setattr(self,name,value)
+
+        return value
+
+
+    def __dir__(self):
+
+        return sorted(set(super().__dir__()) | set(_lazy_attributes) | set(_lazy_submodules) | {'no_gui_reason','start_gui'})
+
+
+sys.modules[__name__].__class__ = _CalcamModule
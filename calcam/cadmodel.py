@@ -25,9 +25,27 @@ import numpy as np
 import json
 import os
 import atexit
-from .config import CalcamConfig
+import hashlib
+import collections
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk, numpy_to_vtkIdTypeArray, ID_TYPE_CODE
+from .config import CalcamConfig, get_cache_dir
 from .io import ZipSaveFile
+from .misc import record_timing
 
+vtk.vtkObject.GlobalWarningDisplayOff()
+
+
+# Settings used to detect feature edges of the meshes. If changing these,
+# change the version number to invalidate any cached edges.
+edge_settings = {'feature_angle':20,'version':1}
+
+# Settings for making reduced detail versions of meshes for smoother interactive display.
+# Meshes with more than min_triangles triangles have their number of triangles reduced
+# by the fraction given by reduction. Again, change the version to invalidate cached meshes.
+lod_settings = {'min_triangles':50000,'reduction':0.9,'version':1}
+
+# Number of the most recent timing records kept in CADModel.timings
+timings_length = 100
 
 
 # A little function to use for status printing if no
@@ -185,9 +203,19 @@ class CADModel():
         self.renderers = []
         self.flat_shading = False
         self.edges = False
+        self.low_detail = False
         self.cell_locator = None
+        self.locator_features = []
+        self.cell_features = None
+
+        # Cell locator and OBB tree made from it for intersect_with_lines() with VTK < 9.2
+        self.line_locator = (None,None)
         self.discard_changes = False
 
+        # Timing records for slow operations, e.g. loading meshes and building the cell locator.
+        # Only the most recent records are kept, so this doesn't grow forever in long running programs.
+        self.timings = collections.deque(maxlen=timings_length)
+
         self.set_status_callback(status_callback)
         atexit.register(self.unload)
 
@@ -586,35 +614,49 @@ class CADModel():
 
             appender = vtk.vtkAppendPolyData()
 
-            for fname in self.get_enabled_features():
-                appender.AddInputData(self.features[fname].get_polydata())
+            # Each cell of the combined geometry is labelled with the index of the
+            # feature it came from, so we can tell which feature a line intersects.
+            self.locator_features = self.get_enabled_features()
+            for feature_index,fname in enumerate(self.locator_features):
+                polydata = vtk.vtkPolyData()
+                polydata.ShallowCopy(self.features[fname].get_polydata())
+                cell_features = numpy_to_vtk(np.full(polydata.GetNumberOfCells(),feature_index,dtype=np.int32),deep=True)
+                cell_features.SetName('FeatureIndex')
+                polydata.GetCellData().AddArray(cell_features)
+                appender.AddInputData(polydata)
 
             appender.Update()
-            if vtk.vtkVersion().GetVTKMajorVersion() > 8:
-                self.cell_locator = vtk.vtkStaticCellLocator()
-            else:
-                self.cell_locator = vtk.vtkCellLocator()
 
-            self.cell_locator.SetTolerance(1e-6)
-            self.cell_locator.SetDataSet(appender.GetOutput())
-            self.cell_locator.BuildLocator()
+            self.cell_features = vtk_to_numpy(appender.GetOutput().GetCellData().GetArray('FeatureIndex'))
+
+            with record_timing(self.timings,'locator build',n_cells=appender.GetOutput().GetNumberOfCells()):
+                if vtk.vtkVersion().GetVTKMajorVersion() > 8:
+                    self.cell_locator = vtk.vtkStaticCellLocator()
+                else:
+                    self.cell_locator = vtk.vtkCellLocator()
+
+                self.cell_locator.SetTolerance(1e-6)
+                self.cell_locator.SetDataSet(appender.GetOutput())
+                self.cell_locator.BuildLocator()
 
             # Initialise some faffy input variables for c-like interface of cellLocator's IntersectWithLine()
             # Keep these as properties so we only have to bother once
             self.raycast_args = (vtk.mutable(0), np.zeros(3), np.zeros(3), vtk.mutable(0), vtk.mutable(0), vtk.vtkGenericCell())
 
 
-    def intersect_with_line(self,line_start,line_end,surface_normal=False):
+    def intersect_with_line(self,line_start,line_end,surface_normal=False,feature=False):
         """
         Find the first intersection of a straight line segment with the CAD geometry, if one
         occurs ("first" meaning first when moving from the start to the end of the line segment).
-        Optionally also calculates the surface normal vector of the CAD model at the intersection point.
+        Optionally also calculates the surface normal vector of the CAD model at the intersection point,
+        and identifies which feature of the model is intersected.
 
         Parameters:
 
             line_start (sequence) : 3-element sequence x,y,z of the line segment start coordinates (in metres)
             line_end   (sequence) : 3-element sequence x,y,z of the line segment end coordinates (in metres)
             surface_normal (bool) : Whether or not to calculate the surface normal vector of the CAD model at the intersection.
+            feature (bool)        : Whether or not to return the name of the CAD model feature at the intersection.
 
         Returns:
 
@@ -624,6 +666,8 @@ class CADModel():
                                       no intersection, `line_end` is returned.
                 - np.array or None  : Only returned if surface_normal = True; the surface normal at the intersection. \
                                       If there is no intersection, returns `None`.
+                - str or None       : Only returned if feature = True; the name of the feature intersected. \
+                                      If there is no intersection, returns `None`.
 
         """
 
@@ -632,6 +676,7 @@ class CADModel():
             intersects = False
             position = line_end
             n = None
+            feature_name = None
 
         else:
             # Make sure we have an octree
@@ -643,6 +688,7 @@ class CADModel():
             if abs(result) > 0:
                 intersects = True
                 position = self.raycast_args[1].copy()
+                feature_name = self.locator_features[self.cell_features[self.raycast_args[4].get()]]
                 if surface_normal:
                     v0 = np.array(self.raycast_args[5].GetPoints().GetPoint(2)) - np.array(self.raycast_args[5].GetPoints().GetPoint(0))
                     v1 = np.array(self.raycast_args[5].GetPoints().GetPoint(2)) - np.array(self.raycast_args[5].GetPoints().GetPoint(1))
@@ -654,11 +700,139 @@ class CADModel():
                 intersects = False
                 position = line_end
                 n = None
+                feature_name = None
 
+        ret_vals = [intersects,position]
         if surface_normal:
-            return intersects,position,n
+            ret_vals.append(n)
+        if feature:
+            ret_vals.append(feature_name)
+
+        return tuple(ret_vals)
+
+
+
+    def intersect_with_lines(self,line_starts,line_ends,max_hits=None,surface_normals=False):
+        """
+        Find all the intersections of a set of straight line segments with the CAD geometry,
+        or the first few intersections along each line segment. Unlike intersect_with_line(),
+        this finds surfaces behind the first one hit, e.g. for finding the thickness of
+        parts of the model, or which surfaces a sight-line would hit if some features were ignored,
+        using a single pass through the geometry for each line segment.
+
+        Parameters:
+
+            line_starts (array)    : Nx3 array of x,y,z line segment start coordinates (in metres)
+            line_ends (array)      : Nx3 array of x,y,z line segment end coordinates (in metres)
+            max_hits (int)         : Maximum number of intersections to return for each line segment. \
+                                     If not given, all intersections are returned.
+            surface_normals (bool) : Whether or not to calculate the surface normal vectors of the CAD model \
+                                     at the intersections.
+
+        Returns:
+
+            Multiple return values:
+                - np.array          : N element array of the number of intersections found for each line segment.
+                - np.array          : N x K x 3 array of the x,y,z positions of the intersections, ordered by distance \
+                                      from the line segment start, where K is max_hits or if not given the largest number \
+                                      of intersections of any line segment. Elements for which there is no intersection are NaN.
+                - np.array          : N x K array of the indices of the features intersected, in to the list of feature names \
+                                      returned by get_enabled_features(). Elements for which there is no intersection are -1.
+                - np.array          : Only returned if surface_normals = True; N x K x 3 array of the surface normals at the \
+                                      intersections, oriented towards the line segment start. Elements for which there is no \
+                                      intersection are NaN.
+
+        """
+        line_starts = np.reshape(np.asarray(line_starts,dtype=np.float64),(-1,3))
+        line_ends = np.reshape(np.asarray(line_ends,dtype=np.float64),(-1,3))
+        if line_starts.shape != line_ends.shape:
+            raise ValueError('The same number of line start and end coordinates must be given!')
+
+        n_lines = line_starts.shape[0]
+
+        # Intersections as lists of (distance, cell ID, position) tuples for each line
+        hits = [[] for _ in range(n_lines)]
+
+        if len(self.get_enabled_features()) > 0:
+
+            self.build_octree()
+
+            points = vtk.vtkPoints()
+            points.SetDataTypeToDouble()
+            cell_ids = vtk.vtkIdList()
+            cell = vtk.vtkGenericCell()
+
+            # Finding all intersections along a line with the cell locators only arrived in VTK 9.2,
+            # so with older versions a vtkOBBTree of the same geometry is used for this.
+            new_locator_api = (vtk.vtkVersion().GetVTKMajorVersion(),vtk.vtkVersion().GetVTKMinorVersion()) >= (9,2)
+            if new_locator_api:
+                locator = self.cell_locator
+            else:
+                if self.line_locator[0] is not self.cell_locator:
+                    line_locator = vtk.vtkOBBTree()
+                    line_locator.SetTolerance(1e-6)
+                    line_locator.SetDataSet(self.cell_locator.GetDataSet())
+                    line_locator.BuildLocator()
+                    self.line_locator = (self.cell_locator,line_locator)
+                locator = self.line_locator[1]
+
+            for line_ind in range(n_lines):
+
+                if not (np.isfinite(line_starts[line_ind]).all() and np.isfinite(line_ends[line_ind]).all()):
+                    continue
+
+                points.Reset()
+                cell_ids.Reset()
+                if new_locator_api:
+                    locator.IntersectWithLine(line_starts[line_ind],line_ends[line_ind],1.e-6,points,cell_ids,cell)
+                else:
+                    locator.IntersectWithLine(line_starts[line_ind],line_ends[line_ind],points,cell_ids)
+
+                if cell_ids.GetNumberOfIds() == 0:
+                    continue
+
+                positions = vtk_to_numpy(points.GetData()).reshape(-1,3)
+                distances = np.sqrt(np.sum((positions - line_starts[line_ind])**2,axis=1))
+                order = np.argsort(distances,kind='stable')
+
+                # Lines passing through a mesh edge or vertex intersect all the triangles sharing it at the
+                # same place. These count as a single surface crossing.
+                for ind in order:
+                    if len(hits[line_ind]) > 0 and distances[ind] - hits[line_ind][-1][0] < 1.e-6:
+                        continue
+                    hits[line_ind].append((distances[ind],cell_ids.GetId(ind),positions[ind].copy()))
+                    if max_hits is not None and len(hits[line_ind]) == max_hits:
+                        break
+
+        n_hits = np.array([len(line_hits) for line_hits in hits],dtype=int)
+
+        if max_hits is None:
+            max_hits = n_hits.max() if n_lines > 0 else 0
+
+        positions = np.full((n_lines,max_hits,3),np.nan)
+        features = np.full((n_lines,max_hits),-1,dtype=np.int16)
+        if surface_normals:
+            normals = np.full((n_lines,max_hits,3),np.nan)
+            polydata = self.cell_locator.GetDataSet() if self.cell_locator is not None else None
+
+        for line_ind,line_hits in enumerate(hits):
+            for hit_ind,(_,cell_id,position) in enumerate(line_hits):
+                positions[line_ind,hit_ind,:] = position
+                features[line_ind,hit_ind] = self.cell_features[cell_id]
+                if surface_normals:
+                    cell_points = polydata.GetCell(cell_id).GetPoints()
+                    v0 = np.array(cell_points.GetPoint(2)) - np.array(cell_points.GetPoint(0))
+                    v1 = np.array(cell_points.GetPoint(2)) - np.array(cell_points.GetPoint(1))
+                    n = np.cross(v0,v1)
+                    n = n / np.sqrt(np.sum(n**2))
+                    if np.dot(line_ends[line_ind] - line_starts[line_ind],n) > 0:
+                        n = -n
+                    normals[line_ind,hit_ind,:] = n
+
+        if surface_normals:
+            return n_hits,positions,features,normals
         else:
-            return intersects, position
+            return n_hits,positions,features
 
 
 
@@ -670,15 +844,93 @@ class CADModel():
 
             wireframe (bool) : Whether to render as wireframe.
         '''
-        enable_features = self.get_enabled_features()
+        if wireframe == self.edges:
+            return
+
+        # If the model isn't being displayed, the actors are made or updated
+        # when it is added to a renderer, so don't load any meshes now.
+        if len(self.renderers) == 0:
+            self.edges = wireframe
+            return
+
+        enabled_features = [self.features[fname] for fname in self.get_enabled_features()]
 
-        for feature in enable_features:
-            self.features[feature].set_enabled(False)
+        # Rather than re-building all the actors, just add or remove
+        # the edge actors and update the solid actor colours.
+        if not wireframe:
+            for feature in enabled_features:
+                if feature.edge_actor is not None:
+                    for renderer in self.renderers:
+                        renderer.RemoveActor(feature.edge_actor)
 
         self.edges = wireframe
 
-        for feature in enable_features:
-            self.features[feature].set_enabled(True)
+        for feature in enabled_features:
+            feature.get_vtk_actors()
+            if wireframe:
+                for renderer in self.renderers:
+                    renderer.AddActor(feature.edge_actor)
+
+
+
+    def set_low_detail(self,low_detail):
+        '''
+        Switch between displaying the full resolution meshes and reduced detail
+        versions of them, e.g. for smoother interaction while moving around a large model.
+        Reduced detail meshes are only shown for features where they have already been
+        made with build_low_detail_meshes(); other features are always shown in full detail.
+        Ray casting always uses the full resolution meshes.
+
+        Parameters:
+
+            low_detail (bool) : Whether to display reduced detail meshes.
+        '''
+        if low_detail == self.low_detail:
+            return
+
+        self.low_detail = low_detail
+
+        # As for set_wireframe(), the actors only need updating if the model is being displayed.
+        if len(self.renderers) == 0:
+            return
+
+        for fname in self.get_enabled_features():
+
+            feature = self.features[fname]
+            had_lod_actor = feature.lod_actor is not None
+
+            # This will make reduced detail actors where needed and
+            # show or hide the full and reduced detail actors.
+            feature.get_vtk_actors()
+
+            if feature.lod_actor is not None and not had_lod_actor:
+                for renderer in self.renderers:
+                    renderer.AddActor(feature.lod_actor)
+
+
+
+    def build_low_detail_meshes(self,cancel=lambda : False):
+        '''
+        Make reduced detail versions of the meshes of all enabled features,
+        for display with set_low_detail(). The reduced meshes are kept in the user's
+        calcam cache directory, so this only needs to be done once per mesh file,
+        but can be slow for large meshes.
+
+        Parameters:
+
+            cancel (callable) : Function which returns True if the operation should stop early.
+        '''
+        for fname in self.get_enabled_features():
+
+            if cancel():
+                break
+
+            # Don't bother loading anything for meshes which are already done.
+            cache_file = self.features[fname].get_lod_cache_filename()
+            if cache_file is not None and os.path.isfile(cache_file):
+                continue
+
+            self.features[fname].get_lod_polydata()
 
 
 
@@ -888,8 +1140,12 @@ class ModelFeature():
             self.coord_handedness = 'right'
 
         self.polydata = None
+        self.edge_polydata = None
+        self.lod_polydata = None
+        self.mesh_id = None
         self.solid_actor = None
         self.edge_actor = None
+        self.lod_actor = None
 
         self.default_colour = definition_dict['colour']
         self.colour = self.default_colour
@@ -906,66 +1162,205 @@ class ModelFeature():
             if self.parent.status_callback is not None:
                 self.parent.status_callback('Loading mesh file: {:s}...'.format(os.path.split(self.filename)[1]))
 
-            if self.filetype == 'stl':
-                reader = vtk.vtkSTLReader()
-            elif self.filetype == 'obj':
-                reader = vtk.vtkOBJReader()
+            with record_timing(self.parent.timings,'load',filename=self.filename):
+
+                if self.filetype == 'stl':
+                    reader = vtk.vtkSTLReader()
+                elif self.filetype == 'obj':
+                    reader = vtk.vtkOBJReader()
+
+                reader.SetFileName(self.filename)
+                reader.Update()
+
+                transformer = vtk.vtkTransformPolyDataFilter()
+
+                transform = vtk.vtkTransform()
+                transform.PostMultiply()
+
+                if self.coord_handedness == 'left':
+                    transform.Scale(self.scale,self.scale,-self.scale)
+                elif self.coord_handedness == 'right':
+                    transform.Scale(self.scale, self.scale, self.scale)
+
+                if self.mesh_up == '+X':
+                    transform.RotateY(-90)
+                elif self.mesh_up == '-X':
+                    transform.RotateY(90)
+                elif self.mesh_up == '+Y':
+                    transform.RotateX(90)
+                elif self.mesh_up == '-Y':
+                    transform.RotateX(-90)
+                elif self.mesh_up == '-Z' and self.coord_handedness == 'right':
+                    transform.RotateX(180)
+                elif self.mesh_up == '+Z' and self.coord_handedness == 'left':
+                    transform.RotateX(180)
+
+                transform.RotateZ(self.toroidal_rotation)
+                transformer.SetInputData(reader.GetOutput())
+                transformer.SetTransform(transform)
+                transformer.Update()
+
+                if self.coord_handedness == 'left':
+                    reverser = vtk.vtkReverseSense()
+                    reverser.ReverseNormalsOff()
+                    reverser.ReverseCellsOn()
+                    reverser.SetInputData(transformer.GetOutput())
+                    reverser.Update()
+                    self.polydata = reverser.GetOutput()
+                    transformer.SetInputData(reverser.GetOutput())
+                elif self.coord_handedness == 'right':
+                    self.polydata = transformer.GetOutput()
+
+            # Remove all the lines from the PolyData. As far as I can tell for "normal" mesh files this shouldn't
+            # remove anything visually important, but it avoids running in to issues with vtkFeatureEdges trying to allocate
+            # way too much memory in VTK 9.1+.
+            self.polydata.SetLines(vtk.vtkCellArray())
 
-            reader.SetFileName(self.filename)
-            reader.Update()
+            if self.parent.status_callback is not None:
+                self.parent.status_callback(None)
 
-            transformer = vtk.vtkTransformPolyDataFilter()
+        return self.polydata
 
-            transform = vtk.vtkTransform()
-            transform.PostMultiply()
 
-            if self.coord_handedness == 'left':
-                transform.Scale(self.scale,self.scale,-self.scale)
-            elif self.coord_handedness == 'right':
-                transform.Scale(self.scale, self.scale, self.scale)
+    # Get a string which uniquely identifies the mesh geometry of this
+    # feature, for looking up cached data derived from the mesh.
+    def get_mesh_id(self):
 
-            if self.mesh_up == '+X':
-                transform.RotateY(-90)
-            elif self.mesh_up == '-X':
-                transform.RotateY(90)
-            elif self.mesh_up == '+Y':
-                transform.RotateX(90)
-            elif self.mesh_up == '-Y':
-                transform.RotateX(-90)
-            elif self.mesh_up == '-Z' and self.coord_handedness == 'right':
-                transform.RotateX(180)
-            elif self.mesh_up == '+Z' and self.coord_handedness == 'left':
-                transform.RotateX(180)
+        if self.mesh_id is not None:
+            return self.mesh_id
 
-            transform.RotateZ(self.toroidal_rotation)
-            transformer.SetInputData(reader.GetOutput())
-            transformer.SetTransform(transform)
-            transformer.Update()
+        mesh_hash = None
 
-            if self.coord_handedness == 'left':
-                reverser = vtk.vtkReverseSense()
-                reverser.ReverseNormalsOff()
-                reverser.ReverseCellsOn()
-                reverser.SetInputData(transformer.GetOutput())
-                reverser.Update()
-                self.polydata = reverser.GetOutput()
-                transformer.SetInputData(reverser.GetOutput())
-            elif self.coord_handedness == 'right':
-                self.polydata = transformer.GetOutput()
+        # For meshes inside the model definition file, use the MD5 hash of their contents.
+        # For anything else, use the file path, size and modification time.
+        if self.parent.def_file is not None:
+            relpath = os.path.relpath(self.filename,self.parent.def_file.get_temp_path())
+            mesh_hash = self.parent.def_file.get_initial_hash(relpath)
 
+        if mesh_hash is None:
+            stat = os.stat(self.filename)
+            mesh_id = '{:s} {:d} {:d}'.format(os.path.abspath(self.filename),stat.st_size,int(stat.st_mtime*1e6))
+        else:
+            mesh_id = mesh_hash.hex()
 
+        self.mesh_id = '{:s} {:} {:s} {:} {:s}'.format(mesh_id,self.scale,self.mesh_up,self.toroidal_rotation,self.coord_handedness)
 
+        return self.mesh_id
 
 
-            # Remove all the lines from the PolyData. As far as I can tell for "normal" mesh files this shouldn't
-            # remove anything visually important, but it avoids running in to issues with vtkFeatureEdges trying to allocate
-            # way too much memory in VTK 9.1+.
-            self.polydata.SetLines(vtk.vtkCellArray())
+    # Get a vtkPolyData containing the feature edges of the mesh,
+    # i.e. the lines drawn when rendering as wireframe.
+    # Since detecting the edges is slow for large meshes, the results are
+    # kept in the user's calcam cache directory (see calcam.config) as a
+    # list of points and line segments.
+    def get_edges(self):
 
-            if self.parent.status_callback is not None:
-                self.parent.status_callback(None)
+        if not self.enabled:
+            return None
 
-        return self.polydata
+        if self.edge_polydata is None:
+
+            cache_file = get_cache_filename('feature_edges','{:s} {:s}'.format(self.get_mesh_id(),json.dumps(edge_settings,sort_keys=True)))
+
+            if cache_file is not None and os.path.isfile(cache_file):
+                try:
+                    with np.load(cache_file) as edge_data:
+                        self.edge_polydata = lines_to_polydata(edge_data['points'],edge_data['lines'])
+                except Exception:
+                    self.edge_polydata = None
+
+            if self.edge_polydata is None:
+
+                if self.parent.status_callback is not None:
+                    self.parent.status_callback('Detecting mesh edges...')
+
+                edge_finder = vtk.vtkFeatureEdges()
+
+                edge_finder.SetInputData( self.get_polydata() )
+
+                edge_finder.ManifoldEdgesOff()
+                edge_finder.BoundaryEdgesOff()
+                edge_finder.NonManifoldEdgesOff()
+                edge_finder.SetFeatureAngle(edge_settings['feature_angle'])
+                edge_finder.ColoringOff()
+                edge_finder.Update()
+
+                self.edge_polydata = edge_finder.GetOutput()
+
+                if cache_file is not None:
+                    points,lines = polydata_to_lines(self.edge_polydata)
+                    save_cache_file(cache_file,points=points,lines=lines)
+
+                if self.parent.status_callback is not None:
+                    self.parent.status_callback(None)
+
+        return self.edge_polydata
+
+
+    # Get the filename where the reduced detail version of the mesh is cached
+    def get_lod_cache_filename(self):
+
+        return get_cache_filename('lod_meshes','{:s} {:s}'.format(self.get_mesh_id(),json.dumps(lod_settings,sort_keys=True)))
+
+
+    # Get a reduced detail version of the mesh for smoother interactive display.
+    # Small meshes are not reduced, in which case this returns the same as get_polydata().
+    # Like the feature edges, the reduced meshes are kept in the user's calcam cache.
+    # If compute is False, returns None if the reduced mesh has not already been made.
+    def get_lod_polydata(self,compute=True):
+
+        if not self.enabled:
+            return None
+
+        if self.lod_polydata is None:
+
+            cache_file = self.get_lod_cache_filename()
+
+            if cache_file is not None and os.path.isfile(cache_file):
+                try:
+                    with np.load(cache_file) as lod_data:
+                        if lod_data['full_detail']:
+                            self.lod_polydata = self.get_polydata()
+                        else:
+                            self.lod_polydata = triangles_to_polydata(lod_data['points'],lod_data['triangles'])
+                except Exception:
+                    self.lod_polydata = None
+
+            if self.lod_polydata is None and compute:
+
+                triangulator = vtk.vtkTriangleFilter()
+                triangulator.SetInputData(self.get_polydata())
+                triangulator.PassVertsOff()
+                triangulator.PassLinesOff()
+                triangulator.Update()
+
+                if triangulator.GetOutput().GetNumberOfCells() > lod_settings['min_triangles']:
+
+                    if self.parent.status_callback is not None:
+                        self.parent.status_callback('Making reduced detail mesh: {:s}...'.format(os.path.split(self.filename)[1]))
+
+                    decimator = vtk.vtkQuadricDecimation()
+                    decimator.SetInputData(triangulator.GetOutput())
+                    decimator.SetTargetReduction(lod_settings['reduction'])
+                    decimator.VolumePreservationOn()
+                    decimator.Update()
+
+                    if self.parent.status_callback is not None:
+                        self.parent.status_callback(None)
+
+                    if decimator.GetOutput().GetNumberOfCells() > 0:
+                        self.lod_polydata = decimator.GetOutput()
+
+                if self.lod_polydata is None:
+                    self.lod_polydata = self.get_polydata()
+                    if cache_file is not None:
+                        save_cache_file(cache_file,full_detail=True)
+
+                elif cache_file is not None:
+                    points,triangles = polydata_to_triangles(self.lod_polydata)
+                    save_cache_file(cache_file,full_detail=False,points=points,triangles=triangles)
+
+        return self.lod_polydata
 
 
     # Enable or disable the feature
@@ -1008,30 +1403,29 @@ class ModelFeature():
             # Make the edge actor if it doesn't already exist and is needed
             if self.parent.edges and self.edge_actor is None:
 
-                if self.parent.status_callback is not None:
-                    self.parent.status_callback('Detecting mesh edges...')
-
-                edge_finder = vtk.vtkFeatureEdges()
-
-                edge_finder.SetInputData( self.get_polydata() )
-
-                edge_finder.ManifoldEdgesOff()
-                edge_finder.BoundaryEdgesOff()
-                edge_finder.NonManifoldEdgesOff()
-                edge_finder.SetFeatureAngle(20)
-                edge_finder.ColoringOff()
-                edge_finder.Update()
-
                 mapper = vtk.vtkPolyDataMapper()
-                mapper.SetInputConnection(edge_finder.GetOutputPort())
+                mapper.SetInputData(self.get_edges())
 
                 self.edge_actor = vtk.vtkActor()
                 self.edge_actor.SetMapper(mapper)
                 
                 self.edge_actor.GetProperty().SetLineWidth(self.linewidth)
-            
-                if self.parent.status_callback is not None:
-                    self.parent.status_callback(None)
+
+            # If the model is showing reduced detail meshes, make the reduced detail
+            # actor if we have a reduced detail mesh ready. It shares the display
+            # properties of the full detail actor.
+            if self.parent.low_detail and self.lod_actor is None:
+
+                lod_polydata = self.get_lod_polydata(compute=False)
+
+                if lod_polydata is not None and lod_polydata is not self.polydata:
+
+                    mapper = vtk.vtkPolyDataMapper()
+                    mapper.SetInputData(lod_polydata)
+
+                    self.lod_actor = vtk.vtkActor()
+                    self.lod_actor.SetMapper(mapper)
+                    self.lod_actor.SetProperty(self.solid_actor.GetProperty())
 
             # Make sure the colour and lighing are set appropriately
             if self.parent.edges:
@@ -1043,11 +1437,17 @@ class ModelFeature():
                 if self.parent.flat_shading:
                    self.solid_actor.GetProperty().LightingOff()
 
-            
+            actors = [self.solid_actor]
+
             if self.parent.edges:
-                return [self.solid_actor,self.edge_actor]
-            else:
-                return [self.solid_actor]
+                actors.append(self.edge_actor)
+
+            if self.lod_actor is not None:
+                self.solid_actor.SetVisibility(not self.parent.low_detail)
+                self.lod_actor.SetVisibility(self.parent.low_detail)
+                actors.append(self.lod_actor)
+
+            return actors
 
 
     def set_linewidth(self,linewidth):
@@ -1065,4 +1465,115 @@ class ModelFeature():
                 self.edge_actor.GetProperty().SetColor(colour)
         else:
             if self.solid_actor is not None:
-                self.solid_actor.GetProperty().SetColor(colour)
\ No newline at end of file
+                self.solid_actor.GetProperty().SetColor(colour)
+
+
+
+# Get the points and line segments in a vtkPolyData as numpy arrays:
+# an Nx3 array of point coordinates and an Mx2 array of point indices.
+# Poly-lines are split in to individual segments.
+def polydata_to_lines(polydata):
+
+    if polydata.GetNumberOfPoints() == 0:
+        return np.zeros((0,3),dtype=np.float32),np.zeros((0,2),dtype=np.int32)
+
+    points = vtk_to_numpy(polydata.GetPoints().GetData())
+
+    cells = vtk_to_numpy(polydata.GetLines().GetData())
+
+    if np.all(cells[::3] == 2):
+        # Usual case: the lines are all individual segments
+        lines = cells.reshape(-1,3)[:,1:]
+    else:
+        lines = []
+        i = 0
+        while i < cells.size:
+            lines = lines + [cells[i+1+j:i+3+j] for j in range(cells[i]-1)]
+            i = i + cells[i] + 1
+        lines = np.array(lines).reshape(-1,2)
+
+    index_type = np.int32 if points.shape[0] < 2**31 else np.int64
+
+    return points.copy(),lines.astype(index_type)
+
+
+# Make a vtkPolyData from arrays of points and line segments
+# as returned by polydata_to_lines()
+def lines_to_polydata(points,lines):
+
+    polydata = vtk.vtkPolyData()
+
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(points),deep=True))
+    polydata.SetPoints(vtk_points)
+
+    cells = np.empty((lines.shape[0],3),dtype=ID_TYPE_CODE)
+    cells[:,0] = 2
+    cells[:,1:] = lines
+    vtk_cells = vtk.vtkCellArray()
+    vtk_cells.SetCells(lines.shape[0],numpy_to_vtkIdTypeArray(cells.ravel(),deep=True))
+    polydata.SetLines(vtk_cells)
+
+    return polydata
+
+
+# Get the filename to use for caching some data derived from a mesh, in the
+# given sub-directory of the user's calcam cache. The key is a string which
+# uniquely describes the cached data. Returns None if there is nowhere to cache.
+def get_cache_filename(cache_name,key):
+
+    cache_dir = get_cache_dir(cache_name)
+
+    if cache_dir is None:
+        return None
+    else:
+        return os.path.join(cache_dir,'{:s}.npz'.format(hashlib.md5(key.encode()).hexdigest()))
+
+
+# Save some numpy arrays to a cache file. The file is written under a temporary
+# name and then renamed, so that other processes never see a partly written file.
+# Failure to write the file is silently ignored, since it just means we will
+# need to calculate the cached data again next time.
+def save_cache_file(filename,**arrays):
+
+    temp_file = '{:s}.{:d}.tmp'.format(filename,os.getpid())
+    try:
+        with open(temp_file,'wb') as f:
+            np.savez(f,**arrays)
+        os.replace(temp_file,filename)
+    except Exception:
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+
+
+# Get the points and triangles in a vtkPolyData as numpy arrays: an Nx3
+# array of point coordinates and an Mx3 array of point indices. The polydata
+# must contain only triangles.
+def polydata_to_triangles(polydata):
+
+    points = vtk_to_numpy(polydata.GetPoints().GetData())
+    triangles = vtk_to_numpy(polydata.GetPolys().GetData()).reshape(-1,4)[:,1:]
+
+    index_type = np.int32 if points.shape[0] < 2**31 else np.int64
+
+    return points.copy(),triangles.astype(index_type)
+
+
+# Make a vtkPolyData from arrays of points and triangles
+# as returned by polydata_to_triangles()
+def triangles_to_polydata(points,triangles):
+
+    polydata = vtk.vtkPolyData()
+
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(points),deep=True))
+    polydata.SetPoints(vtk_points)
+
+    cells = np.empty((triangles.shape[0],4),dtype=ID_TYPE_CODE)
+    cells[:,0] = 3
+    cells[:,1:] = triangles
+    vtk_cells = vtk.vtkCellArray()
+    vtk_cells.SetCells(triangles.shape[0],numpy_to_vtkIdTypeArray(cells.ravel(),deep=True))
+    polydata.SetPolys(vtk_cells)
+
+    return polydata
@@ -22,12 +22,11 @@
 import numpy as np
 import cv2
 import os
+import io
 import json
 import copy
 import warnings
-
-from scipy.ndimage.measurements import center_of_mass as CoM
-from scipy.optimize import minimize
+import zipfile
 
 from .io import ZipSaveFile
 from .coordtransformer import CoordTransformer
@@ -36,6 +35,18 @@ from . import __version__ as calcam_version
 from . import misc
 from .raycast import raycast_sightlines, RayData
 
+
+# SciPy's ndimage and optimize modules are relatively slow to import and are
+# only needed by a few methods, so they are only imported when used.
+def CoM(*args,**kwargs):
+    import scipy.ndimage
+    return scipy.ndimage.center_of_mass(*args,**kwargs)
+
+def minimize(*args,**kwargs):
+    import scipy.optimize
+    return scipy.optimize.minimize(*args,**kwargs)
+
+
 try:
     cv2_version = cv2.__version__
 except AttributeError:
@@ -230,9 +241,8 @@ class RectilinearViewModel(ViewModel):
         y = np.reshape(y,np.size(y),order='F')
 
         input_points = np.zeros([x.size,1,2])
-        for point in range(len(x)):
-            input_points[point,0,0] = x[point]
-            input_points[point,0,1] = y[point]
+        input_points[:,0,0] = x
+        input_points[:,0,1] = y
 
         undistorted = cv2.undistortPoints(input_points,self.cam_matrix,self.kc)
 
@@ -338,9 +348,8 @@ class FisheyeeViewModel(ViewModel):
         y = np.reshape(y,np.size(y),order='F')
 
         input_points = np.zeros([x.size,1,2])
-        for point in range(len(x)):
-            input_points[point,0,0] = x[point]
-            input_points[point,0,1] = y[point]
+        input_points[:,0,0] = x
+        input_points[:,0,1] = y
 
         undistorted = cv2.fisheye.undistortPoints(input_points,self.cam_matrix,self.kc)
 
@@ -409,6 +418,7 @@ class Calibration():
         self.pointpairs = None
         self.cad_config = None
         self.subview_mask = None
+        self._display_mask_cache = None
         self.n_subviews = 1
         self.subview_names = ['Full Frame']
         self.view_models = [None]
@@ -708,117 +718,166 @@ class Calibration():
         self.filename = os.path.abspath(filename)
         self.name = os.path.split(filename)[-1].split('.')[0]
 
-        with ZipSaveFile(filename,'r') as save_file:
+        # The file contents are read straight from the zip file in memory, rather than using a ZipSaveFile
+        # which would extract everything to a temporary directory; this makes loading much faster.
+        if not os.path.isfile(filename):
+            raise IOError('No such file: {:s}'.format(filename))
+
+        try:
+            zip_file = zipfile.ZipFile(filename,'r')
+        except zipfile.BadZipFile:
+            raise IOError('"{:s}" does not appear to be a Calcam calibration file!'.format(filename))
+
+        with zip_file:
+            self._load_from_zip(zip_file)
+
+        self.readonly = not os.access(self.filename,os.W_OK)
+
+
+    # Load the calibration from an open zipfile.ZipFile object.
+    def _load_from_zip(self,zip_file):
+
+        contents = [name.replace('\\','/') for name in zip_file.namelist()]
+
+        def read_text(name):
+            return zip_file.read(name).decode('utf-8')
+
+        # Load the general information
+        try:
+            meta = json.loads(read_text('calibration.json'))
+        except KeyError:
+            raise IOError('"{:s}" does not appear to be a Calcam calibration file!'.format(self.filename))
 
-            # Load the general information
+        # Load the field mask and set up geometry object
+        subview_mask = _decode_png(zip_file.read('subview_mask.png'))[:,:,0].astype(np.int8)
+
+        if 'image_offset' not in meta:
+            meta['image_offset'] = (0,0)
+
+        self.geometry = CoordTransformer(transform_actions=meta['image_transform_actions'],paspect=meta['orig_paspect'],offset=meta['image_offset'])
+        self.geometry.set_image_shape(subview_mask.shape[1],subview_mask.shape[0],coords='Display')
+        self.subview_mask = self.geometry.display_to_original_image(subview_mask,interpolation='nearest')
+
+        # The image is only decoded if and when it is actually needed.
+        if 'image.png' in contents:
+            self._image_file_data = (zip_file.read('image.png'),copy.deepcopy(self.geometry))
+
+        self.n_subviews = meta['n_subviews']
+        self.history = meta['history']
+        self.subview_names = meta['subview_names']
+        self._type = meta['calib_type']
+        self.pixel_size = meta['pixel_size']
+
+        if self._type != 'fit':
+            self.intrinsics_type = meta['intrinsics_type']
+
+        # Load the primary point pairs
+        try:
+            self.pointpairs = PointPairs(io.StringIO(read_text('pointpairs.csv')))
+        except:
+            self.pointpairs = None
+
+        # Load fit results
+        self.view_models = []
+        for nview in range(self.n_subviews):
             try:
-                with save_file.open_file('calibration.json','r') as f:
-                    meta = json.load(f)
-            except IOError:
-                raise IOError('"{:s}" does not appear to be a Calcam calibration file!'.format(filename))
+                self.view_models.append(ViewModel.from_dict(json.loads(read_text('calib_params_{:d}.json'.format(nview)))))
+            except KeyError:
+                self.view_models.append(None)
 
-            # Load the field mask and set up geometry object
-            subview_mask = cv2.imread(os.path.join(save_file.get_temp_path(),'subview_mask.png'))[:,:,0].astype(np.int8)
+        # Load CAD config
+        if 'cad_config.json' in contents:
+            self.cad_config = json.loads(read_text('cad_config.json'))
 
-            if 'image_offset' not in meta:
-                meta['image_offset'] = (0,0)
+            # Bit of code required for calibrations created with Calcam 2.0.0-dev
+            #-----------------------------------------------------------------------
+            if type(self.cad_config['viewport']) is list:
+                self.cad_config['viewport'] = {'cam_x':self.cad_config['viewport'][0],'cam_y':self.cad_config['viewport'][1],'cam_z':self.cad_config['viewport'][2],'tar_x':self.cad_config['viewport'][3],'tar_y':self.cad_config['viewport'][4],'tar_z':self.cad_config['viewport'][5],'fov':self.cad_config['viewport'][6],'roll':0.}
 
-            self.geometry = CoordTransformer(transform_actions=meta['image_transform_actions'],paspect=meta['orig_paspect'],offset=meta['image_offset'])
-            self.geometry.set_image_shape(subview_mask.shape[1],subview_mask.shape[0],coords='Display')
-            self.subview_mask = self.geometry.display_to_original_image(subview_mask,interpolation='nearest')
-            
-            # Load the image. Note with the opencv imread function, it will silently return None if the image file does not exist.
-            image = cv2.imread(os.path.join(save_file.get_temp_path(),'image.png'))
+        # Load any intrinsics constraints
+        for i in range( len( [f for f in contents if f.startswith('intrinsics_constraints') and 'points_' in f] ) ):
+
+            im_name = 'intrinsics_constraints/im_{:03d}.png'.format(i)
+            if im_name in contents:
+                im = _decode_png(zip_file.read(im_name))
+            else:
+                im = None
+
+            if im is not None:
+                if len(im.shape) == 3:
+                    if im.shape[2] == 3:
+                        im[:,:,:3] = im[:,:,2::-1]
+
+            pp = PointPairs(io.StringIO(read_text('intrinsics_constraints/points_{:03d}.csv'.format(i))))
+
+            self.intrinsics_constraints.append([im,pp])
+
+        # Note: this is only needed for calibration created with Calcam 2.0.0-dev
+        # --------------------------------------------------------------------------
+        if 'intrinsics_constraints/intrinsics_calib.ccc' in contents:
+            intrinsics_calib = Calibration(cal_type='fit')
+            intrinsics_calib.filename = self.filename
+            with zipfile.ZipFile(io.BytesIO(zip_file.read('intrinsics_constraints/intrinsics_calib.ccc')),'r') as intrinsics_zip:
+                intrinsics_calib._load_from_zip(intrinsics_zip)
+            self.add_intrinsics_constraints( calibration = intrinsics_calib )
+
+        if type(self.history) is list:
+            old_history = self.history
+            self.history = {}
+            if  self._type != 'virtual':
+                self.history['image'] = None
+            if self._type != 'fit':
+                self.history['extrinsics'] = None
+                self.history['intrinsics'] = None
+            if self._type == 'fit':
+                self.history['pointpairs'] = [None,None]
+                self.history['intrinsics_constraints'] = []
+                self.history['fit'] = [None] * self.n_subviews
+
+            if self._type != 'fit':
+                self.intrisnics_type = None
+
+            for event in old_history:
+                if 'Image' in event[3]:
+                    self.history['image'] = event[3] + ' by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
+                elif 'Point pairs' in event[3]:
+                    if self.history['pointpairs'][0] is None:
+                        self.history['pointpairs'][0] = event[3] + ' by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
+                    else:
+                        self.history['pointpairs'][1] = self.history['pointpairs'][1] = 'Last modified by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
+                elif 'Fit' in event[3]:
+                    subview_ind = self.subview_names.index(event[3].split('for ')[1])
+                    self.history['fit'][subview_ind] = 'Modified by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
+
+
+    # The calibration image is a property so that when loading from a file,
+    # it is only decoded from the file data the first time it is used.
+    @property
+    def image(self):
+
+        if self._image_file_data is not None:
+
+            file_data,geometry = self._image_file_data
+            self._image_file_data = None
+
+            image = _decode_png(file_data)
             if image is not None:
                 if len(image.shape) == 3:
                     if image.shape[2] == 3:
                         image[:,:,:3] = image[:,:,2::-1]
-                
-                self.image = self.geometry.display_to_original_image(image,interpolation='cubic')        
-            
-            self.n_subviews = meta['n_subviews']
-            self.history = meta['history']
-            self.subview_names = meta['subview_names']
-            self._type = meta['calib_type']
-            self.pixel_size = meta['pixel_size']
-            
-            if self._type != 'fit':
-                self.intrinsics_type = meta['intrinsics_type']
 
-            # Load the primary point pairs
-            try:
-                with save_file.open_file('pointpairs.csv','r') as ppf:
-                    self.pointpairs = PointPairs(ppf)
-            except:
-                self.pointpairs = None
+                image = geometry.display_to_original_image(image,interpolation='cubic')
 
-            # Load fit results
-            self.view_models = []
-            for nview in range(self.n_subviews):
-                try:
-                    with save_file.open_file('calib_params_{:d}.json'.format(nview),'r') as f:
-                        self.view_models.append(ViewModel.from_dict(json.load(f)))
-                except IOError:
-                    self.view_models.append(None)
-                    
-            # Load CAD config
-            if 'cad_config.json' in save_file.list_contents():
-                with save_file.open_file('cad_config.json','r') as f:
-                    self.cad_config = json.load(f)
-
-                # Bit of code required for calibrations created with Calcam 2.0.0-dev
-                #-----------------------------------------------------------------------
-                if type(self.cad_config['viewport']) is list:
-                    self.cad_config['viewport'] = {'cam_x':self.cad_config['viewport'][0],'cam_y':self.cad_config['viewport'][1],'cam_z':self.cad_config['viewport'][2],'tar_x':self.cad_config['viewport'][3],'tar_y':self.cad_config['viewport'][4],'tar_z':self.cad_config['viewport'][5],'fov':self.cad_config['viewport'][6],'roll':0.}
-
-            # Load any intrinsics constraints
-            for i in range( len( [f for f in save_file.list_contents() if f.startswith('intrinsics_constraints') and 'points_' in f] ) ):
-
-                im = cv2.imread(os.path.join(save_file.get_temp_path(),'intrinsics_constraints','im_{:03d}.png'.format(i)))
-                if im is not None:
-                    if len(im.shape) == 3:
-                        if im.shape[2] == 3:
-                            im[:,:,:3] = im[:,:,2::-1]
-                
-                with save_file.open_file(os.path.join('intrinsics_constraints','points_{:03d}.csv'.format(i)),'r') as ppf:
-                    pp = PointPairs(ppf)
+            self._image = image
 
-                self.intrinsics_constraints.append([im,pp])
+        return self._image
 
-            # Note: this is only needed for calibration created with Calcam 2.0.0-dev
-            # --------------------------------------------------------------------------
-            if os.path.join('intrinsics_constraints','intrinsics_calib.ccc') in save_file.list_contents():
-                self.add_intrinsics_constraints( calibration = Calibration(os.path.join(save_file.get_temp_path(),'intrinsics_constraints','intrinsics_calib.ccc')) )
-            
-            if type(self.history) is list:
-                old_history = self.history
-                self.history = {}
-                if  self._type != 'virtual':
-                    self.history['image'] = None
-                if self._type != 'fit':
-                    self.history['extrinsics'] = None
-                    self.history['intrinsics'] = None
-                if self._type == 'fit':
-                    self.history['pointpairs'] = [None,None]
-                    self.history['intrinsics_constraints'] = []
-                    self.history['fit'] = [None] * self.n_subviews
-
-                if self._type != 'fit':
-                    self.intrisnics_type = None
-
-                for event in old_history:
-                    if 'Image' in event[3]:
-                        self.history['image'] = event[3] + ' by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
-                    elif 'Point pairs' in event[3]:
-                        if self.history['pointpairs'][0] is None:
-                            self.history['pointpairs'][0] = event[3] + ' by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
-                        else:
-                            self.history['pointpairs'][1] = self.history['pointpairs'][1] = 'Last modified by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
-                    elif 'Fit' in event[3]:
-                        subview_ind = self.subview_names.index(event[3].split('for ')[1])
-                        self.history['fit'][subview_ind] = 'Modified by {:s} on {:s} at {:s}'.format(event[1],event[2],misc.get_formatted_time(event[0]))
+    @image.setter
+    def image(self,image):
+
+        self._image_file_data = None
+        self._image = image
 
-            self.readonly = save_file.is_readonly()
 
 
 
@@ -983,9 +1042,10 @@ class Calibration():
         if self.subview_mask is None:
             return None
         else:
-            mask_out = self.subview_mask.copy()
             if coords.lower() == 'display':
-                mask_out = self.geometry.original_to_display_image(mask_out,interpolation='nearest')
+                mask_out = self._get_display_subview_mask().copy()
+            else:
+                mask_out = self.subview_mask.copy()
            
             return mask_out        
       
@@ -1013,8 +1073,13 @@ class Calibration():
 
         with ZipSaveFile(filename,'w') as save_file:
 
-            # Save the image
-            if self.image is not None:
+            # Save the image. If it has not been decoded since loading from file and the
+            # image geometry is unchanged, the original PNG data can be written as-is.
+            if self._image_file_data is not None and _same_geometry(self._image_file_data[1],self.geometry):
+                with open(os.path.join(save_file.get_temp_path(),'image.png'),'wb') as f:
+                    f.write(self._image_file_data[0])
+
+            elif self.image is not None:
                 im_out = self.get_image(coords='Display')
                 if len(im_out.shape) == 3:
                     if im_out.shape[2] > 2:
@@ -1117,32 +1182,51 @@ class Calibration():
                            The value of each element specified which sub-view the \
                            corresponding input image position belongs to.
         '''
+        display_mask = self._get_display_subview_mask()
+
         if coords.lower() == 'display':
             shape = self.geometry.get_display_shape()
-            mask = self.geometry.original_to_display_image(self.subview_mask)
+            mask = display_mask
         else:
             shape = self.geometry.get_original_shape()
             mask = self.subview_mask
 
+        x = np.asarray(x)
+        y = np.asarray(y)
 
         good_mask = (x >= -0.5) & (y >= -0.5) & (x < shape[0] - 0.5) & (y < shape[1] - 0.5)
-        try:
-            x[ good_mask == 0 ] = 0
-            y[ good_mask == 0 ] = 0
 
-            out = mask[np.round(y).astype('int'),np.round(x).astype('int')]
+        # If there's only 1 sub-view covering the whole image,
+        # we don't need to look at the mask at all.
+        if self.n_subviews == 1 and self._display_mask_cache[3]:
+            out = np.zeros(good_mask.shape,dtype=mask.dtype)
+        else:
+            xi = np.where(good_mask,np.round(x),0).astype(int)
+            yi = np.where(good_mask,np.round(y),0).astype(int)
+            out = np.array(mask[yi,xi])
 
-            out[good_mask == 0] = -1
-        except TypeError:
+        out[~good_mask] = -1
 
-            if good_mask:
-                out = mask[np.round(y).astype('int'),np.round(x).astype('int')]
-            else:
-                out = -1
+        if out.ndim == 0:
+            out = out[()]
 
         return out
 
 
+    def _get_display_subview_mask(self):
+        # Get the sub-view mask in display orientation. This is needed a lot, e.g. by
+        # subview_lookup(), so is kept until the mask or image geometry change.
+        # The cache is checked against a copy of the mask contents, so it still
+        # notices if subview_mask is modified in place. Comparing is much quicker
+        # than re-transforming the mask. The returned array must not be modified.
+        geometry_key = (tuple(self.geometry.transform_actions),self.geometry.pixel_aspectratio,self.geometry.x_pixels,self.geometry.y_pixels)
+
+        if self._display_mask_cache is None or self._display_mask_cache[1] != geometry_key or not np.array_equal(self._display_mask_cache[0],self.subview_mask):
+            display_mask = self.geometry.original_to_display_image(self.subview_mask)
+            self._display_mask_cache = (self.subview_mask.copy(),geometry_key,display_mask,self.subview_mask.min() >= 0)
+
+        return self._display_mask_cache[2]
+
 
 
     def get_pupilpos(self,x=None,y=None,coords='display',subview=None):
@@ -1315,7 +1399,7 @@ class Calibration():
         elif subview is None and self.n_subviews == 1:
             subview = 0
 
-        subview_mask = self.geometry.original_to_display_image(self.subview_mask)
+        subview_mask = self._get_display_subview_mask()
 
         # Calculate FOV by looking at the angle between sight lines at the image extremes
 
@@ -1396,15 +1480,19 @@ class Calibration():
             if coords.lower() == 'original':
                 x,y = self.geometry.original_to_display_coords(x,y)
 
-        # If not given any, generate our own image coordinates covering every pixel.
+        # If not given any, fill in the sight-line directions for every pixel a block of rows at a time,
+        # to avoid making lots of full-frame temporary arrays.
         else:
             if coords.lower() == 'original':
                 shape = self.geometry.get_original_shape()
-                x,y = np.meshgrid(np.arange(shape[0]),np.arange(shape[1]))
-                x,y = self.geometry.original_to_display_coords(x,y)
             else:
                 shape = self.geometry.get_display_shape()
-                x,y = np.meshgrid(np.arange(shape[0]),np.arange(shape[1]))
+
+            output = np.empty((shape[1],shape[0],3))
+            for rows,_,_,_,directions in self.iter_sightlines(coords=coords,subview=subview):
+                output[rows] = directions
+
+            return np.squeeze(output)
 
 
         # Output should be the same shape as input + an extra length 3 axis
@@ -1565,7 +1653,7 @@ class Calibration():
 
         image_out = np.zeros(image.shape)
 
-        subview_mask_display = self.geometry.original_to_display_image(self.subview_mask)
+        subview_mask_display = self._get_display_subview_mask()
         
         for nview in range(self.n_subviews):
 
@@ -2209,18 +2297,96 @@ class Calibration():
         Returns:
             (tuple of np.ndarray) : 2D arrays of X and Y coordinates.
         '''
+        xl,yl = self._fullframe_pixel_centres(coords,binning)
+
+        return np.meshgrid(xl,yl)
+
+
+    def iter_sightlines(self,coords='Display',binning=1,block_rows=256,dtype=np.float64,subview=None):
+        '''
+        Iterate over the camera sight-lines for the full image, a block of image rows at a time.
+
+        This gives the same sight-line geometry as :func:`get_pupilpos` and :func:`get_los_direction`
+        at the pixel positions given by :func:`fullframe_meshgrid`, but only ever holds one block of rows
+        in memory at once, so can be used to process arbitrarily large images with bounded memory use.
+
+        Parameters:
+
+            coords (str)     : Either ``Display`` or ``Original``, specifies which image orientation \
+                               the rows and returned pixel coordinates correspond to.
+
+            binning (float)  : Pixel binning, as for :func:`fullframe_meshgrid`.
+
+            block_rows (int) : Maximum number of (binned) image rows to include in each block.
+
+            dtype            : NumPy data type for the returned sight-line origins and directions, \
+                               e.g. ``np.float32`` to halve the memory required.
+
+            subview (int)    : If specified, forces the use of the camera model from the specified sub-view index. \
+                               If not given, the correct sub-view(s) will be chosen automatically.
+
+        Yields:
+
+            tuple            : (rows, x, y, origins, directions) for each block of rows, where rows is a slice \
+                               giving which rows of the full (binned) image the block corresponds to, x and y are \
+                               (n_rows x w) arrays of pixel coordinates and origins and directions are (n_rows x w x 3) \
+                               arrays of the sight-line start points and unit direction vectors. Pixels not belonging \
+                               to any sub-view have NaN origins and directions.
+        '''
+        if block_rows < 1:
+            raise ValueError('block_rows must be at least 1!')
+
+        xl,yl = self._fullframe_pixel_centres(coords,binning)
+
+        for start in range(0,yl.size,int(block_rows)):
+
+            rows = slice(start,min(start + int(block_rows),yl.size))
+            x,y = np.meshgrid(xl,yl[rows])
+
+            if coords.lower() == 'original':
+                xd,yd = self.geometry.original_to_display_coords(x,y)
+            else:
+                xd,yd = x,y
+
+            origins = np.full(x.shape + (3,),np.nan,dtype=dtype)
+            directions = np.full(x.shape + (3,),np.nan,dtype=dtype)
+
+            if subview is None:
+                block_mask = self.subview_lookup(xd,yd)
+                subview_list = np.unique(block_mask)
+                subview_list = subview_list[subview_list > -1].astype(int)
+            else:
+                block_mask = None
+                subview_list = [subview]
+
+            for nview in subview_list:
+
+                if self.view_models[nview] is None:
+                    continue
+
+                if block_mask is None:
+                    directions[:] = self.view_models[nview].get_los_direction(xd,yd)
+                    origins[:] = self.view_models[nview].get_pupilpos()
+                else:
+                    in_view = block_mask == nview
+                    directions[in_view] = self.view_models[nview].get_los_direction(xd[in_view],yd[in_view])
+                    origins[in_view] = self.view_models[nview].get_pupilpos()
+
+            yield rows,x,y,origins,directions
+
+
+    # Get 1D arrays of the x and y pixel coordinates making up the full frame at a given binning.
+    def _fullframe_pixel_centres(self,coords,binning):
+
         if coords.lower() == 'display':
             shape = self.geometry.get_display_shape()
-            xl = np.linspace( (binning-1.)/2,float(shape[0]-1)-(binning-1.)/2,int((1+shape[0]-1)/binning))
-            yl = np.linspace( (binning-1.)/2,float(shape[1]-1)-(binning-1.)/2,int((1+shape[1]-1)/binning))
-            x,y = np.meshgrid(xl,yl)
         else:
             shape = self.geometry.get_original_shape()
-            xl = np.linspace( (binning-1.)/2,float(shape[0]-1)-(binning-1.)/2,int((1+shape[0]-1)//binning))
-            yl = np.linspace( (binning-1.)/2,float(shape[1]-1)-(binning-1.)/2,int((1+shape[1]-1)//binning))
-            x,y = np.meshgrid(xl,yl)
 
-        return x,y
+        xl = np.linspace( (binning-1.)/2,float(shape[0]-1)-(binning-1.)/2,int((1+shape[0]-1)//binning))
+        yl = np.linspace( (binning-1.)/2,float(shape[1]-1)-(binning-1.)/2,int((1+shape[1]-1)//binning))
+
+        return xl,yl
 
 
 # The 'fitter' class 
@@ -2518,6 +2684,22 @@ class Fitter:
 
 
 
+# Decode PNG file data in to an image array, in the same way as cv2.imread().
+# Returns None if the data cannot be decoded.
+def _decode_png(file_data):
+
+    return cv2.imdecode(np.frombuffer(file_data,dtype=np.uint8),cv2.IMREAD_COLOR)
+
+
+# Check whether two CoordTransformer objects describe the same image geometry.
+def _same_geometry(geometry1,geometry2):
+
+    return geometry1.get_display_shape() == geometry2.get_display_shape() \
+        and list(geometry1.transform_actions) == list(geometry2.transform_actions) \
+        and geometry1.pixel_aspectratio == geometry2.pixel_aspectratio \
+        and tuple(geometry1.offset) == tuple(geometry2.offset)
+
+
 def undistort_model_residual(params,xd,xn,radial_order=2,include_tangential=True):
 
     if radial_order < 1 or radial_order > 3:
@@ -27,8 +27,8 @@ import glob
 import traceback
 import multiprocessing
 import warnings
+import zipfile
 
-from .io import ZipSaveFile
 from .misc import import_source, unload_source
 
 
@@ -48,6 +48,15 @@ user_cfg_path = os.path.expanduser('~/.calcam_config')
 # But there is not one included by default with Calcam!
 default_cfg_path = os.path.join(os.path.split(os.path.abspath(__file__))[0],'site_defaults.cfg')
 
+# Directory where calcam keeps persistent caches of things which are slow to calculate,
+# e.g. CAD model feature edges. Anything in here can safely be deleted.
+user_cache_path = os.path.expanduser('~/.calcam_cache')
+
+# Metadata about CAD model definition files and image source modules is kept in an index in
+# the cache directory, so that they only need to be opened or imported again if they change.
+# If changing what is stored in the index, change the version number to invalidate old indexes.
+file_index_version = 1
+
 # Filename filters for different types of file
 filename_filters = {'calibration':'Calcam Calibration (*.ccc)','image':'PNG Image (*.png)','pointpairs':'Calcam Point Pairs (*.ccc *.csv)','movement':'Calcam Affine Transform (*.cmc)'}
 
@@ -99,7 +108,10 @@ class CalcamConfig():
             else:
                 setattr(self,key,self.fields[key])
 
-        self.save()
+        # Only write the config file if it doesn't exist yet or is missing any fields,
+        # rather than re-writing it every time.
+        if json.loads(json.dumps({ key : getattr(self,key) for key in self.fields})) != user_dict:
+            self.save()
 
 
     def save(self):
@@ -126,29 +138,42 @@ class CalcamConfig():
         """
         cadmodels = {}
 
+        index = _load_file_index('cadmodels')
+        new_index = {}
+
         for path in self.cad_def_paths:
             filelist = glob.glob(os.path.join(path,'*.ccm'))
 
             for fname in filelist:
 
+                # Get the model metadata from the index if the file hasn't changed,
+                # otherwise read it from the file.
+                index_key = os.path.abspath(fname)
                 try:
-                    with ZipSaveFile(fname,'rs') as f:
-                        with f.open_file('model.json','r') as j: 
-                               caddef = json.load(j)
+                    file_state = _get_file_state(fname)
+                    model_info = index.get(index_key)
+                    if model_info is None or model_info['file_state'] != file_state:
+                        caddef = _read_model_definition(fname)
+                        model_info = {'file_state':file_state,'machine_name':caddef['machine_name'],'features':[str(x) for x in caddef['features'].keys()],'default_variant':caddef['default_variant']}
                 except:
                     continue
 
-                if caddef['machine_name'] not in cadmodels:
-                    key = caddef['machine_name']
+                new_index[index_key] = model_info
+
+                if model_info['machine_name'] not in cadmodels:
+                    key = model_info['machine_name']
                 else:
                     
-                    existing_model = cadmodels.pop(caddef['machine_name'])
-                    existing_key = '{:s} [{:s}/{:s}]'.format(caddef['machine_name'], existing_model[0].split(os.sep)[-2],os.path.split(existing_model[0])[-1] )
+                    existing_model = cadmodels.pop(model_info['machine_name'])
+                    existing_key = '{:s} [{:s}/{:s}]'.format(model_info['machine_name'], existing_model[0].split(os.sep)[-2],os.path.split(existing_model[0])[-1] )
                     cadmodels[existing_key] = existing_model
 
-                    key = '{:s} [{:s}/{:s}]'.format(caddef['machine_name'], fname.split(os.sep)[-2],os.path.split(fname)[1] )
+                    key = '{:s} [{:s}/{:s}]'.format(model_info['machine_name'], fname.split(os.sep)[-2],os.path.split(fname)[1] )
 
-                cadmodels[key] = [fname,[str(x) for x in caddef['features'].keys()],caddef['default_variant']]
+                cadmodels[key] = [fname,list(model_info['features']),model_info['default_variant']]
+
+        if new_index != index:
+            _save_file_index('cadmodels',new_index)
 
         return cadmodels
 
@@ -156,10 +181,27 @@ class CalcamConfig():
     def get_image_sources(self,meta_only=False):
         """
         Get a list of available image source providers.
+
+        Parameters:
+
+            meta_only (bool) : If True, return only metadata about the image sources \
+                               instead of the image source modules. In this case, image \
+                               sources whose metadata is already known and whose source \
+                               code has not changed are not imported.
+
+        Returns:
+
+            If meta_only is False, a list of image source modules. If meta_only is True, \
+            a list of [display name, source path, error message or None] for each image \
+            source (the path is None for built-in image sources).
         """
         image_sources = []
         displaynames = []
         meta = []
+        tidy_names = []
+
+        index = _load_file_index('image_sources')
+        new_index = {}
 
         for path in [builtin_imsource_path] + self.image_source_paths:
 
@@ -177,62 +219,93 @@ class CalcamConfig():
                 else:
                     tidy_name = os.sep.join(fname.split(os.sep)[-2:])
 
+                index_key = os.path.abspath(fname)
                 try:
-                    # Import the module, check it has the right attributes and add its info to the metadata table
-                    usermodule = import_source(fname)
+                    file_state = _get_file_state(fname)
+                except OSError:
+                    continue
 
-                    try:
-                        if not callable(usermodule.get_image_function):
-                            raise ImportError()
-                    except Exception:
-                        meta.append([tidy_name, fname, 'Not a valid image source definition:\nDoes not contain required function "get_image_function(..)"'])
-                        continue
+                # If we only need the metadata and already know it, no need to import the module.
+                usermodule = None
+                source_info = index.get(index_key)
+                if not meta_only or source_info is None or source_info['file_state'] != file_state:
 
                     try:
-                        if type(usermodule.get_image_arguments) is not list:
-                            raise ImportError
-                    except Exception:
-                        meta.append([tidy_name, fname, 'Not a valid image source definition:\nDoes not contain required list attribute "get_image_arguments"'])
-                        continue
+                        # Import the module, check it has the right attributes and get its info for the metadata table
+                        usermodule = import_source(fname)
+                        source_info = {'file_state':file_state,'display_name':None,'error':None}
+
+                        try:
+                            if not callable(usermodule.get_image_function):
+                                raise ImportError()
+                        except Exception:
+                            source_info['error'] = 'Not a valid image source definition:\nDoes not contain required function "get_image_function(..)"'
+
+                        if source_info['error'] is None:
+                            try:
+                                if type(usermodule.get_image_arguments) is not list:
+                                    raise ImportError
+                            except Exception:
+                                source_info['error'] = 'Not a valid image source definition:\nDoes not contain required list attribute "get_image_arguments"'
+
+                        if source_info['error'] is None:
+                            try:
+                                if type(usermodule.display_name) is not str:
+                                    raise ImportError
+                            except Exception:
+                                source_info['error'] = 'Not a valid image source definition:\nDoes not contain required string attribute  "display_name"'
+
+                        if source_info['error'] is None:
+                            source_info['display_name'] = usermodule.display_name
+                        else:
+                            usermodule = None
+
+                        new_index[index_key] = source_info
 
-                    try:
-                        if type(usermodule.display_name) is not str:
-                            raise ImportError
                     except Exception:
-                        meta.append([tidy_name, fname, 'Not a valid image source definition:\nDoes not contain required string attribute  "display_name"'])
+                        # If it won't import, show this in the metadata. This is not put in the index because
+                        # it could be due to something other than the image source code, e.g. a missing dependency.
+                        tb_info = ''.join(traceback.format_exception(*sys.exc_info(), limit=-1))
+                        meta.append([tidy_name,fname,'Cannot be imported:\n{:s}'.format(tb_info)])
+                        tidy_names.append(tidy_name)
                         continue
+                else:
+                    new_index[index_key] = source_info
 
+                if source_info['error'] is not None:
+                    meta.append([tidy_name, fname, source_info['error']])
+                    tidy_names.append(tidy_name)
+                else:
+                    display_name = source_info['display_name']
 
-                    # Make sure the imported modules have unique display names
-                    if usermodule.display_name in displaynames:
-                        old_ind = displaynames.index(usermodule.display_name)
+                    # Make sure the image sources have unique display names
+                    if display_name in displaynames:
+                        old_ind = displaynames.index(display_name)
                         for i,metadata in enumerate(meta):
-                            if metadata[0] == usermodule.display_name:
+                            if metadata[0] == display_name:
                                 old_meta_ind = i
                                 break
 
-                        usermodule.display_name = usermodule.display_name + ' [{:s}]'.format(tidy_name)
-                        other_path = image_sources[old_ind].__file__
-                        if other_path.endswith('__init__.py'):
-                            tidyname = os.sep.join(other_path.split(os.sep)[-3:-1])
-                        else:
-                            tidyname = os.sep.join(other_path.split(os.sep)[-2:])
-                        image_sources[old_ind].display_name = image_sources[old_ind].display_name + ' [{:s}]'.format(tidyname)
-                        meta[old_meta_ind][0] = image_sources[old_ind].display_name
+                        meta[old_meta_ind][0] = display_name + ' [{:s}]'.format(tidy_names[old_meta_ind])
+                        displaynames[old_ind] = meta[old_meta_ind][0]
+                        if image_sources[old_ind] is not None:
+                            image_sources[old_ind].display_name = meta[old_meta_ind][0]
 
-                    displaynames.append(usermodule.display_name)
+                        display_name = display_name + ' [{:s}]'.format(tidy_name)
+                        if usermodule is not None:
+                            usermodule.display_name = display_name
+
+                    displaynames.append(display_name)
                     image_sources.append(usermodule)
-                    meta.append([usermodule.display_name,fname,None])
-                except Exception:
-                    # If it won't import or doesn't have the right attributes, show this in the metadata
-                    tb_info = ''.join(traceback.format_exception(*sys.exc_info(), limit=-1))
-                    meta.append([tidy_name,fname,'Cannot be imported:\n{:s}'.format(tb_info)])
-                    continue
+                    meta.append([display_name,fname,None])
+                    tidy_names.append(tidy_name)
 
-                # Built-in image sources get special metadata
-                if path == builtin_imsource_path:
-                    meta[-1][1] = None
+                    # Built-in image sources get special metadata
+                    if path == builtin_imsource_path:
+                        meta[-1][1] = None
 
+        if new_index != index:
+            _save_file_index('image_sources',new_index)
 
         if meta_only:
             for module_meta in meta:
@@ -241,3 +314,96 @@ class CalcamConfig():
             return meta
         else:
             return image_sources
+
+
+# Read the model definition from a CAD model definition file, straight
+# from the zip file without extracting the rest of the file contents.
+def _read_model_definition(filename):
+
+    with zipfile.ZipFile(filename,'r') as zf:
+        return json.loads(zf.read('model.json').decode('utf-8'))
+
+
+# Get a description of the current state of a file, or the python files in
+# a package directory, which changes if the file(s) are modified.
+def _get_file_state(path):
+
+    if os.path.isdir(path):
+        filelist = sorted([os.path.join(dirpath,fname) for dirpath,_,fnames in os.walk(path) for fname in fnames if fname.endswith('.py')])
+    else:
+        filelist = [path]
+
+    file_state = []
+    for fname in filelist:
+        stat = os.stat(fname)
+        file_state.append([os.path.relpath(fname,path),stat.st_mtime,stat.st_size])
+
+    return file_state
+
+
+# Load an index of file metadata from the cache directory.
+# Returns an empty index if it does not exist or cannot be read.
+def _load_file_index(name):
+
+    cache_dir = get_cache_dir('file_index')
+    if cache_dir is None:
+        return {}
+
+    try:
+        with open(os.path.join(cache_dir,'{:s}.json'.format(name)),'r') as f:
+            index = json.load(f)
+        if index['version'] != file_index_version:
+            return {}
+        return index['files']
+    except Exception:
+        return {}
+
+
+# Save an index of file metadata to the cache directory.
+def _save_file_index(name,files):
+
+    cache_dir = get_cache_dir('file_index')
+    if cache_dir is None:
+        return
+
+    filename = os.path.join(cache_dir,'{:s}.json'.format(name))
+    tmp_filename = filename + '.tmp{:d}'.format(os.getpid())
+    try:
+        with open(tmp_filename,'w') as f:
+            json.dump({'version':file_index_version,'files':files},f)
+        os.replace(tmp_filename,filename)
+    except Exception:
+        try:
+            os.remove(tmp_filename)
+        except OSError:
+            pass
+
+
+def get_cache_dir(name):
+    """
+    Get the path to a sub-directory of the user's calcam cache directory,
+    creating it if necessary.
+
+    Parameters:
+
+        name (str) : Name of the cache sub-directory. Can also be an absolute path, \
+                     to use a directory outside the calcam cache directory.
+
+    Returns:
+
+        str or None : Path to the cache directory, or None if it does not exist \
+                      and cannot be created (in which case nothing should be cached).
+    """
+    path = os.path.join(user_cache_path,name)
+
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                return None
+
+    if not os.access(path,os.W_OK):
+        return None
+
+    return path
@@ -27,10 +27,8 @@ Written by Scott Silburn, James Harrison & Artur Perek.
 '''
 import multiprocessing
 import copy
-import time
 import json
 import os
-import random
 
 import numpy as np
 import scipy.sparse
@@ -593,8 +591,17 @@ class GeometryMatrix:
                                                the progress of the calculation. By default, status updates are printed \
                                                to stdout.  If set to None, no status updates are issued.
 
+        cancel (callable)                    : Callable which returns True if the calculation should be stopped early, \
+                                               in which case calcam.misc.Cancelled is raised.
+
     '''
-    def __init__(self,grid,raydata,pixel_order='C',trim_rows=True,trim_columns=True,calc_status_callback = misc.LoopProgPrinter().update):
+    def __init__(self,grid,raydata,pixel_order='C',trim_rows=True,trim_columns=True,calc_status_callback = misc.LoopProgPrinter().update,cancel=None):
+
+        self.timings = []
+        '''
+        list of dict : Records of how long the stages of creating or loading the matrix took. \
+                       See calcam.misc.record_timing() for the record format.
+        '''
 
         if grid is not None and raydata is not None:
 
@@ -630,46 +637,39 @@ class GeometryMatrix:
             n_cells = grid.n_cells
             n_los = raydata.x.size
     
-            # Flatten out the ray start and end coords
-            ray_start_coords = raydata.ray_start_coords.reshape(-1,3,order=self.pixel_order)
-            ray_end_coords = raydata.ray_end_coords.reshape(-1,3,order=self.pixel_order)
-
-
             # Multi-threadedly loop over each sight-line in raydata and calculate its matrix row.
             # Store the results as coords + data then build the matrix after, because that is much faster.
-            if calc_status_callback is not None:
-                calc_status_callback('Calculating geometry matrix elements using {:d} CPUs...'.format(config.n_cpus))
-            
-            last_status_update = 0.
-            
+            progress = misc.ProgressReporter(calc_status_callback,cancel,min_interval=1.)
+            self.timings = progress.timings
+            progress.status('Calculating geometry matrix elements using {:d} CPUs...'.format(config.n_cpus))
+
             # We will do the calculation in a random order,
             # purely to get better time remaining estimation.
-            inds = list(range(n_los))
-            random.shuffle(inds)
+            inds = np.random.permutation(n_los)
 
             colinds = []
             rowinds = []
             data = []
 
-            with multiprocessing.Pool( config.n_cpus ) as cpupool:
-                calc_status_callback(0.)
-                for i , row_data in enumerate( cpupool.imap( self._calc_row_volume, np.hstack((ray_start_coords[inds,:],ray_end_coords[inds,:])) , 10 ) ):          
-                    rowinds.append(np.zeros(row_data[0].shape,dtype=np.uint32) + inds[i])                    
-                    colinds.append(row_data[0])
-                    data.append(row_data[1])
-                    
-                    if time.time() - last_status_update > 1. and calc_status_callback is not None:
-                        calc_status_callback(float(i) / n_los)
-                        last_status_update = time.time()
+            with progress.stage('matrix build',n_los=n_los,n_cells=n_cells,n_cpus=config.n_cpus):
 
-            # Build the matrix!
-            self.data = scipy.sparse.csr_matrix((np.concatenate(data),(np.concatenate(rowinds),np.concatenate(colinds))),shape=(n_los,n_cells))            
-            '''
-            scipy.sparse.csr_matrix : The geometry matrix data itself.
-            '''
+                with multiprocessing.Pool( config.n_cpus ) as cpupool:
+                    progress.update(0.)
+                    for i , row_data in enumerate( cpupool.imap( self._calc_row_volume, _iter_ray_coords(raydata,inds,self.pixel_order) , 10 ) ):
+                        rowinds.append(np.zeros(row_data[0].shape,dtype=np.uint32) + inds[i])
+                        colinds.append(row_data[0])
+                        data.append(row_data[1])
+
+                        progress.update(float(i) / n_los)
+                        progress.check_cancel()
 
-            if calc_status_callback is not None:
-                calc_status_callback(1.)
+                # Build the matrix!
+                self.data = scipy.sparse.csr_matrix((np.concatenate(data),(np.concatenate(rowinds),np.concatenate(colinds))),shape=(n_los,n_cells))
+                '''
+                scipy.sparse.csr_matrix : The geometry matrix data itself.
+                '''
+
+            progress.update(1.)
             
             if trim_columns:
                 # Remove any grid cells + matrix columns which have no sight-line coverage.
@@ -1366,14 +1366,15 @@ class GeometryMatrix:
         except IndexError:
             raise ValueError('Given file name does not include file extension; extension must be specified to determine file type!')
 
-        if fmt == 'npz':
-            geommat._load_npz(filename)
-        elif fmt == 'mat':
-            geommat._load_matlab(filename)
-        elif fmt == 'zip':
-            geommat._load_txt(filename)
-        else:
-            raise ValueError('File extension "{:s}" not understood; should be an "npz", "mat" or "zip" file.'.format(fmt))
+        with misc.record_timing(geommat.timings,'load',filename=filename):
+            if fmt == 'npz':
+                geommat._load_npz(filename)
+            elif fmt == 'mat':
+                geommat._load_matlab(filename)
+            elif fmt == 'zip':
+                geommat._load_txt(filename)
+            else:
+                raise ValueError('File extension "{:s}" not understood; should be an "npz", "mat" or "zip" file.'.format(fmt))
 
         return geommat
         
@@ -1767,3 +1768,20 @@ def _bin_image(image,bin_factor,bin_func=np.mean):
     newshape = ( image.shape[0] // bin_factor, bin_factor, image.shape[1] // bin_factor, bin_factor )
     newshape = np.array(newshape,dtype=int)
     return bin_func( bin_func( image.reshape(newshape),axis=3 ) ,axis=1 )
+
+
+
+# Generator yielding the concatenated [start, end] coordinates of the sight-lines in a RayData object,
+# in the order given by an array of flattened pixel indices. This is done a block at a time so that
+# we never need a full re-ordered copy of the ray coordinates in memory.
+def _iter_ray_coords(raydata,inds,pixel_order,block_size=65536):
+
+    if pixel_order is None:
+        pixel_order = 'C'
+
+    shape = raydata.ray_start_coords.shape[:-1]
+
+    for start in range(0,len(inds),block_size):
+        pixel_inds = np.unravel_index(inds[start:start+block_size],shape,order=pixel_order)
+        for coords in np.hstack((raydata.ray_start_coords[pixel_inds],raydata.ray_end_coords[pixel_inds])):
+            yield coords
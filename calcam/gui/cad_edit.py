@@ -43,7 +43,7 @@ class CADEdit(CalcamGUIWindow):
         # Set up VTK
         self.qvtkwidget_3d = qt.QVTKRenderWindowInteractor(self.vtk_frame)
         self.vtk_frame.layout().addWidget(self.qvtkwidget_3d,0,0,1,2)
-        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,newpick_callback=self.add_cursor,cursor_move_callback=self.update_cursor_position)
+        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,newpick_callback=self.add_cursor,cursor_move_callback=self.update_cursor_position,interaction_callback=self.on_3d_interaction)
         self.qvtkwidget_3d.SetInteractorStyle(self.interactor3d)
         self.renderer_3d = vtk.vtkRenderer()
         self.renderer_3d.SetBackground(0, 0, 0)
@@ -323,6 +323,10 @@ class CADEdit(CalcamGUIWindow):
                 self.cadmodel.features[self.selected_feature].coord_handedness = 'right' if self.handedness_box.currentIndex() == 0 else 'left'
 
             self.cadmodel.features[self.selected_feature].polydata = None
+            self.cadmodel.features[self.selected_feature].edge_polydata = None
+            self.cadmodel.features[self.selected_feature].lod_polydata = None
+            self.cadmodel.features[self.selected_feature].lod_actor = None
+            self.cadmodel.features[self.selected_feature].mesh_id = None
             self.cadmodel.features[self.selected_feature].solid_actor = None
             self.cadmodel.features[self.selected_feature].edge_actor = None
             self.cadmodel.set_features_enabled(True, self.selected_feature)
@@ -23,6 +23,11 @@
 import sys
 import os
 import traceback
+import pickle
+import threading
+import weakref
+import atexit
+import multiprocessing
 
 # External module imports
 import numpy as np
@@ -40,9 +45,259 @@ from ..pointpairs import PointPairs
 from .vtkinteractorstyles import CalcamInteractorStyle2D
 from . import qt_wrapper as qt
 from ..misc import ColourCycle,DodgyDict, open_file
+from .. import render
 
 guipath = os.path.split(os.path.abspath(__file__))[0]
 
+
+class BackgroundJob():
+    '''
+    A computation submitted to a JobRunner.
+    '''
+    def __init__(self,queue,function,args,kwargs,on_result,on_progress,on_error,process,key):
+
+        self.queue = queue
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.on_result = on_result
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.process = process
+        self.key = key
+
+        self.cancelled = False
+        self.result = None
+        self.error = None
+        self.async_result = None
+
+
+class JobRunner(qt.QObject):
+    '''
+    Runs slow computations such as rendering and ray casting in the background, so the GUI
+    stays responsive while they run.
+
+    Jobs are submitted to named queues. Each queue runs one job at a time, and if more jobs
+    are submitted to a queue while one is running, only the most recently submitted one is
+    kept to run next, and the result of the running job is thrown away. So if the user changes
+    things quickly, only the latest request gets rendered.
+
+    Jobs run either in a thread, for things which release the GIL like VTK ray casting, or
+    in a separate worker process, for things like off-screen rendering which can't be done
+    safely outside the GUI thread. Results, progress updates and errors are passed to
+    callbacks which are always called on the GUI thread.
+    '''
+    job_finished = qt.pyqtSignal(object)
+    job_progress = qt.pyqtSignal(object,object)
+
+    def __init__(self,parent=None):
+
+        qt.QObject.__init__(self,parent)
+
+        self.running = {}
+        self.pending = {}
+        self.pool = None
+
+        self.job_finished.connect(self._on_finished)
+        self.job_progress.connect(self._on_progress)
+
+
+    def submit(self,queue,function,args=(),kwargs={},on_result=None,on_progress=None,on_error=None,process=False,progress_arg=None,cancel_arg=None,key=None):
+        '''
+        Submit a job to be run in the background.
+
+        Parameters:
+
+            queue (str)             : Name of the queue to run the job in.
+            function (callable)     : Function to run. For jobs run in a process, this must be picklable \
+                                      i.e. a module-level function.
+            args (tuple)            : Positional arguments to pass to the function.
+            kwargs (dict)           : Keyword arguments to pass to the function.
+            on_result (callable)    : Called with the function's return value when it finishes.
+            on_progress (callable)  : Called with progress updates from the function (see progress_arg).
+            on_error (callable)     : Called with the exception if the function raises one. If not given, \
+                                      the exception is re-raised on the GUI thread.
+            process (bool)          : Whether to run the job in a worker process instead of a thread. In this \
+                                      case the arguments are copied when the job is submitted.
+            progress_arg (str)      : Name of a keyword argument of the function which takes a status \
+                                      callback, which will be used to send progress updates to on_progress. \
+                                      Only for jobs run in threads.
+            cancel_arg (str)        : Name of a keyword argument of the function which takes a callable \
+                                      returning whether the job should stop. Only for jobs run in threads.
+            key (object)            : Optional description of what the job calculates. If the latest job in \
+                                      the queue has the same key, it is kept and no new job is started.
+
+        Returns:
+
+            BackgroundJob           : Object representing the job.
+        '''
+        if key is not None:
+            latest = self.pending.get(queue,self.running.get(queue))
+            if latest is not None and not latest.cancelled and latest.key == key:
+                return latest
+
+        kwargs = dict(kwargs)
+
+        if process:
+            if progress_arg is not None or cancel_arg is not None:
+                raise ValueError('Progress and cancellation callbacks are not supported for jobs run in a process.')
+            # Take a copy of the arguments now, since the originals might be changed by the
+            # GUI before the job starts.
+            args,kwargs = pickle.loads(pickle.dumps((args,kwargs)))
+
+        job = BackgroundJob(queue,function,args,kwargs,on_result,on_progress,on_error,process,key)
+
+        if progress_arg is not None:
+            job.kwargs[progress_arg] = lambda status: self.job_progress.emit(job,status)
+        if cancel_arg is not None:
+            job.kwargs[cancel_arg] = lambda: job.cancelled
+
+        if queue in self.running:
+            self.running[queue].cancelled = True
+            if queue in self.pending:
+                self.pending[queue].cancelled = True
+            self.pending[queue] = job
+        else:
+            self._start(job)
+
+        return job
+
+
+    def cancel(self,queue=None):
+        '''
+        Cancel running and pending jobs. Jobs running in threads are cancelled if they
+        support it (see the cancel_arg argument of submit()), otherwise their results are
+        discarded; jobs running in a process are stopped straight away.
+
+        Parameters:
+
+            queue (str) : Name of the queue to cancel. If not given, all queues are cancelled.
+        '''
+        if queue is None:
+            queues = set(self.running.keys()) | set(self.pending.keys())
+        else:
+            queues = [queue]
+
+        terminate = False
+        for queue in queues:
+            if queue in self.pending:
+                self.pending.pop(queue).cancelled = True
+            if queue in self.running:
+                self.running[queue].cancelled = True
+                terminate = terminate or self.running[queue].process
+
+        if terminate:
+            self._terminate_pool()
+
+
+    def is_busy(self,queue=None):
+        '''
+        Check whether there are jobs running or waiting to run.
+
+        Parameters:
+
+            queue (str) : Name of the queue to check. If not given, checks all queues.
+
+        Returns:
+
+            bool        : Whether there are jobs running or waiting.
+        '''
+        if queue is None:
+            return len(self.running) > 0
+        else:
+            return queue in self.running
+
+
+    def shutdown(self):
+        '''
+        Cancel all jobs and stop the worker process.
+        '''
+        self.cancel()
+        self._terminate_pool()
+
+
+    def _start(self,job):
+
+        self.running[job.queue] = job
+
+        if job.process:
+            if self.pool is None:
+                # Use a freshly started interpreter for the worker, since forking
+                # a process with a GUI and OpenGL contexts is asking for trouble.
+                self.pool = multiprocessing.get_context('spawn').Pool(1)
+            job.async_result = self.pool.apply_async(job.function,job.args,job.kwargs)
+            target = self._wait_process
+        else:
+            target = self._run_thread
+
+        threading.Thread(target=target,args=(job,),daemon=True).start()
+
+
+    def _run_thread(self,job):
+
+        try:
+            job.result = job.function(*job.args,**job.kwargs)
+        except Exception as e:
+            job.error = e
+
+        self.job_finished.emit(job)
+
+
+    def _wait_process(self,job):
+
+        async_result = job.async_result
+
+        # Poll rather than just waiting, so we notice if the worker is terminated.
+        while not async_result.ready():
+            if job.async_result is None:
+                break
+            async_result.wait(0.1)
+        else:
+            try:
+                job.result = async_result.get()
+            except Exception as e:
+                job.error = e
+
+        self.job_finished.emit(job)
+
+
+    def _terminate_pool(self):
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+        for job in self.running.values():
+            if job.process:
+                job.cancelled = True
+                job.async_result = None
+
+
+    def _on_finished(self,job):
+
+        if self.running.get(job.queue) is job:
+            del self.running[job.queue]
+            if job.queue in self.pending:
+                self._start(self.pending.pop(job.queue))
+
+        if job.cancelled:
+            return
+
+        if job.error is None:
+            if job.on_result is not None:
+                job.on_result(job.result)
+        elif job.on_error is not None:
+            job.on_error(job.error)
+        else:
+            raise job.error
+
+
+    def _on_progress(self,job,status):
+
+        if not job.cancelled and job.on_progress is not None:
+            job.on_progress(status)
+
+
 class CalcamGUIWindow(qt.QMainWindow):
 
 
@@ -63,6 +318,24 @@ class CalcamGUIWindow(qt.QMainWindow):
 
         self.manual_exc = False
 
+        # For running slow calculations in the background
+        self.jobs = JobRunner(self)
+
+        # For showing the CAD model in reduced detail while moving the 3D view.
+        # Full detail is restored once the view stops moving.
+        self.full_detail_timer = qt.QTimer()
+        self.full_detail_timer.setSingleShot(True)
+        self.full_detail_timer.setInterval(300)
+        self.full_detail_timer.timeout.connect(self.restore_full_detail)
+        self.low_detail_model = None
+        self.low_detail_requested = set()
+
+        # Copy of the CAD model for ray casting in background threads, see get_raycast_cadmodel()
+        self.raycast_cadmodel = (None,None)
+
+        # Anti-aliasing factor for CAD overlay images
+        self.overlay_aa = 2
+
         # See how big the screen is and open the window at an appropriate size
         if qt.qt_ver < 5:
             available_space = self.app.desktop().availableGeometry(self)
@@ -1092,6 +1365,10 @@ class CalcamGUIWindow(qt.QMainWindow):
 
     def update_cad_status(self,message):
 
+        # The CAD model might be used by background jobs, but we can only touch the GUI from the main thread.
+        if threading.current_thread() is not threading.main_thread():
+            return
+
         if message is not None:
             self.app.setOverrideCursor(qt.QCursor(qt.Qt.WaitCursor))
             self.statusbar.showMessage(message)
@@ -1211,6 +1488,53 @@ class CalcamGUIWindow(qt.QMainWindow):
         dialog.exec()
 
 
+    def get_overlay_key(self,calibration,wireframe):
+        '''
+        Get a string describing what a CAD overlay image rendered with the given
+        calibration and model settings will look like.
+        '''
+        return render._hash_object([render._get_calib_key(calibration),self.cadmodel.get_enabled_features(),wireframe])
+
+
+    def get_overlay_oversampling(self,calibration):
+        '''
+        Get the oversampling factor used for CAD overlay images for a calibration,
+        so that small images still have reasonably fine lines.
+        '''
+        return int(np.ceil(min(1000/np.array(calibration.geometry.get_display_shape()))))
+
+
+    def render_overlay_image(self,calibration,wireframe,on_result,queue='overlay',depth=False):
+        '''
+        Start rendering a white CAD model overlay image from the point of view of a calibration
+        in the background. When it is done, on_result is called with the image (and a depth map,
+        if depth is True) as long as the calibration and model have not changed in the meantime.
+        '''
+        oversampling = self.get_overlay_oversampling(calibration)
+
+        model_state = render._get_cadmodel_state(self.cadmodel)
+        for feature in model_state['features'].values():
+            feature['current_colour'] = (1,1,1)
+        model_state['edges'] = wireframe
+
+        key = self.get_overlay_key(calibration,wireframe)
+
+        def finished(result):
+            self.statusbar.clearMessage()
+            if self.cadmodel is not None and self.get_overlay_key(calibration,wireframe) == key:
+                if depth:
+                    on_result(*result)
+                else:
+                    on_result(result)
+
+        def failed(error):
+            self.statusbar.clearMessage()
+            raise error
+
+        self.statusbar.showMessage('Rendering CAD image overlay...')
+        self.jobs.submit(queue,render._render_cam_view_from_state,args=(model_state,calibration),kwargs={'transparency':True,'aa':self.overlay_aa,'oversampling':oversampling,'depth':depth},on_result=finished,on_error=failed,process=True,key=key)
+
+
 
     def closeEvent(self,event):
 
@@ -1231,6 +1555,8 @@ class CalcamGUIWindow(qt.QMainWindow):
                 event.ignore()
                 return
 
+        self.jobs.shutdown()
+
         if self.cadmodel is not None:
             self.cadmodel.remove_from_renderer(self.renderer_3d)
             self.cadmodel.unload()
@@ -1243,6 +1569,87 @@ class CalcamGUIWindow(qt.QMainWindow):
         sys.excepthook = sys.__excepthook__
 
 
+    def on_3d_interaction(self,moving):
+        # Called by the 3D interactor when the camera starts or stops moving.
+        # While it is moving, the CAD model is shown with reduced detail meshes
+        # so that interaction stays smooth with very large models.
+        if self.cadmodel is None:
+            return
+
+        if moving:
+            self.full_detail_timer.start()
+            self.cadmodel.set_low_detail(True)
+            self.build_low_detail_meshes()
+
+        else:
+            self.full_detail_timer.stop()
+            if self.cadmodel.low_detail:
+                self.cadmodel.set_low_detail(False)
+                self.refresh_3d()
+
+
+    def restore_full_detail(self):
+        # Called a short time after the 3D view was last moved by the mouse
+        # wheel or keyboard. If a mouse drag is still in progress, wait more.
+        if self.interactor3d.GetState() != 0:
+            self.full_detail_timer.start()
+        else:
+            self.on_3d_interaction(False)
+
+
+    def build_low_detail_meshes(self):
+        # Start making reduced detail meshes in the background for any enabled
+        # CAD model features which we have not already asked for.
+        if self.low_detail_model is None or self.low_detail_model() is not self.cadmodel:
+            self.low_detail_model = weakref.ref(self.cadmodel)
+            self.low_detail_requested = set()
+
+        features = set(self.cadmodel.get_enabled_features())
+
+        if features.issubset(self.low_detail_requested):
+            return
+
+        self.low_detail_requested.update(features)
+
+        self.jobs.submit('low_detail',render._build_low_detail_meshes,args=(render._get_cadmodel_state(self.cadmodel),),cancel_arg='cancel',on_error=lambda error: self.statusbar.showMessage('Could not make reduced detail CAD meshes: {:}'.format(error),5000))
+
+
+    def get_raycast_cadmodel(self):
+        '''
+        Get a copy of the current CAD model to use for ray casting in background jobs.
+        VTK objects are not thread-safe, so jobs running in threads must not use the CAD
+        model which the GUI is rendering. The copy contains only the enabled features,
+        shares no VTK objects with the GUI's model, and is re-used until the model geometry changes.
+        Must be called from the GUI thread.
+        '''
+        if self.cadmodel is None:
+            return None
+
+        enabled_features = self.cadmodel.get_enabled_features()
+        key = (id(self.cadmodel),[(fname,self.cadmodel.features[fname].get_mesh_id()) for fname in enabled_features])
+
+        if self.raycast_cadmodel[0] != key:
+
+            state = render._get_cadmodel_state(self.cadmodel)
+            state['features'] = dict([(fname,state['features'][fname]) for fname in enabled_features])
+            cadmodel = render._cadmodel_from_state(state)
+
+            # Copy any meshes which are already loaded rather than loading them again.
+            for fname in enabled_features:
+                if self.cadmodel.features[fname].polydata is not None:
+                    cadmodel.features[fname].polydata = vtk.vtkPolyData()
+                    cadmodel.features[fname].polydata.DeepCopy(self.cadmodel.features[fname].polydata)
+
+            # The previous copy has no definition file to close, so make sure it can be freed
+            # once any jobs using it have finished.
+            if self.raycast_cadmodel[1] is not None:
+                atexit.unregister(self.raycast_cadmodel[1].unload)
+
+            self.raycast_cadmodel = (key,cadmodel)
+
+        return self.raycast_cadmodel[1]
+
+
     def on_model_load(self):
         pass
 
@@ -27,8 +27,8 @@ from .core import *
 from .vtkinteractorstyles import CalcamInteractorStyle2D, CalcamInteractorStyle3D
 from ..calibration import Calibration, Fitter, ImageUpsideDown
 from ..pointpairs import PointPairs
-from ..render import render_cam_view
 from .. import misc
+from .. import render
 from ..image_enhancement import enhance_image, scale_to_8bit
 from ..movement import manual_movement
 
@@ -49,7 +49,7 @@ class FittingCalib(CalcamGUIWindow):
         # Set up VTK
         self.qvtkwidget_3d = qt.QVTKRenderWindowInteractor(self.vtkframe_3d)
         self.vtkframe_3d.layout().addWidget(self.qvtkwidget_3d)
-        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,cursor_move_callback=self.update_cursor_position,newpick_callback=self.new_point_3d,focus_changed_callback=lambda x: self.change_point_focus('3d',x),resize_callback=self.update_vtk_size,pre_move_callback=self.record_undo_state)
+        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,cursor_move_callback=self.update_cursor_position,newpick_callback=self.new_point_3d,focus_changed_callback=lambda x: self.change_point_focus('3d',x),resize_callback=self.update_vtk_size,pre_move_callback=self.record_undo_state,interaction_callback=self.on_3d_interaction)
         self.qvtkwidget_3d.SetInteractorStyle(self.interactor3d)
         self.renderer_3d = vtk.vtkRenderer()
         self.renderer_3d.SetBackground(0, 0, 0)
@@ -123,6 +123,13 @@ class FittingCalib(CalcamGUIWindow):
         self.comparison_overlay_opacity_slider.valueChanged.connect(self.change_comparison_colour)
         self.rendertype_edges.toggled.connect(self.toggle_wireframe)
 
+        # The full quality fit overlay is rendered when the fit hasn't changed for a little while;
+        # until then a quick preview is shown.
+        self.overlay_render_timer = qt.QTimer()
+        self.overlay_render_timer.setSingleShot(True)
+        self.overlay_render_timer.setInterval(750)
+        self.overlay_render_timer.timeout.connect(self.render_fit_overlay)
+
         self.control_sensitivity_slider.valueChanged.connect(lambda x: self.interactor3d.set_control_sensitivity(x*0.01))
         self.rmb_rotate.toggled.connect(self.interactor3d.set_rmb_rotate)
         self.interactor3d.set_control_sensitivity(self.control_sensitivity_slider.value()*0.01)
@@ -178,7 +185,10 @@ class FittingCalib(CalcamGUIWindow):
         self.fit_settings_widgets = []
 
         self.fit_overlay = None
+        self.fit_overlay_preview = False
         self.comp_overlay = None
+        self.wireframe_preview = None
+        self.wireframe_preview_features = None
 
         self.chessboard_history = []
 
@@ -251,38 +261,20 @@ class FittingCalib(CalcamGUIWindow):
                 raise UserWarning('The selected calibration has different image dimensions ({:d} x {:d}) to the current calibration ({:d} x {:d}), so cannot be used to compare!'.format(comp_shape[0],comp_shape[1],curr_shape[0],curr_shape[1]))
 
             self.comp_calib = cal
+            self.comp_overlay = None
             self.comparison_overlay_checkbox.setEnabled(True)
             self.comparison_overlay_checkbox.setChecked(True)
             self.comparison_name.setText(('...' + cal.filename[-25:]) if len(cal.filename) > 28 else cal.filename)
 
+            # If the checkbox was already ticked, setChecked() doesn't trigger an update,
+            # so start rendering the new calibration's overlay here.
+            self.update_overlay()
+
         elif self.comp_calib is None:
             self.comparison_overlay_checkbox.setChecked(False)
             self.comparison_overlay_checkbox.setEnabled(False)
 
 
-
-            oversampling = int(np.ceil(min(1000 / np.array(self.calibration.geometry.get_display_shape()))))
-
-            fname = cal.filename
-
-            self.statusbar.showMessage('Rendering wireframe overlay...')
-            self.app.setOverrideCursor(qt.QCursor(qt.Qt.WaitCursor))
-            self.app.processEvents()
-
-            orig_colours = self.cadmodel.get_colour()
-            if self.comparison_overlay_type.currentIndex() == 0:
-                self.cadmodel.set_wireframe(True)
-            self.cadmodel.set_colour((1,1,1))
-            self.comp_overlay = render_cam_view(self.cadmodel,cal,transparency=True,verbose=False,aa=2,oversampling=oversampling)
-            self.cadmodel.set_colour(orig_colours)
-            self.cadmodel.set_wireframe(False)
-
-            self.statusbar.clearMessage()
-            self.app.restoreOverrideCursor()
-            self.comparison_overlay_checkbox.setEnabled(True)
-            self.comparison_overlay_checkbox.setChecked(True)
-
-
     def toggle_wireframe(self,wireframe):
 
         if self.cadmodel is not None:
@@ -1240,6 +1232,7 @@ class FittingCalib(CalcamGUIWindow):
 
         self.app.setOverrideCursor(qt.QCursor(qt.Qt.WaitCursor))
         self.fitted_points_checkbox.setChecked(False)
+        show_overlay = self.overlay_checkbox.isChecked()
         self.overlay_checkbox.setChecked(False)
         self.fit_overlay = None
 
@@ -1255,6 +1248,10 @@ class FittingCalib(CalcamGUIWindow):
 
         self.update_fit_results()
 
+        # If the user was looking at the overlay, keep showing it for the new fit.
+        if show_overlay and self.overlay_checkbox.isEnabled():
+            self.overlay_checkbox.setChecked(True)
+
         self.app.restoreOverrideCursor()
         if self.tabWidget.isHidden():
             dialog = qt.QMessageBox(self)
@@ -1268,29 +1265,6 @@ class FittingCalib(CalcamGUIWindow):
         self.unsaved_changes = True
 
 
-    def render_overlay_image(self,calibration,wireframe):
-
-        oversampling = int(np.ceil(min(1000/np.array(calibration.geometry.get_display_shape()))))
-
-        self.statusbar.showMessage('Rendering CAD image overlay...')
-        self.app.setOverrideCursor(qt.QCursor(qt.Qt.WaitCursor))
-        self.app.processEvents()
-
-        orig_colours = self.cadmodel.get_colour()
-
-        self.cadmodel.set_wireframe(wireframe)
-        self.cadmodel.set_colour((1, 1, 1))
-        image = render_cam_view(self.cadmodel, calibration, transparency=True, verbose=False, aa=2,oversampling=oversampling)
-        self.cadmodel.set_colour(orig_colours)
-        self.cadmodel.set_wireframe(self.rendertype_edges.isChecked())
-
-        self.statusbar.clearMessage()
-        self.app.restoreOverrideCursor()
-
-        return image
-
-
-
     def update_overlay(self):
 
         # Clear the existing overlay image to force it to re-render if the user has changed between solid / wireframe
@@ -1311,13 +1285,18 @@ class FittingCalib(CalcamGUIWindow):
             self.fitted_points_checkbox.setChecked(False)
 
             if self.fit_overlay is None:
-                self.fit_overlay = self.render_overlay_image(self.calibration,self.overlay_type.currentIndex() == 0)
-
-                if np.max(self.fit_overlay) == 0:
-                    self.show_msgbox('CAD model overlay result is a blank image.','This usually means the fit is wildly wrong.')
+                if self.overlay_type.currentIndex() == 0:
+                    # Show a quick preview of the wireframe now, and do the full render when the fit stops changing.
+                    self.fit_overlay = self.get_wireframe_preview().project(self.calibration,oversampling=self.get_overlay_oversampling(self.calibration),aa=self.overlay_aa)
+                    self.fit_overlay_preview = True
+                    self.overlay_render_timer.start()
+                else:
+                    # Render in the background; this is called again when the image is ready.
+                    self.render_fit_overlay()
 
-            # Apply desired colour (stored as a list in self.config.main_overlay_colour)
-            overlay_ims.append( (self.fit_overlay * np.tile(np.array(self.config.main_overlay_colour)[np.newaxis,np.newaxis,:],self.fit_overlay.shape[:2] + (1,))).astype(np.uint8) )
+            if self.fit_overlay is not None:
+                # Apply desired colour (stored as a list in self.config.main_overlay_colour)
+                overlay_ims.append( (self.fit_overlay * np.tile(np.array(self.config.main_overlay_colour)[np.newaxis,np.newaxis,:],self.fit_overlay.shape[:2] + (1,))).astype(np.uint8) )
 
 
         if self.comparison_overlay_checkbox.isChecked():
@@ -1325,10 +1304,10 @@ class FittingCalib(CalcamGUIWindow):
             self.comparison_overlay_appearance.show()
 
             if self.comp_overlay is None:
-                self.comp_overlay = self.render_overlay_image(self.comp_calib,self.comparison_overlay_type.currentIndex() == 0)
-
-            # Apply desired colour (stored as a list in self.config.second_overlay_colour)
-            overlay_ims.append( (self.comp_overlay * np.tile(np.array(self.config.second_overlay_colour)[np.newaxis, np.newaxis, :],self.fit_overlay.shape[:2] + (1,))).astype(np.uint8) )
+                self.render_overlay_image(self.comp_calib,self.comparison_overlay_type.currentIndex() == 0,lambda image: self.set_overlay_image('comparison',image),queue='comp_overlay')
+            else:
+                # Apply desired colour (stored as a list in self.config.second_overlay_colour)
+                overlay_ims.append( (self.comp_overlay * np.tile(np.array(self.config.second_overlay_colour)[np.newaxis, np.newaxis, :],self.comp_overlay.shape[:2] + (1,))).astype(np.uint8) )
 
         self.interactor2d.set_overlay_image(overlay_ims)
 
@@ -1336,6 +1315,42 @@ class FittingCalib(CalcamGUIWindow):
 
 
 
+    def render_fit_overlay(self):
+
+        if self.overlay_checkbox.isChecked() and (self.fit_overlay is None or self.fit_overlay_preview):
+            self.render_overlay_image(self.calibration,self.overlay_type.currentIndex() == 0,lambda image,depth: self.set_overlay_image('fit',image,depth),queue='fit_overlay',depth=True)
+
+
+    def get_wireframe_preview(self):
+
+        # Edges are re-extracted if the enabled model features change
+        features = self.cadmodel.get_enabled_features()
+        if self.wireframe_preview is None or features != self.wireframe_preview_features:
+            self.wireframe_preview = render._WireframeProjector(self.cadmodel)
+            self.wireframe_preview_features = features
+
+        return self.wireframe_preview
+
+
+    def set_overlay_image(self,which,image,depth=None):
+
+        if which == 'fit':
+            self.fit_overlay = image
+            self.fit_overlay_preview = False
+
+            # The depth map from the full render is used for hidden line removal in future previews
+            if depth is not None:
+                self.get_wireframe_preview().set_depth_map(self.calibration,depth,aa=self.overlay_aa)
+
+            if self.overlay_checkbox.isChecked() and np.max(self.fit_overlay) == 0:
+                self.show_msgbox('CAD model overlay result is a blank image.','This usually means the fit is wildly wrong.')
+        else:
+            self.comp_overlay = image
+
+        self.update_overlay()
+
+
+
     def update_n_points(self):
 
         self.n_points = []
@@ -26,7 +26,7 @@ import matplotlib.cm
 
 from .core import *
 from .vtkinteractorstyles import CalcamInteractorStyle2D, CalcamInteractorStyle3D
-from ..render import render_cam_view,get_wall_coverage_actor,render_hires
+from ..render import get_wall_coverage_actor,render_hires
 from ..coordtransformer import CoordTransformer
 from ..raycast import raycast_sightlines
 from ..image_enhancement import enhance_image, scale_to_8bit
@@ -57,7 +57,7 @@ class ImageAnalyser(CalcamGUIWindow):
         # Set up VTK
         self.qvtkwidget_3d = qt.QVTKRenderWindowInteractor(self.vtkframe_3d)
         self.vtkframe_3d.layout().addWidget(self.qvtkwidget_3d)
-        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,resize_callback=self.update_vtk_size,newpick_callback=self.update_from_3d,cursor_move_callback=lambda cid,coords: self.update_from_3d(coords))
+        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,resize_callback=self.update_vtk_size,newpick_callback=self.update_from_3d,cursor_move_callback=lambda cid,coords: self.update_from_3d(coords),interaction_callback=self.on_3d_interaction)
         self.interactor3d.allow_focus_change = False
         self.qvtkwidget_3d.SetInteractorStyle(self.interactor3d)
         self.renderer_3d = vtk.vtkRenderer()
@@ -275,15 +275,25 @@ class ImageAnalyser(CalcamGUIWindow):
 
     def update_from_3d(self,coords_3d):
 
+        if self.calibration is not None and self.image is not None and coords_3d is not None:
+
+            self.cursor_closeup_button.setEnabled(True)
+
+            # Projecting the point and checking if it's hidden can be slow for big models,
+            # so do that in the background and draw the cursors when it's done.
+            self.jobs.submit('cursor',find_cursor_positions,args=(self.calibration,self.get_raycast_cadmodel(),coords_3d),on_result=lambda positions: self.show_cursors(coords_3d,*positions))
+
+
+
+    def show_cursors(self,coords_3d,image_pos,image_pos_nocheck,intersections):
+
         # Sight line drawing style
         visible_linewidth = 3
         visible_colour = (0,0.8,0)
         invisible_linewidth = 1
         invisible_colour = (1.,0,1.)
 
-        if self.calibration is not None and self.image is not None and coords_3d is not None:
-
-            self.cursor_closeup_button.setEnabled(True)
+        if self.calibration is not None and self.image is not None:
 
             # Clear anything which already exists
             if self.cursor_ids['3d'] is not None:
@@ -303,32 +313,22 @@ class ImageAnalyser(CalcamGUIWindow):
             self.sightline_actors = []
 
 
-            intersection_coords = None
-
             visible = [False] * self.calibration.n_subviews
 
-            # Find where the cursor(s) is/are in 2D.
-            image_pos_nocheck = self.calibration.project_points([coords_3d],coords='original')
-
-            image_pos = self.calibration.project_points([coords_3d],check_occlusion_with=self.cadmodel,occlusion_tol=1e-2,coords='original')
-
             for i in range(len(image_pos)):
-                image_pos[i][0][:] = self.calibration.geometry.original_to_display_coords(*image_pos[i][0])
-                image_pos_nocheck[i][0][:] = self.calibration.geometry.original_to_display_coords(*image_pos_nocheck[i][0])
 
                 if np.any(np.isnan(image_pos_nocheck[i])):
                     visible[i] = False
                     continue
 
-                raydata = raycast_sightlines(self.calibration,self.cadmodel,image_pos_nocheck[i][0,0],image_pos_nocheck[i][0,1],verbose=False,force_subview=i)
-                visible[i] =True
+                visible[i] = True
 
                 if self.mov_correction is not None:
                     image_pos_nocheck[i][0][:] = self.mov_correction.ref_to_moved_coords(*image_pos_nocheck[i][0])
 
                 if np.any(np.isnan(image_pos[i])):
                     visible[i] = False
-                    intersection_coords = raydata.ray_end_coords
+                    intersection_coords = intersections[i]
 
                 if visible[i]:
 
@@ -431,8 +431,7 @@ class ImageAnalyser(CalcamGUIWindow):
                     if self.calibration.subview_lookup(*coords) == -1:
                         raise UserWarning('The clicked position is outside the calibrated field of view.')
                     elif np.any(coords != self.coords_2d[i]):
-                        raydata = raycast_sightlines(self.calibration,self.cadmodel,coords[0],coords[1],coords='Display',verbose=False)
-                        self.update_from_3d(raydata.ray_end_coords[0,:])
+                        self.jobs.submit('cursor',raycast_sightlines,args=(self.calibration,self.get_raycast_cadmodel(),coords[0],coords[1]),kwargs={'coords':'Display','verbose':False},on_result=lambda raydata: self.update_from_3d(raydata.ray_end_coords[0,:]))
                         break
 
 
@@ -873,15 +872,18 @@ class ImageAnalyser(CalcamGUIWindow):
         if self.overlay_checkbox.isChecked():
 
             if self.overlay is None:
-                self.overlay = self.render_overlay_image(self.overlay_type_box.currentIndex() == 0)
-
-            # Apply desired colour
-            im = (self.overlay * np.tile(np.array(self.overlay_colour)[np.newaxis, np.newaxis, :], self.overlay.shape[:2] + (1,))).astype(np.uint8)
+                # Render in the background; this is called again when the image is ready.
+                self.render_overlay_image(self.calibration,self.overlay_type_box.currentIndex() == 0,self.set_overlay_image)
+                self.interactor2d.set_overlay_image(None)
 
-            if self.mov_correction is not None:
-                self.interactor2d.set_overlay_image(self.mov_correction.warp_ref_to_moved(im)[0])
             else:
-                self.interactor2d.set_overlay_image(im)
+                # Apply desired colour
+                im = (self.overlay * np.tile(np.array(self.overlay_colour)[np.newaxis, np.newaxis, :], self.overlay.shape[:2] + (1,))).astype(np.uint8)
+
+                if self.mov_correction is not None:
+                    self.interactor2d.set_overlay_image(self.mov_correction.warp_ref_to_moved(im)[0])
+                else:
+                    self.interactor2d.set_overlay_image(im)
 
 
         else:
@@ -907,26 +909,10 @@ class ImageAnalyser(CalcamGUIWindow):
             self.update_overlay()
 
 
-    def render_overlay_image(self,wireframe):
-
-        oversampling = int(np.ceil(min(1000/np.array(self.calibration.geometry.get_display_shape()))))
-
-        self.statusbar.showMessage('Rendering CAD image overlay...')
-        self.app.setOverrideCursor(qt.QCursor(qt.Qt.WaitCursor))
-        self.app.processEvents()
+    def set_overlay_image(self,image):
 
-        orig_colours = self.cadmodel.get_colour()
-
-        self.cadmodel.set_wireframe(wireframe)
-        self.cadmodel.set_colour((1, 1, 1))
-        image = render_cam_view(self.cadmodel, self.calibration, transparency=True, verbose=False, aa=2,oversampling=oversampling)
-        self.cadmodel.set_colour(orig_colours)
-        self.cadmodel.set_wireframe(False)
-
-        self.statusbar.clearMessage()
-        self.app.restoreOverrideCursor()
-
-        return image
+        self.overlay = image
+        self.update_overlay()
 
 
 
@@ -1035,4 +1021,28 @@ class ImageAnalyser(CalcamGUIWindow):
 
         self.impos_info.setText(iminfo_str)
         self.sightline_info.setText(sightline_info_string)
-        self.cadpos_info.setText(cadinfo_str)
\ No newline at end of file
+        self.cadpos_info.setText(cadinfo_str)
+
+
+def find_cursor_positions(calibration,cadmodel,coords_3d):
+    '''
+    Find where a 3D point appears in the image, both with and without checking
+    whether it is hidden by the CAD model, and where each sub-view's sight line to the
+    point first hits the CAD model. This is run in a background thread by ImageAnalyser.
+    '''
+    # Find where the cursor(s) is/are in 2D.
+    image_pos_nocheck = calibration.project_points([coords_3d],coords='original')
+
+    image_pos = calibration.project_points([coords_3d],check_occlusion_with=cadmodel,occlusion_tol=1e-2,coords='original')
+
+    intersections = [None] * len(image_pos)
+
+    for i in range(len(image_pos)):
+        image_pos[i][0][:] = calibration.geometry.original_to_display_coords(*image_pos[i][0])
+        image_pos_nocheck[i][0][:] = calibration.geometry.original_to_display_coords(*image_pos_nocheck[i][0])
+
+        if not np.any(np.isnan(image_pos_nocheck[i])):
+            raydata = raycast_sightlines(calibration,cadmodel,image_pos_nocheck[i][0,0],image_pos_nocheck[i][0,1],verbose=False,force_subview=i)
+            intersections[i] = raydata.ray_end_coords
+
+    return image_pos,image_pos_nocheck,intersections
@@ -20,7 +20,6 @@ permissions and limitations under the Licence.
 '''
 import os
 
-import cv2
 import vtk
 import numpy as np
 
@@ -277,14 +276,9 @@ class ImageAlignDialog(qt.QDialog):
                 new_points[i,:] = self.interactor_new.get_cursor_coords(pp[1])[0]
 
 
-        try:
-            # First try the call for newer versions of OpenCV (not sure exactly when it changed?)
-            m = np.matrix(cv2.estimateAffinePartial2D(new_points, ref_points)[0])
-        except AttributeError:
-            # If that fails, try the older style call instead
-            m = np.matrix(cv2.cv2.estimateAffinePartial2D(new_points, ref_points)[0])
+        m = movement.estimate_transform(ref_points, new_points)
 
-        if m[0,0] is None:
+        if m is None:
             self.transform = None
             self.fitted_points_checkbox.setEnabled(False)
             self.transform_params.hide()
@@ -22,8 +22,9 @@
 import os
 import sys
 import cv2
+import vtk
 
-from .. import __version__, vtk
+from .. import __version__
 from .core import guipath
 from ..misc import DodgyDict, open_file
 from ..config import CalcamConfig
@@ -57,7 +57,7 @@ class Viewer(CalcamGUIWindow):
         # Set up VTK
         self.qvtkwidget_3d = qt.QVTKRenderWindowInteractor(self.vtk_frame)
         self.vtk_frame.layout().addWidget(self.qvtkwidget_3d,0,0,1,2)
-        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,newpick_callback=self.add_cursor,cursor_move_callback=self.update_cursor_position,resize_callback=self.on_resize,save_coords_callback=self.save_cursor_coords)
+        self.interactor3d = CalcamInteractorStyle3D(refresh_callback=self.refresh_3d,viewport_callback=self.update_viewport_info,newpick_callback=self.add_cursor,cursor_move_callback=self.update_cursor_position,resize_callback=self.on_resize,save_coords_callback=self.save_cursor_coords,interaction_callback=self.on_3d_interaction)
         self.qvtkwidget_3d.SetInteractorStyle(self.interactor3d)
         self.renderer_3d = vtk.vtkRenderer()
         self.renderer_3d.SetBackground(0, 0, 0)
@@ -865,8 +865,16 @@ class Viewer(CalcamGUIWindow):
                 extra_actors.append(self.contour_actor)
 
             coords = ['Display','Original'][ self.render_coords_combobox.currentIndex()]
-            
-            im = render.render_cam_view(self.cadmodel,self.render_calib,extra_actors = extra_actors,oversampling=oversampling,aa=aa,transparency=use_transparency,verbose=False,coords=coords)
+
+            # Render in a background process so the GUI doesn't freeze, and save the result when it's done.
+            model_state = render._get_cadmodel_state(self.cadmodel)
+            extra_actor_states = []
+            for actor in extra_actors:
+                extra_actor_states = extra_actor_states + render._get_actor_state(actor)
+
+            self.app.restoreOverrideCursor()
+            self.jobs.submit('render:{:s}'.format(filename),render._render_cam_view_from_state,args=(model_state,self.render_calib,extra_actor_states),kwargs={'oversampling':oversampling,'aa':aa,'transparency':use_transparency,'coords':coords},on_result=lambda im: self.save_render(im,filename),on_error=self.render_failed,process=True)
+            return
 
         elif self.render_unfolded_view.isChecked():
 
@@ -897,13 +905,24 @@ class Viewer(CalcamGUIWindow):
                 return
             render_dialog.accept()
 
+        self.app.restoreOverrideCursor()
+        self.save_render(im,filename)
+
+
+    def render_failed(self,error):
+
+        self.statusbar.clearMessage()
+        raise error
+
+
+    def save_render(self,im,filename):
+
         # Save the image!
         im[:,:,:3] = im[:,:,2::-1]
         result = cv2.imwrite(filename,im)
 
         self.renderer_3d.Render()
 
-        self.app.restoreOverrideCursor()
         self.statusbar.clearMessage()
 
         if not result:
@@ -42,7 +42,7 @@ import time
 
 class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
  
-    def __init__(self,parent=None,viewport_callback=None,resize_callback=None,newpick_callback=None,cursor_move_callback=None,focus_changed_callback=None,refresh_callback=None,pre_move_callback=None,save_coords_callback=None):
+    def __init__(self,parent=None,viewport_callback=None,resize_callback=None,newpick_callback=None,cursor_move_callback=None,focus_changed_callback=None,refresh_callback=None,pre_move_callback=None,save_coords_callback=None,interaction_callback=None):
 
         # Set callbacks for all the mouse controls
         self.AddObserver("LeftButtonPressEvent",self.on_left_click)
@@ -54,6 +54,10 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
         self.AddObserver("MouseWheelBackwardEvent",self.zoom_out)
         self.AddObserver("MouseMoveEvent",self.on_mouse_move)
 
+        # These are sent by VTK when mouse drags start and finish
+        self.AddObserver("StartInteractionEvent",lambda obj,event: self.on_interaction(True))
+        self.AddObserver("EndInteractionEvent",lambda obj,event: self.on_interaction(False))
+
         self.viewport_callback = viewport_callback
         self.pick_callback = newpick_callback
         self.resize_callback = resize_callback
@@ -64,6 +68,7 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
         self.focus_changed_callback = focus_changed_callback
         self.pre_move_callback = pre_move_callback
         self.save_coords_callback = save_coords_callback
+        self.interaction_callback = interaction_callback
         self.image_actor = None
         self.image_resizer = None
         self.force_aspect = None
@@ -176,6 +181,7 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
                 self.save_coords_callback()
 
         if direction is not None:
+            self.on_interaction(True)
             current_fp = self.camera.GetFocalPoint()
             view_vect = np.array(current_fp) - np.array(self.camera.GetPosition())
             view_centre = np.zeros(3)
@@ -285,6 +291,8 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
 
     def zoom_in(self,obj,event):
 
+        self.on_interaction(True)
+
         # If ctrl + scroll, change the camera FOV
         if self.interactor.GetControlKey():
             if self.zoom_enabled:
@@ -308,6 +316,8 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
 
     def zoom_out(self,obj,event):
 
+        self.on_interaction(True)
+
         # If ctrl + scroll, change the camera FOV
         if self.interactor.GetControlKey():
             if self.zoom_enabled:
@@ -327,6 +337,15 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
         self.on_cam_moved()
 
 
+    # Tell the GUI when the camera starts or stops moving, so it can
+    # e.g. show the CAD model in less detail while moving.
+    # For single step moves (mouse wheel or keyboard) we only say the camera
+    # has started moving, and the GUI has to decide when it has stopped.
+    def on_interaction(self,moving):
+        if self.interaction_callback is not None:
+            self.interaction_callback(moving)
+
+
     def on_cam_moved(self):
         self.update_cursor_style(refresh=False)
         self.update_clipping()
@@ -392,6 +411,9 @@ class CalcamInteractorStyle3D(vtk.vtkInteractorStyleTerrain):
         clicked_cursor = None
         pickcoords = None
 
+        # Make sure the CAD model is back to full detail before picking
+        self.on_interaction(False)
+
         # Do a pick with our picker object
         clickcoords = self.interactor.GetEventPosition()
         
@@ -26,6 +26,8 @@ Sam Van Stroud, Jamie McGowan, Augustin Marignier, Emily Nurse & Christian Gutsc
 in a collaboration between UKAEA and University College London.
 """
 import warnings
+import hashlib
+import collections
 
 import cv2
 import numpy as np
@@ -68,12 +70,26 @@ def scale_to_8bit(image,cutoff=0.999):
     return np.uint8(255 * image)
 
 
-def enhance_image(image,target_msb=25,target_noise=500,tiles=(20,20),downsample=False,median=False,bilateral=False):
+# Maximum number of enhanced images to keep in the cache used by enhance_image()
+cache_size = 8
+
+# Cache of enhanced images, keyed by image content and enhancement settings
+_result_cache = collections.OrderedDict()
+
+# Enhancement parameters most recently determined for each image shape & settings,
+# for re-use by enhance_image() in fast mode.
+_params_cache = {}
+
+
+def enhance_image(image,target_msb=25,target_noise=500,tiles=(20,20),downsample=False,median=False,bilateral=False,fast=False):
     """
     Enhance details in a given image. Used both for visual enhancement
     in the Calcam GUIs and as a pre-processing step for automatic camera
     movement detection.
 
+    Results are cached by image content, so enhancing the same image again
+    with the same settings returns the cached result without re-calculating it.
+
     Parameters:
         image (np.ndarray)   : Image to enhance
         target_msb (float)   : Controls contrast enhancement. Higher numbers \
@@ -86,11 +102,21 @@ def enhance_image(image,target_msb=25,target_noise=500,tiles=(20,20),downsample=
                                using cv2.pyrDown(). Using this greatly increases the \
                                success of automatic point detection, but makes the images \
                                look worse by eye due to the lower resolution.
+        fast (bool)          : If True, re-use the contrast enhancement and de-noising parameters \
+                               determined for a previous image of the same size and similar brightness \
+                               and contrast, instead of searching for the best parameters again. This is much \
+                               faster when enhancing many similar images, e.g. video frames.
 
     Returns:
 
         np.ndarray : The processed image.
     """
+    settings = (tuple(tiles),target_msb,target_noise,downsample,median,bilateral)
+
+    cache_key = (hashlib.sha1(np.ascontiguousarray(image)).hexdigest(),image.shape,image.dtype.str) + settings
+    if cache_key in _result_cache:
+        _result_cache.move_to_end(cache_key)
+        return _result_cache[cache_key].copy()
 
     # Make sure we have an 8-bit unisnged int image.
     if image.dtype != np.uint8:
@@ -115,26 +141,84 @@ def enhance_image(image,target_msb=25,target_noise=500,tiles=(20,20),downsample=
     if median:
         image = cv2.medianBlur(image,ksize=3)
 
+    # See if we can re-use previously determined parameters
+    mean,std = [float(x) for x in cv2.meanStdDev(image)]
+    params_key = settings + (image.shape,)
+    params = None
+    if fast and params_key in _params_cache:
+        params = _params_cache[params_key]
+        if abs(mean - params['mean']) > 0.1*params['std'] + 1 or abs(std - params['std']) > 0.1*params['std'] + 1:
+            params = None
+
+    if params is None:
+        params = {'mean':mean,'std':std,'cliplim':_find_cliplim(image,target_msb,tiles)}
+
+    if params['cliplim'] is None:
+        result = image.copy()
+    else:
+        result = cv2.createCLAHE(params['cliplim'], tiles).apply(image)
+
+    if bilateral:
+        result = cv2.bilateralFilter(result,d=-1,sigmaColor=25,sigmaSpace=25)
+
+    nlm_win_size = int(np.mean([image.shape[0] / 100, image.shape[1] / 100]))
+
+    if 'nlm_strength' not in params:
+        params['nlm_strength'] = _find_nlm_strength(image,result,target_noise,nlm_win_size)
+        _params_cache[params_key] = params
+
+    if params['nlm_strength'] is not None:
+        result = cv2.fastNlMeansDenoising(result,h=params['nlm_strength'],searchWindowSize=nlm_win_size)
+
+    if mono:
+        result = np.tile(result[:,:,np.newaxis],(1,1,3))
+    else:
+        image_lab[:,:,0] = result
+        result = cv2.cvtColor(image_lab,cv2.COLOR_LAB2RGB)
+
+    _result_cache[cache_key] = result
+    while len(_result_cache) > cache_size:
+        _result_cache.popitem(last=False)
+
+    return result.copy()
+
+
+
+def _find_cliplim(image,target_msb,tiles):
+    """
+    Find the CLAHE clip limit which gives the desired local contrast for a given image.
+
+    Returns:
+
+        float or NoneType : Clip limit, or None if CLAHE should not be applied.
+    """
     test_clip_lims = [1.,5.,10.]
     contrast = []
 
     for cliplim in test_clip_lims:
         contrast.append( local_contrast( cv2.createCLAHE(cliplim, tiles).apply(image), tiles) )
 
-    result = image.copy()
     if max(contrast) - min(contrast) > 0:
         coefs = np.polyfit(contrast,test_clip_lims,2)
         best_cliplim = np.polyval(coefs,target_msb)
         if best_cliplim > 0:
-            result = cv2.createCLAHE(best_cliplim, tiles).apply(image)
+            return best_cliplim
+        else:
+            return None
     else:
-        result = cv2.createCLAHE(1, tiles).apply(image)
+        return 1.
+
 
-    if bilateral:
-        result = cv2.bilateralFilter(result,d=-1,sigmaColor=25,sigmaSpace=25)
 
+def _find_nlm_strength(image,result,target_noise,nlm_win_size):
+    """
+    Find the non-local means de-noising strength which gives the desired noise level.
+
+    Returns:
+
+        float or NoneType : De-noising strength, or None if no de-noising should be applied.
+    """
     starting_noise = cv2.Laplacian(image,cv2.CV_64F).var()
-    nlm_win_size = int(np.mean([image.shape[0] / 100, image.shape[1] / 100]))
 
     if starting_noise > target_noise and nlm_win_size > 1 and min(image.shape) > 512:
         test_strengths = [1.,10.,20.,30.]
@@ -150,14 +234,9 @@ def enhance_image(image,target_msb=25,target_noise=500,tiles=(20,20),downsample=
         best_strength = tan_shape(target_noise,*tanparams)
 
         if best_strength > 0:
-            result = cv2.fastNlMeansDenoising(result,h=best_strength,searchWindowSize=nlm_win_size)
-    if mono:
-        result = np.tile(result[:,:,np.newaxis],(1,1,3))
-    else:
-        image_lab[:,:,0] = result
-        result = cv2.cvtColor(image_lab,cv2.COLOR_LAB2RGB)
+            return best_strength
 
-    return result
+    return None
 
 
 
@@ -177,15 +256,31 @@ def local_contrast(image,tilegridsize=(20,20)):
     """
     tile_height = int(np.ceil(image.shape[0] / tilegridsize[1]))
     tile_width = int(np.ceil(image.shape[1] / tilegridsize[0]))
-    sb = []
 
-    for i in range(tilegridsize[1]):
-        for j in range(tilegridsize[0]):
-            sample = image[i*tile_height:(i+1)*tile_height,j*tile_width:(j+1)*tile_width]
-            if len(np.unique(sample)) > 1:
-                sb.append(sample.std())
+    # Tile edges, where tiles at the bottom and right of the image may be smaller or empty.
+    y_edges = np.minimum(np.arange(tilegridsize[1] + 1) * tile_height, image.shape[0])
+    x_edges = np.minimum(np.arange(tilegridsize[0] + 1) * tile_width, image.shape[1])
+
+    # Sums of pixel values and their squares over every tile, from integral images.
+    image = image.reshape(image.shape[0],image.shape[1],-1).astype(np.float64)
+    n_channels = image.shape[2]
+    tile_sums = []
+    for values in [image, image**2]:
+        integral = np.zeros((image.shape[0] + 1,image.shape[1] + 1))
+        integral[1:,1:] = values.sum(axis=2).cumsum(axis=0).cumsum(axis=1)
+        integral = integral[y_edges,:][:,x_edges]
+        tile_sums.append(integral[1:,1:] - integral[:-1,1:] - integral[1:,:-1] + integral[:-1,:-1])
+
+    n = np.outer(np.diff(y_edges),np.diff(x_edges)) * n_channels
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        mean = tile_sums[0] / n
+        var = tile_sums[1] / n - mean**2
+
+    # Only include tiles which are not uniform
+    sb = np.sqrt(var[(n > 0) & (var > 1e-10 * (mean**2 + 1))])
 
-    if len(sb) == 0:
+    if sb.size == 0:
         sb = [0]
 
     return np.nanmean(sb)
@@ -25,9 +25,25 @@ import os
 import shutil
 import hashlib
 import atexit
+import struct
+import copy
 
 from .misc import import_source,unload_source
 
+
+# Whether to compress files in the .large directory of save files (i.e. CAD model
+# mesh files) when they are written. Storing them uncompressed makes bigger files
+# which are faster to open. This only applies to new or changed files: files which
+# are already in a save file keep their existing compression, unless the whole file
+# is re-written by calling ZipSaveFile.update(recompress=True).
+compress_large_files = True
+
+# Files in save files smaller than this (in bytes) have their contents hashed
+# when the file is opened, so that files which are re-written with exactly the
+# same contents are not counted as changed. Larger files are counted as changed
+# if their size or modification time change.
+hash_size_limit = 1024**2
+
 # Get a list of directory contents, including sub-directories.
 # Returned list has absolute paths.
 def listdir(path):
@@ -59,6 +75,71 @@ def md5_file(filename):
     return hasher.digest()
 
 
+# Copy a member from one zip file to another which is open for writing, without
+# decompressing and re-compressing its contents. Returns False without writing
+# anything if this cannot be done for the given member.
+# This needs the internals of zipfile.ZipFile, so checks they are as expected first.
+def _copy_raw_member(src_zip,dst_zip,zinfo):
+
+    # Encrypted members are not supported
+    if zinfo.flag_bits & 0x1:
+        return False
+
+    if not all([hasattr(dst_zip,attr) for attr in ['fp','start_dir','filelist','NameToInfo','_didModify']]) or not hasattr(src_zip,'fp'):
+        return False
+
+    # Can't write while another member is being written through ZipFile.open()
+    if getattr(dst_zip,'_writing',False):
+        return False
+
+    # Find where the member's data starts, after its local file header
+    src_zip.fp.seek(zinfo.header_offset)
+    header = src_zip.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        return False
+    fname_length,extra_length = struct.unpack('<HH',header[26:30])
+    src_zip.fp.seek(fname_length + extra_length,1)
+
+    # The new local header contains the CRC and sizes directly rather than using a data descriptor,
+    # and any ZIP64 information is re-generated for the new file.
+    new_zinfo = copy.copy(zinfo)
+    new_zinfo.flag_bits = zinfo.flag_bits & ~0x08
+    new_zinfo.extra = _strip_zip64_extra(zinfo.extra)
+
+    dst_zip.fp.seek(dst_zip.start_dir)
+    new_zinfo.header_offset = dst_zip.fp.tell()
+    dst_zip.fp.write(new_zinfo.FileHeader())
+
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        data = src_zip.fp.read(min(remaining,1024**2))
+        if len(data) == 0:
+            raise IOError('Unexpected end of file reading "{:s}" from {:s}'.format(zinfo.filename,src_zip.filename))
+        dst_zip.fp.write(data)
+        remaining = remaining - len(data)
+
+    dst_zip.filelist.append(new_zinfo)
+    dst_zip.NameToInfo[new_zinfo.filename] = new_zinfo
+    dst_zip.start_dir = dst_zip.fp.tell()
+    dst_zip._didModify = True
+
+    return True
+
+
+# Remove any ZIP64 extended information from a zip member's extra field data.
+def _strip_zip64_extra(extra):
+
+    stripped = b''
+    i = 0
+    while i + 4 <= len(extra):
+        field_id,field_length = struct.unpack('<HH',extra[i:i+4])
+        if field_id != 0x0001:
+            stripped = stripped + extra[i:i+4+field_length]
+        i = i + 4 + field_length
+
+    return stripped
+
+
 # Class for Zip file based save files.
 class ZipSaveFile():
 
@@ -138,7 +219,7 @@ class ZipSaveFile():
 
         self.file_handles = []
         self.is_open = True
-        self.initial_hashes = self.get_hashes()
+        self._record_initial_state()
 
 
     def is_readonly(self):
@@ -146,6 +227,95 @@ class ZipSaveFile():
         return not os.access(self.filename,os.W_OK)
 
 
+    # Record the state of the extracted files, so we can tell which
+    # have been changed, added or removed since opening the file.
+    def _record_initial_state(self,previous_state={}):
+
+        self._initial_state = {}
+        for fname,file_state in self._get_file_states().items():
+            md5 = None
+            if fname in previous_state and previous_state[fname][:2] == file_state:
+                md5 = previous_state[fname][2]
+            elif file_state[0] < hash_size_limit:
+                md5 = md5_file(os.path.join(self.tempdir,fname))
+            self._initial_state[fname] = [file_state[0],file_state[1],md5]
+
+
+    # Get the size and modification time of the extracted files.
+    def _get_file_states(self):
+
+        file_states = {}
+        for fname in self.list_contents():
+            stat = os.stat(os.path.join(self.tempdir,fname))
+            file_states[fname] = (stat.st_size,stat.st_mtime_ns)
+
+        return file_states
+
+
+    # Get a list of the files which have been added or changed since opening.
+    def get_changed_files(self):
+
+        if not self.is_open:
+            raise Exception('File is not open!')
+
+        changed_files = []
+        for fname,file_state in self._get_file_states().items():
+
+            if fname not in self._initial_state:
+                changed_files.append(fname)
+                continue
+
+            size,mtime,md5 = self._initial_state[fname]
+            if (size,mtime) == file_state:
+                continue
+            elif md5 is None or size != file_state[0] or md5_file(os.path.join(self.tempdir,fname)) != md5:
+                changed_files.append(fname)
+
+        return changed_files
+
+
+    # Check whether the contents have been changed since opening.
+    def is_modified(self):
+
+        return len(self.get_changed_files()) > 0 or set(self._initial_state.keys()) != set(self.list_contents())
+
+
+    # Get the MD5 hash of a file's contents as they were when the file was opened,
+    # or None if the file was not in the save file or has been changed since.
+    # Large files are only hashed when this is called.
+    def get_initial_hash(self,fname):
+
+        if not self.is_open or fname not in self._initial_state:
+            return None
+
+        size,mtime,md5 = self._initial_state[fname]
+
+        if md5 is None:
+            try:
+                stat = os.stat(os.path.join(self.tempdir,fname))
+            except OSError:
+                return None
+            if (stat.st_size,stat.st_mtime_ns) != (size,mtime):
+                return None
+            md5 = md5_file(os.path.join(self.tempdir,fname))
+            self._initial_state[fname][2] = md5
+
+        return md5
+
+
+    # List of (file name, MD5 hash) for the file contents as they were when the file was opened.
+    @property
+    def initial_hashes(self):
+
+        hashes = []
+        for fname in sorted(self._initial_state.keys()):
+            md5 = self.get_initial_hash(fname)
+            if md5 is not None:
+                hashes.append((fname,md5))
+
+        return hashes
+
+
     def get_hashes(self):
 
         if self.is_open:
@@ -166,7 +336,7 @@ class ZipSaveFile():
 
             # If we're in write mode, and the file contents have been modified since being loaded,
             # we need to re-save the ZIP file with the new contents.
-            if 'w' in self.mode and not discard_changes and self.get_hashes() != self.initial_hashes:
+            if 'w' in self.mode and not discard_changes and self.is_modified():
                 self.update()
 
             # Make sure we properly unload any user code
@@ -185,11 +355,69 @@ class ZipSaveFile():
 
 
 
-    def update(self):
+    # Write the current contents to the file on disk. Files which have not
+    # changed since opening are copied from the existing file as-is, keeping
+    # their existing compression, unless recompress is True in which case all
+    # files are written with the current compression settings. The new file is
+    # written to a temporary file first, so the existing file is left intact
+    # if anything goes wrong.
+    def update(self,recompress=False):
+
+        unchanged_files = set()
+        if os.path.isfile(self.filename) and not recompress:
+            unchanged_files = set(self._initial_state.keys()) - set(self.get_changed_files())
+
+        tmp_filename = self.filename + '.tmp{:d}'.format(os.getpid())
+
+        try:
+            with zipfile.ZipFile(tmp_filename,'w',zipfile.ZIP_DEFLATED,True) as zf:
+
+                src_zip = zipfile.ZipFile(self.filename,'r') if len(unchanged_files) > 0 else None
+
+                try:
+                    for fname in listdir(self.tempdir):
+
+                        relpath = os.path.relpath(fname,self.tempdir)
+
+                        if relpath in unchanged_files:
+                            try:
+                                zinfo = src_zip.getinfo(relpath.replace(os.sep,'/'))
+                            except KeyError:
+                                zinfo = None
+
+                            if zinfo is not None:
+                                # If the raw data can't be copied, copy the contents with the same compression.
+                                if not _copy_raw_member(src_zip,zf,zinfo):
+                                    new_zinfo = zipfile.ZipInfo(zinfo.filename,zinfo.date_time)
+                                    new_zinfo.compress_type = zinfo.compress_type
+                                    new_zinfo.external_attr = zinfo.external_attr
+                                    zf.writestr(new_zinfo,src_zip.read(zinfo))
+                                continue
+
+                        if compress_large_files or relpath.split(os.sep)[0] != '.large':
+                            compress_type = zipfile.ZIP_DEFLATED
+                        else:
+                            compress_type = zipfile.ZIP_STORED
+
+                        zf.write(fname,relpath,compress_type=compress_type)
+                finally:
+                    if src_zip is not None:
+                        src_zip.close()
+
+            if os.path.isfile(self.filename):
+                shutil.copymode(self.filename,tmp_filename)
+
+            os.replace(tmp_filename,self.filename)
+
+        except BaseException:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            raise
 
-        with zipfile.ZipFile(self.filename,'w',zipfile.ZIP_DEFLATED,True) as zf:
-            for fname in listdir(self.tempdir):
-                zf.write(fname,os.path.relpath(fname,self.tempdir))
+        # The file on disk now matches the current contents
+        self._record_initial_state(self._initial_state)
 
 
     # Open a file inside the zip for doing stuff with.
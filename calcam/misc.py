@@ -33,6 +33,7 @@ import importlib
 import os
 import sys
 import subprocess
+import contextlib
 
 import numpy as np
 
@@ -279,6 +280,151 @@ class LoopProgPrinter:
             self.end_printed = True
 
 
+class Cancelled(Exception):
+    '''
+    Exception raised when a calculation is stopped early
+    because cancellation was requested.
+    '''
+    pass
+
+
+
+class ProgressReporter:
+    '''
+    Helper for long calculations to give progress updates to a status
+    callback without calling it more often than is useful, check
+    whether the calculation should be cancelled, and record how long
+    each stage of the calculation takes.
+
+    Parameters:
+
+        status_callback (callable) : Callable which takes a single argument to be called with status updates. \
+                                     The argument will either be a string for textual status updates or a \
+                                     float from 0 to 1 specifying the progress of the calculation. If None, \
+                                     no status updates are given.
+
+        cancel (callable)          : Callable which returns True if the calculation should be stopped early, \
+                                     in which case check_cancel() raises calcam.misc.Cancelled.
+
+        min_interval (float)       : Minimum time in seconds between progress updates. Textual status updates, \
+                                     and progress updates of 0 and 1, are always passed on.
+    '''
+    def __init__(self,status_callback=None,cancel=None,min_interval=0.5):
+
+        self.status_callback = status_callback
+        self.cancel = cancel
+        self.min_interval = min_interval
+        self.last_update = None
+
+        # List of timing records, one for each stage of the calculation.
+        self.timings = []
+
+
+    def status(self,message):
+        '''
+        Give a textual status update.
+
+        Parameters:
+
+            message (str) : Status message.
+        '''
+        if self.status_callback is not None:
+            self.status_callback(message)
+
+
+    def update(self,frac_done):
+        '''
+        Give a progress update, if it has been long enough since the last one.
+
+        Parameters:
+
+            frac_done (float) : Fraction of the calculation done, from 0 to 1.
+        '''
+        if self.status_callback is None:
+            return
+
+        now = time.time()
+        if self.last_update is None or frac_done <= 0 or frac_done >= 1 or now - self.last_update >= self.min_interval:
+            self.last_update = now
+            self.status_callback(frac_done)
+
+
+    def check_cancel(self):
+        '''
+        Raise calcam.misc.Cancelled if cancellation of the calculation has been requested.
+        '''
+        if self.cancel is not None and self.cancel():
+            raise Cancelled('Calculation cancelled.')
+
+
+    def stage(self,name,**info):
+        '''
+        Context manager to record how long a stage of the calculation takes, e.g.::
+
+            with progress.stage('cast',n_rays=n_rays):
+                ...
+
+        Adds a timing record to this object's timings list; see record_timing().
+
+        Parameters:
+
+            name (str) : Name of the stage, e.g. 'load', 'locator build', 'cast', 'matrix build' or 'render'.
+        '''
+        return record_timing(self.timings,name,**info)
+
+
+
+@contextlib.contextmanager
+def record_timing(timings,name,**info):
+    '''
+    Context manager to record how long something takes, e.g.::
+
+        with record_timing(timings,'load',filename=filename):
+            ...
+
+    A timing record is added to the given list: a dictionary with the stage name (key 'stage'), \
+    start time as a UNIX timestamp ('start'), duration in seconds ('duration') and any extra \
+    information given as keyword arguments.
+
+    Parameters:
+
+        timings (list) : List to add the timing record to.
+        name (str)     : Name of the stage, e.g. 'load', 'locator build', 'cast', 'matrix build' or 'render'.
+    '''
+    record = {'stage':name,'start':time.time(),'duration':None}
+    record.update(info)
+    timings.append(record)
+
+    start_time = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['duration'] = time.perf_counter() - start_time
+
+
+
+def format_timings(timings):
+    '''
+    Make a human readable summary of a list of timing records, such
+    as the timings attribute of a calcam.RayData or calcam.gm.GeometryMatrix.
+
+    Parameters:
+
+        timings (list of dict) : Timing records, as made by ProgressReporter.stage().
+
+    Returns:
+
+        str : Multi-line string with one line per timing record.
+    '''
+    lines = []
+    for record in timings:
+        info = ', '.join(['{:s}={:}'.format(key,value) for key,value in sorted(record.items()) if key not in ['stage','start','duration']])
+        duration = 'unfinished' if record['duration'] is None else '{:.3f} s'.format(record['duration'])
+        lines.append('{:s}: {:s}{:s}'.format(record['stage'],duration,' ({:s})'.format(info) if len(info) > 0 else ''))
+
+    return '\n'.join(lines)
+
+
 def bin_image(arr, factor,binfunc=np.mean):
     """
     Bin an image by the given factor.
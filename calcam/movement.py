@@ -39,6 +39,32 @@ from .image_enhancement import enhance_image, scale_to_8bit
 
 
 
+def estimate_transform(ref_points, new_points):
+    """
+    Estimate the 2D rigid + scale transform which maps points in a moved
+    image on to corresponding points in a reference image.
+
+    Parameters:
+        ref_points (np.ndarray) : Nx2 array of x,y coordinates in the reference image
+        new_points (np.ndarray) : Nx2 array of corresponding x,y coordinates in the moved image
+
+    Returns:
+        np.ndarray or NoneType  : 2x3 affine transform matrix, or None if the transform could not be determined.
+    """
+    try:
+        # First try the call for newer versions of OpenCV (not sure exactly when it changed?)
+        transform = cv2.estimateAffinePartial2D(new_points, ref_points)[0]
+    except AttributeError:
+        # If that fails, try the older style call instead
+        transform = cv2.cv2.estimateAffinePartial2D(new_points, ref_points)[0]
+
+    if transform is None:
+        return None
+    else:
+        return np.array(transform,dtype=np.float64)
+
+
+
 def filter_points(ref_points, new_points, n_points=50, err_limit=10):
     """
     Given sets of auto-detected corresponding points in two images,
@@ -55,21 +81,14 @@ def filter_points(ref_points, new_points, n_points=50, err_limit=10):
         np.ndarray  : Nx2 array of filtered x,y coordinates in the reference image
         np.ndarray  : Nx2 array of filtered x,y coordinates in the moved image
     """
-    try:
-        transform = np.matrix(cv2.estimateAffinePartial2D(new_points, ref_points)[0])
-    except AttributeError:
-        transform = np.matrix(cv2.cv2.estimateAffinePartial2D(new_points, ref_points)[0])
+    transform = estimate_transform(ref_points, new_points)
 
-    if transform[0,0] is None:
+    if transform is None:
         return np.array([]),np.array([])
 
-    err = []
-    for pp in range(ref_points.shape[0]):
-            oldpt = np.matrix(np.concatenate((new_points[pp,:], np.ones(1)))).T
-            fitted_pt = transform * oldpt
-            err.append( (np.sqrt( (ref_points[pp,0] - fitted_pt[0])**2 + (ref_points[pp,1] - fitted_pt[1])**2) )[0,0])
-
-    err = np.array(err)
+    # Re-projection error of each point pair with the fitted transform
+    fitted_points = new_points @ transform[:,:2].T + transform[:,2]
+    err = np.sqrt(np.sum((ref_points - fitted_points)**2,axis=1))
 
     order = np.argsort(err)
 
@@ -99,15 +118,43 @@ def find_pointpairs(ref_image,image):
         np.ndarray : Nx2 matrix of corresponding coordinates in the moved image.
 
     """
-    # Enhance the images and ensure they're in the correct format
-    ref_image = enhance_image(ref_image,downsample=True,median=True,bilateral=True)
-    image = enhance_image(image,downsample=True,median=True,bilateral=True)
+    ref_image,ref_points = _get_reference_features(ref_image)
+
+    return _track_features(ref_image,ref_points,image)
+
+
+
+def _get_reference_features(ref_image):
+    """
+    Enhance a reference image and find features in it to track with optical flow.
+
+    Returns:
+
+        np.ndarray : Enhanced, downsampled reference image
+        np.ndarray : Nx1x2 array of feature coordinates in the enhanced image, or None if none were found.
+    """
+    # Enhance the image and ensure it's in the correct format. Does this work in all cases?
+    ref_image = enhance_image(ref_image,downsample=True,median=True,bilateral=True).astype(np.uint8)
+
+    ref_points = cv2.goodFeaturesToTrack(ref_image[:,:,0].astype(np.float32),maxCorners=100,qualityLevel=0.1,minDistance=50)
+
+    if ref_points is not None:
+        ref_points = ref_points.astype(np.float32)
+
+    return ref_image,ref_points
+
 
-    # Does this work in all cases?
-    ref_image = ref_image.astype(np.uint8)
-    image = image.astype(np.uint8)
 
-    ref_points = cv2.goodFeaturesToTrack(ref_image[:,:,0].astype(np.float32),maxCorners=100,qualityLevel=0.1,minDistance=50).astype(np.float32)
+def _track_features(ref_image,ref_points,image,fast=False):
+    """
+    Find the features from _get_reference_features() in a moved image using
+    sparse optical flow, and return filtered corresponding points in full resolution image coordinates.
+    If fast = True, image enhancement parameters are re-used from previous similar images.
+    """
+    if ref_points is None:
+        return np.array([]),np.array([])
+
+    image = enhance_image(image,downsample=True,median=True,bilateral=True,fast=fast).astype(np.uint8)
 
     # Run optical flow
     new_points,status,err = cv2.calcOpticalFlowPyrLK(ref_image,image,ref_points,np.zeros(ref_points.shape,dtype=ref_points.dtype))
@@ -124,6 +171,54 @@ def find_pointpairs(ref_image,image):
         return np.array([]),np.array([])
 
 
+
+def _get_image(image):
+    """
+    Get an image array from either an image array or a calibration containing an image.
+    """
+    if isinstance(image,Calibration):
+        return image.get_image(coords='Display')
+    else:
+        return image
+
+
+
+def _get_ddscore_image(image):
+    """
+    Convert an image to the form used for DDScore calculation.
+    """
+    if len(image.shape) > 2:
+        return cv2.cvtColor(image[:, :, :3], cv2.COLOR_RGB2LAB)[:,:,0]
+    else:
+        return image
+
+
+
+def _movement_from_points(ref_im,moved_im,ref_points,new_points,ref_ddscore_im=None):
+    """
+    Create a MovementCorrection from auto-detected corresponding points in a pair of images,
+    raising DetectionFailedError if this is not successful.
+    """
+    if ref_points.shape[0] == 0:
+        raise DetectionFailedError('Could not auto-detect a good set of matching points in these two images. Consider using manual movement correction instead.')
+
+    m = estimate_transform(ref_points, new_points)
+
+    if m is None:
+        raise DetectionFailedError('Could not determine image movement automatically. Consider using manual movement correction instead.')
+
+    mov_correction = MovementCorrection(m, ref_im.shape[:2], ref_points, new_points,'Auto-generated by {:s} on {:s} at {:s}'.format(misc.username, misc.hostname, misc.get_formatted_time()))
+
+    if ref_ddscore_im is None:
+        ref_ddscore_im = ref_im
+
+    if mov_correction.get_ddscore(ref_ddscore_im,moved_im) >= 0:
+        return mov_correction
+    else:
+        raise DetectionFailedError('Could not determine image movement automatically. Consider using manual movement correction instead.')
+
+
+
 def detect_movement(ref,moved):
     """
     Attempt to auto-detect image movement between two images using sparse optical flow and return a
@@ -150,38 +245,58 @@ def detect_movement(ref,moved):
         DetectionFailedError
 
     """
-    if isinstance(ref,Calibration):
-        ref_im = ref.get_image(coords='Display')
-    else:
-        ref_im = ref
-
-    if isinstance(moved,Calibration):
-        moved_im = moved.get_image(coords='Display')
-    else:
-        moved_im = moved
+    ref_im = _get_image(ref)
+    moved_im = _get_image(moved)
 
     if ref_im.shape[:2] != moved_im.shape[:2]:
         raise ValueError('Moved image has different dimensions ({:d}x{:d}) to reference image ({:d}x{:d})! The two images must have the same dimensions.'.format(moved_im.shape[1],moved_im.shape[0],ref_im.shape[1],ref_im.shape[0]))
 
     ref_points, new_points = find_pointpairs(ref_im, moved_im)
 
-    if ref_points.shape[0] == 0:
-        raise DetectionFailedError('Could not auto-detect a good set of matching points in these two images. Consider using manual movement correction instead.')
+    return _movement_from_points(ref_im,moved_im,ref_points,new_points)
 
-    try:
-        m = np.matrix(cv2.estimateAffinePartial2D(new_points, ref_points)[0])
-    except AttributeError:
-        m = np.matrix(cv2.cv2.estimateAffinePartial2D(new_points, ref_points)[0])
 
-    if m[0, 0] is None:
-        raise DetectionFailedError('Could not determine image movement automatically. Consider using manual movement correction instead.')
 
-    mov_correction = MovementCorrection(m, ref_im.shape[:2], ref_points, new_points,'Auto-generated by {:s} on {:s} at {:s}'.format(misc.username, misc.hostname, misc.get_formatted_time()))
+def detect_movement_many(ref,frames):
+    """
+    Auto-detect image movement of many images, e.g. every frame of a video, relative to a single reference image.
+    This does the same as calling :func:`calcam.movement.detect_movement` for each image, but is faster because the
+    reference image enhancement and feature detection is only done once, and image enhancement parameters are re-used
+    between similar frames (see the ``fast`` option of :func:`calcam.image_enhancement.enhance_image`). This is a generator which yields the
+    result for each frame in turn, so ``frames`` can also be a generator e.g. reading frames from a file.
 
-    if mov_correction.get_ddscore(ref_im,moved_im) >= 0:
-        return mov_correction
-    else:
-        raise DetectionFailedError('Could not determine image movement automatically. Consider using manual movement correction instead.')
+    Parameters:
+
+        ref (np.ndarray or calcam.Calibration)    : Reference image or calibration to align to. This can \
+                                                    be either an array containg a refrence image, or a \
+                                                    calcam calibrationn containing an image.
+
+        frames (iterable)                         : Sequence of moved images (np.ndarray) or calibrations \
+                                                    containing images to align.
+
+    Yields:
+
+        MovementCorrection or NoneType : Movement correction object representing the movement of each frame, or \
+                                         None for frames where the movement could not be determined.
+    """
+    ref_im = _get_image(ref)
+
+    ref_enhanced,ref_features = _get_reference_features(ref_im)
+    ref_ddscore_im = _get_ddscore_image(ref_im)
+
+    for frame in frames:
+
+        moved_im = _get_image(frame)
+
+        if ref_im.shape[:2] != moved_im.shape[:2]:
+            raise ValueError('Moved image has different dimensions ({:d}x{:d}) to reference image ({:d}x{:d})! The two images must have the same dimensions.'.format(moved_im.shape[1],moved_im.shape[0],ref_im.shape[1],ref_im.shape[0]))
+
+        ref_points, new_points = _track_features(ref_enhanced,ref_features,moved_im,fast=True)
+
+        try:
+            yield _movement_from_points(ref_im,moved_im,ref_points,new_points,ref_ddscore_im)
+        except DetectionFailedError:
+            yield None
 
 
 def manual_movement(ref,moved,correction=None,parent_window=None):
@@ -270,15 +385,8 @@ def phase_correlation_movement(ref,moved):
         DetectionFailedError
 
     """
-    if isinstance(ref,Calibration):
-        ref_im = ref.get_image(coords='Display')
-    else:
-        ref_im = ref
-
-    if isinstance(moved,Calibration):
-        moved_im = moved.get_image(coords='Display')
-    else:
-        moved_im = moved
+    ref_im = _get_image(ref)
+    moved_im = _get_image(moved)
 
     ref_x = np.linspace(0,ref_im.shape[1],4)
     ref_y = np.linspace(0,ref_im.shape[0],4)
@@ -303,10 +411,7 @@ def phase_correlation_movement(ref,moved):
     new_points[:,0] = ref_points[:,0] + movxy[0]
     new_points[:,1] = ref_points[:,1] + movxy[1]
 
-    try:
-        m = np.matrix(cv2.estimateAffinePartial2D(new_points, ref_points)[0])
-    except AttributeError:
-        m = np.matrix(cv2.cv2.estimateAffinePartial2D(new_points, ref_points)[0])
+    m = estimate_transform(ref_points, new_points)
 
     mov_correction = MovementCorrection(m, ref_im.shape[:2], ref_points, new_points,'Auto-generated by {:s} on {:s} at {:s}'.format(misc.username, misc.hostname, misc.get_formatted_time()))
 
@@ -414,7 +519,7 @@ class MovementCorrection:
 
     Parameters:
 
-        matrix (np.matrix)        : 2x3 or 3x3 Affine or projective transform matrix
+        matrix (np.ndarray)       : 2x3 or 3x3 Affine or projective transform matrix
         im_shape (tuple)          : Image array dimensions (rows,cols) to which this transform applies
         ref_points (np.ndarray)   : Nx2 array containing coordinates of points on the reference image
         moved_points (np.ndarray) : Nx2 array containing coordinates of corresponding points on the moved image
@@ -423,8 +528,10 @@ class MovementCorrection:
 
     def __init__(self,matrix,im_shape,ref_points,moved_points,src):
 
+        matrix = np.array(matrix,dtype=np.float64)
+
         if matrix.shape[0] == 2:
-             mat_ = np.matrix(np.zeros((3, 3)))
+             mat_ = np.zeros((3, 3))
              mat_[:2, :] = matrix
              mat_[2, 2] = 1.
              self.matrix = mat_
@@ -574,11 +681,8 @@ class MovementCorrection:
 
         '''
 
-        if len(ref_im.shape) > 2:
-            ref_im = cv2.cvtColor(ref_im[:, :, :3], cv2.COLOR_RGB2LAB)[:,:,0]
-
-        if len(moved_im.shape) > 2:
-            moved_im = cv2.cvtColor(moved_im[:, :, :3], cv2.COLOR_RGB2LAB)[:,:,0]
+        ref_im = _get_ddscore_image(ref_im)
+        moved_im = _get_ddscore_image(moved_im)
 
         image_adjusted, mask = self.warp_moved_to_ref(moved_im)
         diff_before = np.abs(moved_im[mask].astype(int) - ref_im[mask].astype(int))
@@ -664,7 +768,214 @@ class MovementCorrection:
         with open(filename,'r') as readfile:
             loaded_dict = json.load(readfile)
 
-        return cls(np.matrix(loaded_dict['transform_matrix']),loaded_dict['im_array_shape'],np.array(loaded_dict['ref_points']),np.array(loaded_dict['moved_points']),loaded_dict['history'])
+        return cls(np.array(loaded_dict['transform_matrix']),loaded_dict['im_array_shape'],np.array(loaded_dict['ref_points']),np.array(loaded_dict['moved_points']),loaded_dict['history'])
+
+
+class MovementTracker:
+    '''
+    Class for tracking camera movement through a sequence of images, e.g. the frames
+    of a camera video, relative to a single reference image.
+
+    Features in the reference image are tracked from frame to frame using sparse optical flow,
+    which is much faster than detecting the movement of every frame relative to the reference image
+    independently. If the tracking drifts, i.e. the RMS residual of the fitted transform between the
+    reference and tracked feature positions exceeds a threshold, or too many features are lost, the
+    tracking is re-anchored by tracking the features directly from the reference image to the current frame.
+
+    Parameters:
+
+        ref (np.ndarray or calcam.Calibration) : Reference image or calibration to align to. This can \
+                                                 be either an array containg a refrence image, or a \
+                                                 calcam calibrationn containing an image.
+        reanchor_threshold (float)             : RMS residual, in pixels, of the fitted transform above which \
+                                                 the tracking is re-anchored to the reference image. Default is 1.
+        min_points (int)                       : Minimum number of successfully tracked features, below which the \
+                                                 tracking is re-anchored to the reference image. Default is 10.
+        enhance (bool)                         : Whether to enhance each frame with :func:`calcam.image_enhancement.enhance_image` \
+                                                 before tracking. This makes the tracking more robust but is slow; if set to False \
+                                                 the frames are only converted to 8-bit greyscale and downsampled, for faster tracking \
+                                                 of good quality images. Default is True.
+    '''
+    def __init__(self,ref,reanchor_threshold=1.,min_points=10,enhance=True):
+
+        self.ref_im = _get_image(ref)
+        self.reanchor_threshold = reanchor_threshold
+        self.min_points = min_points
+        self.enhance = enhance
+
+        # Optical flow search window size and number of pyramid levels
+        self.win_size = (21,21)
+        self.max_level = 3
+
+        # Everything we need from the reference image is only calculated once
+        ref_image = self._prepare_image(self.ref_im)
+        self.ref_image = ref_image
+
+        ref_points = cv2.goodFeaturesToTrack(ref_image,maxCorners=100,qualityLevel=0.1,minDistance=50)
+
+        if ref_points is None or ref_points.shape[0] < 4:
+            raise DetectionFailedError('Could not find enough features to track in the reference image.')
+
+        self.ref_points = ref_points.astype(np.float32)
+
+        self.reset()
+
+
+    def reset(self):
+        '''
+        Forget the tracking history, so the next frame is aligned directly to the reference image.
+        '''
+        self.prev_image = None
+        self.tracked_ref_points = None
+        self.tracked_points = None
+        self.last_matrix = np.eye(3)
+        self.n_frames = 0
+        self.n_reanchors = 0
+
+
+    def update(self,frame):
+        '''
+        Track the camera movement to the next frame.
+
+        Parameters:
+
+            frame (np.ndarray or calcam.Calibration) : Next moved image, or calibration containing an image.
+
+        Returns:
+
+            MovementCorrection or NoneType : Movement correction object representing the movement of this frame \
+                                             relative to the reference image, or None if it could not be determined.
+        '''
+        image = _get_image(frame)
+
+        if self.ref_im.shape[:2] != image.shape[:2]:
+            raise ValueError('Moved image has different dimensions ({:d}x{:d}) to reference image ({:d}x{:d})! The two images must have the same dimensions.'.format(image.shape[1],image.shape[0],self.ref_im.shape[1],self.ref_im.shape[0]))
+
+        image = self._prepare_image(image)
+        self.n_frames += 1
+
+        result = None
+
+        # Try tracking from the previous frame
+        if self.prev_image is not None:
+            points,ok = self._track(self.prev_image,image,self.tracked_points)
+            result = self._fit(self.tracked_ref_points[ok],points[ok],self.reanchor_threshold)
+
+        # If that didn't work or we've drifted too far, re-anchor to the reference image.
+        # The previous transform gives a good starting guess for where the features are.
+        if result is None:
+            self.n_reanchors += 1
+            guess = self._ref_to_moved(self.ref_points,np.linalg.inv(self.last_matrix))
+            points,ok = self._track(self.ref_image,image,self.ref_points,guess)
+            result = self._fit(self.ref_points[ok],points[ok])
+
+        if result is None:
+            self.prev_image = None
+            self.last_matrix = np.eye(3)
+            return None
+
+        self.tracked_ref_points,self.tracked_points,matrix = result
+        self.prev_image = image
+
+        mov_correction = MovementCorrection(matrix, self.ref_im.shape[:2], 2*self.tracked_ref_points.reshape(-1,2), 2*self.tracked_points.reshape(-1,2),'Auto-generated by movement tracking by {:s} on {:s} at {:s}'.format(misc.username, misc.hostname, misc.get_formatted_time()))
+        self.last_matrix = mov_correction.matrix
+
+        return mov_correction
+
+
+    def _prepare_image(self,image):
+
+        if self.enhance:
+            image = enhance_image(image,downsample=True,median=True,bilateral=True,fast=True)
+            return cv2.cvtColor(image,cv2.COLOR_RGB2GRAY)
+        else:
+            image = scale_to_8bit(image)
+            if len(image.shape) > 2:
+                image = cv2.cvtColor(image[:,:,:3],cv2.COLOR_RGB2GRAY)
+            return cv2.pyrDown(image)
+
+
+    def _track(self,from_image,to_image,points,guess=None):
+
+        if guess is None:
+            guess = points.copy()
+            flags = 0
+        else:
+            flags = cv2.OPTFLOW_USE_INITIAL_FLOW
+
+        new_points,status,_ = cv2.calcOpticalFlowPyrLK(from_image,to_image,points,guess,winSize=self.win_size,maxLevel=self.max_level,flags=flags)
+
+        return new_points,status.ravel() == 1
+
+
+    def _ref_to_moved(self,points,matrix):
+
+        # Points are in downsampled image coordinates, matrices in full resolution coordinates.
+        moved = 2 * points.reshape(-1,2) @ matrix[:2,:2].T + matrix[:2,2]
+        return (moved / 2).reshape(-1,1,2).astype(np.float32)
+
+
+    def _fit(self,ref_points,points,max_rms=None):
+        '''
+        Fit the transform between reference and tracked points, discarding outliers.
+        Returns the inlying reference points, tracked points and the 2x3 transform matrix,
+        or None if the fit is not good enough.
+        '''
+        for _ in range(2):
+
+            if ref_points.shape[0] < 4:
+                return None
+
+            matrix = estimate_transform(2*ref_points.reshape(-1,2),2*points.reshape(-1,2))
+            if matrix is None:
+                return None
+
+            err = np.sqrt(np.sum( (2*ref_points.reshape(-1,2) - (2*points.reshape(-1,2) @ matrix[:,:2].T + matrix[:,2]))**2,axis=1))
+            inliers = err < 3*self.reanchor_threshold
+
+            if np.all(inliers):
+                break
+
+            ref_points = ref_points[inliers]
+            points = points[inliers]
+            err = err[inliers]
+
+        if ref_points.shape[0] < 4:
+            return None
+
+        if max_rms is not None:
+            if ref_points.shape[0] < self.min_points or np.sqrt(np.mean(err**2)) > max_rms:
+                return None
+
+        return ref_points,points,matrix
+
+
+
+def track_movement(ref,frames,reanchor_threshold=1.,min_points=10,enhance=True):
+    """
+    Track camera movement through a sequence of images, e.g. every frame of a camera video,
+    relative to a reference image using :class:`calcam.movement.MovementTracker`. This is a generator
+    which yields the movement of each frame in turn, so ``frames`` can also be a generator. Unlike
+    :func:`calcam.movement.detect_movement`, no DDScore check is made on each result.
+
+    Parameters:
+
+        ref (np.ndarray or calcam.Calibration) : Reference image or calibration to align to.
+        frames (iterable)                      : Sequence of moved images (np.ndarray) or calibrations containing images.
+        reanchor_threshold (float)             : RMS fit residual in pixels above which tracking is re-anchored to the reference image.
+        min_points (int)                       : Minimum number of tracked features below which tracking is re-anchored to the reference image.
+        enhance (bool)                         : Whether to enhance the frames before tracking.
+
+    Yields:
+
+        MovementCorrection or NoneType : Movement correction for each frame, or None for frames where \
+                                         the movement could not be determined.
+    """
+    tracker = MovementTracker(ref,reanchor_threshold=reanchor_threshold,min_points=min_points,enhance=enhance)
+
+    for frame in frames:
+        yield tracker.update(frame)
+
 
 
 class DetectionFailedError(Exception):
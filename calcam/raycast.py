@@ -22,21 +22,53 @@
 import os
 import random
 import copy
-
-try:
-    import vtk
-except:
-    vtk = None
+import json
+import hashlib
+import glob
+import collections
+import warnings
+import importlib.util
 
 import numpy as np
-from scipy.io.netcdf import netcdf_file
 
 from . import coordtransformer
 from . import misc
 from . import __version__ as calcam_version
+from .config import get_cache_dir
+
+
+# Settings for the on-disk cache of ray casting results used by raycast_sightlines().
+# Ray casts of fewer than min_rays sight-lines are not cached, and the least recently
+# used results are deleted when the total size of the cache exceeds max_size (in bytes).
+# The cache is kept in the directory "path", which if relative is inside the calcam cache
+# directory (~/.calcam_cache). The location and size can also be set with the environment
+# variables CALCAM_RAYDATA_CACHE_DIR and CALCAM_RAYDATA_CACHE_SIZE (in bytes); setting the
+# size to 0 turns the cache off.
+raydata_cache = {'enabled':True,'min_rays':1000,'max_size':2*1024**3,'path':'raydata','version':2}
+
+if os.environ.get('CALCAM_RAYDATA_CACHE_DIR'):
+    raydata_cache['path'] = os.path.expanduser(os.environ['CALCAM_RAYDATA_CACHE_DIR'])
+
+if os.environ.get('CALCAM_RAYDATA_CACHE_SIZE'):
+    try:
+        raydata_cache['max_size'] = int(float(os.environ['CALCAM_RAYDATA_CACHE_SIZE']))
+        raydata_cache['enabled'] = raydata_cache['max_size'] > 0
+    except ValueError:
+        warnings.warn('Ignoring invalid CALCAM_RAYDATA_CACHE_SIZE value "{:s}"; this should be a size in bytes.'.format(os.environ['CALCAM_RAYDATA_CACHE_SIZE']))
+
+# Running total size of the files in each ray data cache directory, so the directory
+# only needs listing when it might be over the size limit.
+_raydata_cache_sizes = {}
+
+# Maximum number of results to keep in the cache used by get_wall_coords()
+wall_coords_cache_size = 8
 
+# Cached results of get_wall_coords() and wall contour segment indices, by content.
+_wall_coords_cache = collections.OrderedDict()
+_contour_index_cache = collections.OrderedDict()
 
-def raycast_sightlines(calibration,cadmodel,x=None,y=None,exclusion_radius=0.0,binning=1,coords='Display',verbose=True,intersecting_only=False, force_subview=None,status_callback=None,calc_normals=False):
+
+def raycast_sightlines(calibration,cadmodel,x=None,y=None,exclusion_radius=0.0,binning=1,coords='Display',verbose=True,intersecting_only=False, force_subview=None,status_callback=None,calc_normals=False,block_rows=256,use_cache=True,cancel=None,wall_contour=None):
     '''
     Ray cast camera sight-lines to determine where they intersect the given CAD model.
 
@@ -44,7 +76,8 @@ def raycast_sightlines(calibration,cadmodel,x=None,y=None,exclusion_radius=0.0,b
 
         calibration (calcam.Calibration) : Calibration whose sight-lines to raycast.
         
-        cadmodel (calcam.CADModel)       : CAD model to check intersection with.
+        cadmodel (calcam.CADModel)       : CAD model to check intersection with. Can be None if an array \
+                                           is given for wall_contour.
         
         x, y (array-like)                : x and y image pixel coordinates for which to cast sight-lines. \
                                            If not specified, one ray is cast at the centre of every detector pixel.\
@@ -86,65 +119,64 @@ def raycast_sightlines(calibration,cadmodel,x=None,y=None,exclusion_radius=0.0,b
                                            Not turned on by default because it seems to add around 80% extra calculation time, so best used \
                                            only if actyally needed.
 
+        block_rows (int)                 : If not explicitly providing x and y image coordinates, the sight-lines are generated and cast \
+                                           this many (binned) image rows at a time, to limit the memory needed for large images.
+
+        use_cache (bool)                 : Whether to use the on-disk cache of ray casting results. The cache is used by default: \
+                                           results of ray casts with at least 1000 sight-lines are saved in ~/.calcam_cache/raydata, \
+                                           and the results of previous identical ray casts (i.e. the same calibration, image geometry, \
+                                           CAD model geometry, pixels and options) are loaded from there instead of being re-calculated. \
+                                           The least recently used results are deleted when the cache is bigger than 2 GB. See \
+                                           ``calcam.raycast.raydata_cache`` to change these settings or turn the cache off, or set the \
+                                           environment variables CALCAM_RAYDATA_CACHE_DIR and CALCAM_RAYDATA_CACHE_SIZE (in bytes, \
+                                           0 to turn the cache off).
+
+        cancel (callable)                : Callable which returns True if the ray casting should be stopped early, in which case \
+                                           calcam.misc.Cancelled is raised. Checked periodically during the ray casting.
+
+        wall_contour (bool or np.ndarray): If set to True, instead of the full CAD model geometry, the sight-lines are intersected \
+                                           with the CAD model's R,Z wall contour revolved around the Z axis. This is calculated \
+                                           analytically for many sight-lines at once, so is orders of magnitude faster than ray casting \
+                                           with the full CAD model, but only gives where the sight-lines hit an axisymmetric approximation \
+                                           of the first wall. Alternatively an Nx2 array of R,Z wall contour coordinates in metres can be \
+                                           given, in which case cadmodel can be None. Only intersections where sight-lines leave the region \
+                                           enclosed by the contour are counted, so the camera can be outside the contour, e.g. in a port. \
+                                           Results of these ray casts are not cached, and the feature hit by each sight-line is not recorded.
+
     Returns:
 
-        calcam.RayData                   : Object containing the results.
+        calcam.RayData                   : Object containing the results. Its timings attribute contains records of \
+                                           how long the different stages of the calculation took. Which CAD model feature \
+                                           each sight-line intersects is also recorded, see :func:`calcam.RayData.get_feature_index`.
 
     '''
 
-    if vtk is None:
+    if importlib.util.find_spec('vtk') is None:
         raise Exception('VTK is not available, and this Calcam feature requires VTK!')
 
     if status_callback is None:
         if verbose:
             status_callback = misc.LoopProgPrinter().update
             
-    if status_callback is not None:
+    if wall_contour is True:
+        if cadmodel.wall_contour is None:
+            raise ValueError('CAD model "{:s}" does not have a wall contour!'.format(cadmodel.machine_name))
+        wall_contour = cadmodel.wall_contour
+    elif wall_contour is False:
+        wall_contour = None
+
+    if wall_contour is not None:
+        # The CAD model isn't used so we don't need to tell it about the status callback.
+        cadmodel = None
+
+    if status_callback is not None and cadmodel is not None:
         original_callback = cadmodel.get_status_callback()
         cadmodel.set_status_callback(status_callback)
 
-
-    # Work out how big the model is. This is to make sure the rays we cast aren't too short.
-    model_extent = cadmodel.get_extent()
-    model_size = model_extent[1::2] - model_extent[::2]
-    max_ray_length = model_size.max() * 4
-
-    # If no pixels are specified, do the whole chip at the specified binning level.
-    fullchip = False
-    if x is None and y is None:
-        fullchip = True
-        x,y = calibration.fullframe_meshgrid(coords=coords,binning=binning)
-
-    elif x is None or y is None:
-        raise ValueError('Either both or none of x and y pixel coordinates must be given!')
-
-
-    if np.array(x).ndim == 0:
-        x = np.array([x])
-    else:
-        x = np.array(x)
-    if np.array(y).ndim == 0:
-        y = np.array([y])
-    else:
-        y = np.array(y)
-    if x.shape != y.shape:
-        raise ValueError('x and y arrays must be the same shape!')
-
-    valid_mask = np.logical_and(np.isnan(x) == 0 , np.isnan(y) == 0 )
-    if coords.lower() == 'original':
-        x,y = calibration.geometry.original_to_display_coords(x,y)
+    progress = misc.ProgressReporter(status_callback,cancel)
 
     results = RayData()
-    
-    if fullchip:
-        results.fullchip = coords
-    else:
-        results.fullchip = False
-        
-    results.x = np.copy(x).astype('float')
-    results.x[valid_mask == 0] = 0
-    results.y = np.copy(y).astype('float')
-    results.y[valid_mask == 0] = 0
+    results.timings = progress.timings
     results.transform = calibration.geometry
     if calibration.filename is not None:
         splitname = os.path.split(calibration.filename)
@@ -152,94 +184,438 @@ def raycast_sightlines(calibration,cadmodel,x=None,y=None,exclusion_radius=0.0,b
     else:
         results.history = 'Ray cast by {:s} on {:s} at {:s}'.format(misc.username,misc.hostname,misc.get_formatted_time())
 
-    orig_shape = np.shape(results.x)
-    results.x = np.reshape(results.x,np.size(results.x),order='F')
-    results.y = np.reshape(results.y,np.size(results.y),order='F')
-    valid_mask = np.reshape(valid_mask,np.size(valid_mask),order='F')
-
+    # If no pixels are specified, do the whole chip at the specified binning level.
+    if x is None and y is None:
 
-    # New results object to store results
-    if fullchip:
+        results.fullchip = coords
         results.binning = binning
         results.coords = coords
+
+        xl,yl = calibration._fullframe_pixel_centres(coords,binning)
+        orig_shape = (yl.size,xl.size)
+        n_rays = yl.size * xl.size
+
+    elif x is None or y is None:
+        raise ValueError('Either both or none of x and y pixel coordinates must be given!')
+
     else:
+
+        results.fullchip = False
         results.binning = None
         results.coords = None
 
+        if np.array(x).ndim == 0:
+            x = np.array([x])
+        else:
+            x = np.array(x)
+        if np.array(y).ndim == 0:
+            y = np.array([y])
+        else:
+            y = np.array(y)
+        if x.shape != y.shape:
+            raise ValueError('x and y arrays must be the same shape!')
+
+        orig_shape = x.shape
+        n_rays = x.size
+
+    # If we have done exactly the same ray cast before, we can use the cached results.
+    cache_file = None
+    if use_cache and raydata_cache['enabled'] and n_rays >= raydata_cache['min_rays'] and wall_contour is None:
+
+        cache_file = _get_raydata_cache_file(calibration,cadmodel,x,y,coords=coords.lower(),binning=binning,exclusion_radius=exclusion_radius,intersecting_only=intersecting_only,force_subview=force_subview,calc_normals=calc_normals)
+        cached_results = _load_cached_raydata(cache_file)
 
-    results.ray_end_coords = np.ndarray([np.size(x),3])
-    results.model_normals = np.ndarray([np.size(x),3]) + np.nan
+        if cached_results is not None:
+            cached_results.coords = results.coords
+            cached_results.history = results.history
+            if status_callback is not None:
+                status_callback('Using cached ray casting results.')
+                status_callback(1.)
+                cadmodel.set_status_callback(original_callback)
+            return cached_results
 
-    # Line of sight directions
-    LOSDir = calibration.get_los_direction(results.x,results.y,coords='Display',subview=force_subview)
-    if len(LOSDir.shape) == 1:
-        LOSDir = [LOSDir]
-    results.ray_start_coords = calibration.get_pupilpos(results.x,results.y,coords='Display',subview=force_subview)
+    # Work out how big the model is. This is to make sure the rays we cast aren't too short.
+    # Any mesh loading or cell locator building this needs is included in the results' timings.
+    if wall_contour is None:
+        last_model_timing = cadmodel.timings[-1] if len(cadmodel.timings) > 0 else None
+        model_extent = cadmodel.get_extent()
+        model_size = model_extent[1::2] - model_extent[::2]
+        max_ray_length = model_size.max() * 4
+        cadmodel.build_octree()
+        # The model only keeps its most recent timing records, so find the new ones by working back from the end.
+        new_model_timings = []
+        for record in reversed(cadmodel.timings):
+            if record is last_model_timing:
+                break
+            new_model_timings.insert(0,record)
+        progress.timings.extend(new_model_timings)
+
+        results.feature_names = cadmodel.get_enabled_features()
+        feature_ids = dict([(fname,i) for i,fname in enumerate(results.feature_names)])
+    else:
+        wall_contour = np.array(wall_contour,dtype=np.float64)
+        max_ray_length = max(2 * np.abs(wall_contour[:,0]).max(),np.ptp(wall_contour[:,1])) * 4
 
-    
     if status_callback is not None:
-        oom = np.floor( np.log(np.size(x)) / np.log(10) / 3. ) # Order of magnitude of number of points to do
-        status_callback('Casting {:s} rays...'.format( ['{:.0f}','{:.1f}k','{:.2f}M'][int(oom)].format(np.size(x)/10**(3*oom)) ) )
+        oom = np.floor( np.log(n_rays) / np.log(10) / 3. ) # Order of magnitude of number of points to do
+        progress.status('Casting {:s} rays...'.format( ['{:.0f}','{:.1f}k','{:.2f}M'][int(oom)].format(n_rays/10**(3*oom)) ) )
+        progress.update(0.)
 
+    n_done = [0]
 
-    n_done = 0
-    
-    # We will do the ray casting in a random order,
-    # purely to get better time remaining estimation.
-    inds = list(range(np.size(x)))
-    random.shuffle(inds)
-    
-    for ind in inds:
+    # Functions to cast a set of rays given as Nx3 arrays of start points and directions,
+    # returning Nx3 arrays of end coordinates and model normals, and the indices in
+    # results.feature_names of the features hit (-1 for no hit, or None when using the
+    # wall contour). With the CAD model the rays are cast one at a time.
+    def _cast_rays_mesh(ray_start_coords,los_dirs):
 
-        if not valid_mask[ind]:
-            results.ray_end_coords[ind,:] = np.nan
-            results.ray_start_coords[ind,:] = np.nan
-            continue
+        ray_end_coords = np.full(ray_start_coords.shape,np.nan)
+        model_normals = np.full(ray_start_coords.shape,np.nan)
+        feature_index = np.full(ray_start_coords.shape[0],-1,dtype=np.int16)
 
-        # Do the raycast and put the result in the output array
-        raystart = results.ray_start_coords[ind] + exclusion_radius * LOSDir[ind]
-        rayend = results.ray_start_coords[ind] + max_ray_length * LOSDir[ind]
+        # We will do the ray casting in a random order,
+        # purely to get better time remaining estimation.
+        inds = list(range(ray_start_coords.shape[0]))
+        random.shuffle(inds)
 
-        ret_vals = cadmodel.intersect_with_line(raystart,rayend,calc_normals)
+        for ind in inds:
 
-        if ret_vals[0]:
-            results.ray_end_coords[ind,:] = ret_vals[1][:]
-            if calc_normals:
-                results.model_normals[ind,:] = ret_vals[2]
+            n_done[0] = n_done[0] + 1
 
-        elif intersecting_only:
-            results.ray_end_coords[ind,:] = np.nan
-        else:
-            results.ray_end_coords[ind,:] = rayend
+            if not np.isfinite(ray_start_coords[ind]).all():
+                continue
 
-        n_done = n_done + 1
-        
-        if status_callback is not None:
-            status_callback(n_done / len(inds))
+            # Do the raycast and put the result in the output array
+            raystart = ray_start_coords[ind] + exclusion_radius * los_dirs[ind]
+            rayend = ray_start_coords[ind] + max_ray_length * los_dirs[ind]
 
-    if status_callback is not None:
-        status_callback(1.)
+            ret_vals = cadmodel.intersect_with_line(raystart,rayend,surface_normal=calc_normals,feature=True)
 
-    results.x[valid_mask == 0] = np.nan
-    results.y[valid_mask == 0] = np.nan
+            if ret_vals[0]:
+                ray_end_coords[ind,:] = ret_vals[1][:]
+                feature_index[ind] = feature_ids[ret_vals[-1]]
+                if calc_normals:
+                    model_normals[ind,:] = ret_vals[2]
 
-    results.ray_end_coords = np.reshape(results.ray_end_coords,orig_shape + (3,),order='F')
-    results.ray_start_coords = np.reshape(results.ray_start_coords,orig_shape + (3,),order='F')
-    if calc_normals:
-        results.model_normals = np.reshape(results.model_normals, orig_shape + (3,), order='F')
-    else:
-        results.model_normals = None
+            elif not intersecting_only:
+                ray_end_coords[ind,:] = rayend
 
-    results.x = np.reshape(results.x,orig_shape,order='F')
-    results.y = np.reshape(results.y,orig_shape,order='F')
+            # Status updates and cancellation checks are only done every so often,
+            # to keep their overhead small compared to the ray casting itself.
+            if n_done[0] % 256 == 0:
+                progress.update(n_done[0] / n_rays)
+                progress.check_cancel()
+
+        return ray_end_coords,model_normals,feature_index
+
+
+    # When using the wall contour, the rays are all cast at once instead.
+    def _cast_rays_contour(ray_start_coords,los_dirs):
+
+        ray_lengths,model_normals = _intersect_wall_contour(ray_start_coords,los_dirs,wall_contour,min_length=exclusion_radius)
+
+        hit = np.isfinite(ray_lengths)
+        if not intersecting_only:
+            ray_lengths[~hit] = max_ray_length
+        ray_end_coords = ray_start_coords + ray_lengths[:,np.newaxis] * los_dirs
+
+        n_done[0] = n_done[0] + ray_start_coords.shape[0]
+        progress.update(n_done[0] / n_rays)
+        progress.check_cancel()
+
+        return ray_end_coords,model_normals,None
+
+
+    cast_rays = _cast_rays_mesh if wall_contour is None else _cast_rays_contour
+
+
+    try:
+        with progress.stage('cast',n_rays=n_rays,calc_normals=calc_normals):
+
+            if results.fullchip:
+
+                # For the full chip, get the sight-lines a block of rows at a time so that we never
+                # need any full-frame temporary arrays other than the results themselves.
+                results.x = np.empty(orig_shape)
+                results.y = np.empty(orig_shape)
+                results.ray_start_coords = np.empty(orig_shape + (3,))
+                results.ray_end_coords = np.empty(orig_shape + (3,))
+                if wall_contour is None:
+                    results.feature_index = np.empty(orig_shape,dtype=np.int16)
+                if calc_normals:
+                    results.model_normals = np.empty(orig_shape + (3,))
+                else:
+                    results.model_normals = None
+
+                for rows,block_x,block_y,ray_start_coords,los_dirs in calibration.iter_sightlines(coords=coords,binning=binning,block_rows=block_rows,subview=force_subview):
+
+                    if coords.lower() == 'original':
+                        block_x,block_y = calibration.geometry.original_to_display_coords(block_x,block_y)
+
+                    results.x[rows] = block_x
+                    results.y[rows] = block_y
+                    results.ray_start_coords[rows] = ray_start_coords
+
+                    ray_end_coords,model_normals,feature_index = cast_rays(ray_start_coords.reshape(-1,3),los_dirs.reshape(-1,3))
+
+                    results.ray_end_coords[rows] = ray_end_coords.reshape(ray_start_coords.shape)
+                    if feature_index is not None:
+                        results.feature_index[rows] = feature_index.reshape(ray_start_coords.shape[:-1])
+                    if calc_normals:
+                        results.model_normals[rows] = model_normals.reshape(ray_start_coords.shape)
+
+            else:
+
+                valid_mask = np.logical_and(np.isnan(x) == 0 , np.isnan(y) == 0 )
+                if coords.lower() == 'original':
+                    x,y = calibration.geometry.original_to_display_coords(x,y)
+
+                results.x = np.copy(x).astype('float')
+                results.x[valid_mask == 0] = 0
+                results.y = np.copy(y).astype('float')
+                results.y[valid_mask == 0] = 0
+
+                results.x = np.reshape(results.x,np.size(results.x),order='F')
+                results.y = np.reshape(results.y,np.size(results.y),order='F')
+                valid_mask = np.reshape(valid_mask,np.size(valid_mask),order='F')
+
+                # Line of sight directions
+                los_dirs = np.reshape(calibration.get_los_direction(results.x,results.y,coords='Display',subview=force_subview),(-1,3))
+                ray_start_coords = calibration.get_pupilpos(results.x,results.y,coords='Display',subview=force_subview)
+                ray_start_coords[valid_mask == 0,:] = np.nan
+
+                ray_end_coords,model_normals,feature_index = cast_rays(ray_start_coords,los_dirs)
+
+                results.x[valid_mask == 0] = np.nan
+                results.y[valid_mask == 0] = np.nan
+
+                results.ray_end_coords = np.reshape(ray_end_coords,orig_shape + (3,),order='F')
+                results.ray_start_coords = np.reshape(ray_start_coords,orig_shape + (3,),order='F')
+                if feature_index is not None:
+                    results.feature_index = np.reshape(feature_index,orig_shape,order='F')
+                if calc_normals:
+                    results.model_normals = np.reshape(model_normals, orig_shape + (3,), order='F')
+                else:
+                    results.model_normals = None
+
+                results.x = np.reshape(results.x,orig_shape,order='F')
+                results.y = np.reshape(results.y,orig_shape,order='F')
+
+    except misc.Cancelled:
+        if status_callback is not None and cadmodel is not None:
+            cadmodel.set_status_callback(original_callback)
+        raise
+
+    if cache_file is not None:
+        _save_cached_raydata(cache_file,results)
 
     if status_callback is not None:
-        cadmodel.set_status_callback(original_callback)
+        progress.update(1.)
+        if cadmodel is not None:
+            cadmodel.set_status_callback(original_callback)
 
     return results
 
 
 
+# Get the cache file name for the results of a ray cast. This is based on everything which can affect the
+# results: the camera models, sub-view mask and image geometry of the calibration, the enabled CAD model
+# features and their mesh contents, the pixel coordinates and the other ray casting options.
+# Returns None if there is no usable cache directory.
+def _get_raydata_cache_file(calibration,cadmodel,x,y,**options):
+
+    cache_dir = get_cache_dir(raydata_cache['path'])
+    if cache_dir is None:
+        return None
+
+    key = hashlib.md5()
+
+    for view_model in calibration.view_models:
+        if view_model is None:
+            key.update(b'None')
+        else:
+            key.update(view_model.model.encode())
+            for coeffs in [view_model.cam_matrix,view_model.kc,view_model.rvec,view_model.tvec]:
+                key.update(np.ascontiguousarray(coeffs,dtype=np.float64).tobytes())
+
+    key.update(str(calibration.subview_mask.shape).encode())
+    key.update(np.ascontiguousarray(calibration.subview_mask,dtype=np.int16).tobytes())
+
+    geometry = calibration.geometry
+    key.update(json.dumps([geometry.transform_actions,int(geometry.x_pixels),int(geometry.y_pixels),[int(offset) for offset in geometry.offset],float(geometry.pixel_aspectratio)]).encode())
+
+    for feature_name in cadmodel.get_enabled_features():
+        key.update('{:s} {:s}'.format(feature_name,cadmodel.features[feature_name].get_mesh_id()).encode())
+
+    if x is not None:
+        for coords in [x,y]:
+            key.update(str(coords.shape).encode())
+            key.update(np.ascontiguousarray(coords,dtype=np.float64).tobytes())
+
+    options['binning'] = float(options['binning'])
+    options['exclusion_radius'] = float(options['exclusion_radius'])
+    options['version'] = raydata_cache['version']
+    key.update(json.dumps(options,sort_keys=True).encode())
+
+    return os.path.join(cache_dir,'{:s}.nc'.format(key.hexdigest()))
+
+
+# Load cached ray casting results, if they exist.
+def _load_cached_raydata(cache_file):
+
+    if cache_file is None or not os.path.isfile(cache_file):
+        return None
+
+    try:
+        raydata = RayData(cache_file)
+    except Exception:
+        return None
+
+    raydata.filename = None
+
+    # Update the modification time, which is used to find the least recently used cache entries.
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+
+    return raydata
+
+
+# Save ray casting results to the cache, then delete the least recently used
+# cache entries if the cache is bigger than allowed. Any errors are ignored,
+# since that just means the ray cast will need doing again next time.
+def _save_cached_raydata(cache_file,raydata):
+
+    try:
+        raydata.save(cache_file,compact=True)
+        new_size = os.path.getsize(cache_file)
+    except Exception:
+        return
+
+    # The cache directory only needs listing the first time, or when the running total
+    # says it might be too big (other processes can also add to the cache, so then we
+    # find the real size).
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir in _raydata_cache_sizes:
+        _raydata_cache_sizes[cache_dir] = _raydata_cache_sizes[cache_dir] + new_size
+        if _raydata_cache_sizes[cache_dir] <= raydata_cache['max_size']:
+            return
+
+    try:
+        cache_entries = []
+        for filename in glob.glob(os.path.join(cache_dir,'*.nc')):
+            stat = os.stat(filename)
+            cache_entries.append((stat.st_mtime,stat.st_size,filename))
+    except OSError:
+        return
+
+    cache_size = sum([entry[1] for entry in cache_entries])
+
+    for _,size,filename in sorted(cache_entries):
+        if cache_size <= raydata_cache['max_size']:
+            break
+        try:
+            os.remove(filename)
+            cache_size = cache_size - size
+        except OSError:
+            pass
+
+    _raydata_cache_sizes[cache_dir] = cache_size
+
+
+
+
+
+# Intersect rays, given as Nx3 arrays of start coordinates and unit direction vectors, with the
+# surface made by revolving a closed R,Z wall contour around the Z axis. This uses the same ray - cone
+# intersection equations as calcam.gm.PoloidalVolumeGrid.get_cell_intersections(), but for many rays at once.
+# Only intersections where the rays leave the region enclosed by the contour count, so rays starting outside
+# the contour (e.g. cameras in ports) see the far wall. Returns an N element array of the distances along the
+# rays to the first such intersections beyond min_length (NaN if there are none) and an Nx3 array of the
+# surface normals there, facing back along the rays.
+def _intersect_wall_contour(ray_start_coords,los_dirs,contour,min_length=0.,chunk_size=65536):
+
+    contour = np.array(contour,dtype=np.float64)
+    if np.abs(contour[0,:] - contour[-1,:]).max() < 1e-15:
+        contour = contour[:-1]
+
+    # Contour segments, and which way their outward normals point given the direction of the contour
+    lar = contour[:,0]
+    laz = contour[:,1]
+    dlr = np.roll(lar,-1) - lar
+    dlz = np.roll(laz,-1) - laz
+    orientation = np.sign(np.sum(lar*np.roll(laz,-1) - np.roll(lar,-1)*laz))
+    normal_r = orientation * dlz
+    normal_z = -orientation * dlr
+
+    # Exactly horizontal segments need treating separately.
+    horizontal = np.abs(dlz) < 1e-14
+    cone = ~horizontal
+    lar_h,laz_h,dlr_h,normal_z_h = lar[horizontal],laz[horizontal],dlr[horizontal],normal_z[horizontal]
+    lar,laz,dlr,dlz = lar[cone],laz[cone],dlr[cone],dlz[cone]
+    seg_inds = np.concatenate((np.argwhere(cone)[:,0],np.argwhere(horizontal)[:,0]))
+
+    # Constant parts of the quadratic coefficients for each segment. Points on the ray at distance t
+    # along it are on the cone through the segment where g(t) = k(t)^2 - dlz^2 * R(t)^2 = 0, where
+    # R(t) is the major radius of the point and k(t) = dlz * lar + dlr * (Z(t) - laz).
+    # For each segment, the ray can only leave the contour at the root where g(t) has a particular sign
+    # of gradient, since g > 0 inside the cone and g < 0 outside it.
+    k0 = dlz*lar - dlr*laz
+    dlr2 = dlr**2
+    dlz2 = dlz**2
+    two_dlr = 2*dlr
+    root_sign = -orientation * np.sign(dlz)
+
+    ray_lengths = np.full(ray_start_coords.shape[0],np.nan)
+    seg_hit = np.zeros(ray_start_coords.shape[0],dtype=int)
+
+    rays_per_chunk = max(1,chunk_size // contour.shape[0])
+
+    with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+
+        for first_ray in range(0,ray_start_coords.shape[0],rays_per_chunk):
+
+            chunk = slice(first_ray,first_ray + rays_per_chunk)
+            pax,pay,paz = [coord[:,np.newaxis] for coord in ray_start_coords[chunk].T]
+            dpx,dpy,dpz = [coord[:,np.newaxis] for coord in los_dirs[chunk].T]
+
+            k = k0 + dlr*paz
+            a = dlr2*dpz**2 - dlz2*(dpx**2 + dpy**2)
+            b = two_dlr*dpz*k - 2*dlz2*(dpx*pax + dpy*pay)
+            c = k*k - dlz2*(pax**2 + pay**2)
+
+            sqrt_d = np.sqrt(b*b - 4*a*c) * root_sign
+
+            # Root (-b + sqrt_d) / 2a, calculated whichever way avoids cancellation errors.
+            t_cone = np.where(b*sqrt_d > 0,2*c/(-b - sqrt_d),(-b + sqrt_d)/(2*a))
+            t_seg = (paz - laz + t_cone*dpz)/dlz
+            t_cone[~((t_seg >= 0.) & (t_seg <= 1.) & (t_cone > min_length))] = np.inf
+
+            if lar_h.size > 0:
+                t_plane = (laz_h - paz)/dpz
+                r_hit = np.sqrt((pax + t_plane*dpx)**2 + (pay + t_plane*dpy)**2)
+                t_seg = (r_hit - lar_h)/dlr_h
+                t_plane[~((t_seg >= 0.) & (t_seg <= 1.) & (t_plane > min_length) & (normal_z_h*dpz > 0))] = np.inf
+                t_cone = np.concatenate((t_cone,t_plane),axis=1)
+
+            first_hit = np.argmin(t_cone,axis=1)
+            ray_lengths[chunk] = t_cone[np.arange(t_cone.shape[0]),first_hit]
+            seg_hit[chunk] = seg_inds[first_hit]
+
+    hit = np.isfinite(ray_lengths)
+    ray_lengths[~hit] = np.nan
+
+    # Normals of the revolved surface, facing back along the rays
+    normals = np.full(ray_start_coords.shape,np.nan)
+    hit_coords = ray_start_coords[hit] + ray_lengths[hit][:,np.newaxis] * los_dirs[hit]
+    hit_r = np.sqrt(hit_coords[:,0]**2 + hit_coords[:,1]**2)
+    n_r = normal_r[seg_hit[hit]]
+    n_z = normal_z[seg_hit[hit]]
+    normals[hit] = -np.stack((n_r*hit_coords[:,0]/hit_r,n_r*hit_coords[:,1]/hit_r,n_z),axis=-1) / np.sqrt(n_r**2 + n_z**2)[:,np.newaxis]
+
+    return ray_lengths,normals
+
 
 
 class RayData:
@@ -254,8 +630,14 @@ class RayData:
         filename (str)  : File name of netCDF file containing saved RayData to load. \
                           If not given, an empty RayData object is created.
 
+        lazy (bool)     : If True, when loading from a file the ray data arrays are memory mapped \
+                          from the file instead of being read in to memory, so only the parts of the \
+                          data which are actually used (e.g. the current detector window, or pixels \
+                          requested with x and y coordinates) are read from disk. The file must not \
+                          be modified while the RayData object is in use.
+
     '''
-    def __init__(self,filename=None):
+    def __init__(self,filename=None,lazy=False):
 
         self.ray_end_coords = None
         self.ray_start_coords = None
@@ -273,134 +655,251 @@ class RayData:
         self.filename = None
         self.crop = None
         self.model_normals = None
-        
+
+        self.feature_index = None
+        self.feature_names = None
+        '''
+        list of str: Names of the CAD model features which were enabled for the ray cast, \
+        which the values returned by get_feature_index() are indices in to. \
+        None if the feature intersected by each sight-line is not known, e.g. for RayData \
+        saved by older versions of Calcam.
+        '''
+
+        self.timings = []
+        '''
+        list of dict: Records of how long the stages of creating this object took, \
+        e.g. loading the CAD model, building the cell locator and ray casting. \
+        See calcam.misc.record_timing() for the record format.
+        '''
+
         if filename is not None:
-            self._load(filename)
+            with misc.record_timing(self.timings,'load',filename=filename,lazy=lazy):
+                self._load(filename,lazy=lazy)
 
 
     # Save to a netCDF file
-    def save(self,filename):
+    def save(self,filename,compact=False,ray_lengths=False,quantise=None):
         '''
         Save the RayData to a netCDF file.
 
         Parameters:
 
-            filename (str) : File name to save to.
+            filename (str)     : File name to save to.
+
+            compact (bool)     : Whether to save in the compact file format, which typically makes files around half the size. \
+                                 In this format the ray start coordinates are saved as a list of pupil positions with a map of \
+                                 which pupil position each pixel uses, and pixel coordinates for full-chip ray casts are saved \
+                                 as x and y axes. Files saved in this format can only be loaded with Calcam 2.14 or newer.
+
+            ray_lengths (bool) : If True, save the sight-line lengths and directions instead of the ray end coordinates. \
+                                 The directions are saved as 16-bit integers, i.e. to a precision of around 3e-5. Implies compact=True.
+
+            quantise (float)   : If given, the ray end coordinates (or ray lengths) are rounded to this resolution, in metres, \
+                                 and saved as integers. Model normals are then also saved as 16-bit integers. Implies compact=True.
         '''
         if not filename.endswith('.nc'):
             filename = filename + '.nc'
 
-        current_crop = self.crop
-        self.set_detector_window(None)
+        compact = compact or ray_lengths or quantise is not None
 
-        f = netcdf_file(filename,'w')
-        f.title = 'Calcam v{:s} RayData (ray cast results) file.'.format(calcam_version)
-        f.history = self.history
-        f.image_transform_actions = "['" + "','".join(self.transform.transform_actions) + "']"
-        f.fullchip = self.fullchip
+        # Data is always saved for the native detector window.
+        transform,pixel_x,pixel_y = self._get_native_geometry()
 
-        f.createDimension('pointdim',3)
+        # Write to a temporary file first and then move it in to place, so that we don't
+        # break anything using a lazy loaded version of the file we're overwriting.
+        tmp_filename = filename + '.tmp{:d}'.format(os.getpid())
 
-        if len(self.x.shape) == 2:
-            f.createDimension('udim',self.x.shape[1])
-            f.createDimension('vdim',self.x.shape[0])
-            rayhit = f.createVariable('RayEndCoords','f4',('vdim','udim','pointdim'))
-            raystart = f.createVariable('RayStartCoords','f4',('vdim','udim','pointdim'))
-            x = f.createVariable('PixelXLocation','f4',('vdim','udim'))
-            y = f.createVariable('PixelYLocation','f4',('vdim','udim'))
-            if self.model_normals is not None:
-                normals = f.createVariable('ModelNormals', 'f4', ('vdim', 'udim', 'pointdim'))
-            
-            rayhit[:,:,:] = self.ray_end_coords
-            raystart[:,:,:] = self.ray_start_coords
-            x[:,:] = self.x
-            y[:,:] = self.y
-            if self.model_normals is not None:
-                normals[:,:,:] = self.model_normals
+        from scipy.io.netcdf import netcdf_file
+        f = netcdf_file(tmp_filename,'w')
+        try:
+            f.title = 'Calcam v{:s} RayData (ray cast results) file.'.format(calcam_version)
+            f.history = self.history
+            f.image_transform_actions = "['" + "','".join(transform.transform_actions) + "']"
+            f.fullchip = self.fullchip
+
+            f.createDimension('pointdim',3)
+
+            if len(pixel_x.shape) == 2:
+                f.createDimension('udim',pixel_x.shape[1])
+                f.createDimension('vdim',pixel_x.shape[0])
+                dims = ('vdim','udim')
+            elif len(pixel_x.shape) == 1:
+                f.createDimension('udim',pixel_x.size)
+                dims = ('udim',)
+            else:
+                raise Exception('Cannot save RayData with >2D x and y arrays!')
+
+            # Ray start coordinates. In the compact format, if there are few enough distinct
+            # ray start positions we save these and a map of which is used by each pixel.
+            pupils = None
+            if compact:
+                pupils = _find_pupils(self.ray_start_coords)
+
+            if pupils is None:
+                raystart = f.createVariable('RayStartCoords','f4',dims + ('pointdim',))
+                raystart.units = 'm'
+                _copy_blocks(raystart,self.ray_start_coords)
+            else:
+                f.createDimension('pupildim',pupils[0].shape[0])
+                pupilpos = f.createVariable('PupilPositions','f8',('pupildim','pointdim'))
+                pupilpos[:] = pupils[0]
+                pupilpos.units = 'm'
+                pupilind = f.createVariable('PupilIndex','b',dims)
+                _copy_blocks(pupilind,pupils[1])
 
-        elif len(self.x.shape) == 1:
-            f.createDimension('udim',self.x.size)
-            rayhit = f.createVariable('RayEndCoords','f4',('udim','pointdim'))
-            raystart = f.createVariable('RayStartCoords','f4',('udim','pointdim'))
-            if self.model_normals is not None:
-                normals = f.createVariable('ModelNormals','f4',('udim','pointdim'))
+            # Ray end coordinates, or lengths and directions.
+            if ray_lengths:
+
+                get_lengths = lambda start,end : np.sqrt(np.sum((end - start)**2,axis=-1))
+
+                if quantise is None:
+                    rayhit = f.createVariable('RayLengths','f4',dims)
+                    encode = None
+                else:
+                    rayhit,encode = _create_quantised_variable(f,'RayLengths',dims,_finite_range(get_lengths,self.ray_start_coords,self.ray_end_coords),quantise)
+                _copy_blocks(rayhit,self.ray_start_coords,self.ray_end_coords,convert=get_lengths if encode is None else lambda start,end : encode(get_lengths(start,end)))
 
-            x = f.createVariable('PixelXLocation','f4',('udim',))
-            y = f.createVariable('PixelYLocation','f4',('udim',))
+                raydir,encode = _create_quantised_variable(f,'RayDirections',dims + ('pointdim',),(-1.,1.),1./32767)
+                _copy_blocks(raydir,self.ray_start_coords,self.ray_end_coords,convert=lambda start,end : encode((end - start) / get_lengths(start,end)[...,np.newaxis]))
+
+            elif quantise is not None:
+                rayhit,encode = _create_quantised_variable(f,'RayEndCoords',dims + ('pointdim',),_finite_range(None,self.ray_end_coords),quantise)
+                _copy_blocks(rayhit,self.ray_end_coords,convert=encode)
+
+            else:
+                rayhit = f.createVariable('RayEndCoords','f4',dims + ('pointdim',))
+                _copy_blocks(rayhit,self.ray_end_coords)
+
+            rayhit.units = 'm'
+
+            # Pixel coordinates. For full-chip data in the compact format, if they are
+            # a regular grid we only need to save the x and y axes.
+            if compact and len(dims) == 2 and np.array_equal(pixel_x[0,:],pixel_x[-1,:]) and np.array_equal(pixel_y[:,0],pixel_y[:,-1]) \
+                    and np.all(pixel_x == pixel_x[0,:]) and np.all(pixel_y == pixel_y[:,:1]):
+                x = f.createVariable('PixelXAxis','f4',('udim',))
+                y = f.createVariable('PixelYAxis','f4',('vdim',))
+                x[:] = pixel_x[0,:]
+                y[:] = pixel_y[:,0]
+            else:
+                x = f.createVariable('PixelXLocation','f4',dims)
+                y = f.createVariable('PixelYLocation','f4',dims)
+                _copy_blocks(x,pixel_x)
+                _copy_blocks(y,pixel_y)
+
+            if self.feature_index is not None:
+                f.feature_names = json.dumps(self.feature_names)
+                feature_index = f.createVariable('FeatureIndex','h',dims)
+                _copy_blocks(feature_index,self.feature_index)
 
-            rayhit[:,:] = self.ray_end_coords
-            raystart[:,:] = self.ray_start_coords
-            x[:] = self.x
-            y[:] = self.y
             if self.model_normals is not None:
-                normals[:,:] = self.model_normals
-        else:
-            raise Exception('Cannot save RayData with >2D x and y arrays!')
+                if quantise is None:
+                    normals = f.createVariable('ModelNormals', 'f4', dims + ('pointdim',))
+                    _copy_blocks(normals,self.model_normals)
+                else:
+                    normals,encode = _create_quantised_variable(f,'ModelNormals',dims + ('pointdim',),(-1.,1.),1./32767)
+                    _copy_blocks(normals,self.model_normals,convert=encode)
 
-        binning = f.createVariable('Binning','f4',())
+            binning = f.createVariable('Binning','f4',())
 
-        if self.binning is not None:
-            binning.assignValue(self.binning)
-        else:
-            binning.assignValue(0)
+            if self.binning is not None:
+                binning[()] = self.binning
+            else:
+                binning[()] = 0
 
-        f.createDimension('pixelsdim',2)
+            f.createDimension('pixelsdim',2)
 
-        xpx = f.createVariable('image_original_shape','i4',('pixelsdim',))
-        xpx[:] = [self.transform.x_pixels,self.transform.y_pixels]
+            xpx = f.createVariable('image_original_shape','i4',('pixelsdim',))
+            xpx[:] = [transform.x_pixels,transform.y_pixels]
 
-        offset = f.createVariable('image_offset','i4',('pixelsdim',))
-        offset[:] = self.transform.offset[:]
+            offset = f.createVariable('image_offset','i4',('pixelsdim',))
+            offset[:] = transform.offset[:]
 
-        pixelaspect = f.createVariable('image_original_pixel_aspect','f4',())
-        pixelaspect.assignValue(self.transform.pixel_aspectratio)
+            pixelaspect = f.createVariable('image_original_pixel_aspect','f4',())
+            pixelaspect[()] = transform.pixel_aspectratio
 
-        binning.units = 'pixels'
-        raystart.units = 'm'
-        rayhit.units = 'm'
-        x.units = 'pixels'
-        y.units = 'pixels'
-        f.close()
+            binning.units = 'pixels'
+            x.units = 'pixels'
+            y.units = 'pixels'
+            f.close()
+
+            os.replace(tmp_filename,filename)
 
-        self.set_detector_window(current_crop)
+        except:
+            f.close()
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+            raise
 
 
 
-    def _load(self,filename):
+    def _load(self,filename,lazy=False):
         '''
         Load RayData from a file.
 
         Parameters:
 
             filename (str) : File name to load from.
+            lazy (bool)    : Whether to memory map the data arrays instead \
+                             of reading them in to memory.
         '''
-        f = netcdf_file(filename, 'r',mmap=False)
+        from scipy.io.netcdf import netcdf_file
+        f = netcdf_file(filename, 'r',mmap=True)
         self.filename = filename
-               
-        self.ray_end_coords = f.variables['RayEndCoords'].data.astype(np.float32)
-        self.ray_start_coords = f.variables['RayStartCoords'].data.astype(np.float32)
+
+        # Quantised data (from compact files) always has to be read in to memory to convert it.
+        def get_data(var):
+            if hasattr(var,'scale_factor'):
+                return _dequantise(var)
+            elif lazy:
+                return _memmap_nc_variable(filename,var)
+            else:
+                return np.array(var.data,dtype=np.float32)
+
+        if 'PupilPositions' in f.variables:
+            self.ray_start_coords = _expand_pupils(f.variables['PupilPositions'].data,f.variables['PupilIndex'].data)
+        else:
+            self.ray_start_coords = get_data(f.variables['RayStartCoords'])
+
+        if 'RayEndCoords' in f.variables:
+            self.ray_end_coords = get_data(f.variables['RayEndCoords'])
+        else:
+            self.ray_end_coords = np.empty(self.ray_start_coords.shape,dtype=np.float32)
+            lengths = get_data(f.variables['RayLengths'])
+            directions = get_data(f.variables['RayDirections'])
+            for rows in _block_slices(lengths.shape):
+                self.ray_end_coords[rows] = self.ray_start_coords[rows] + lengths[rows][...,np.newaxis] * directions[rows]
+            del lengths,directions
+
         self.binning = f.variables['Binning'].data[()]
 
         self.transform = coordtransformer.CoordTransformer()
         self.transform.set_transform_actions(eval(f.image_transform_actions))
-        self.transform.x_pixels = f.variables['image_original_shape'][0]
-        self.transform.y_pixels = f.variables['image_original_shape'][1]
+        self.transform.x_pixels = int(f.variables['image_original_shape'][0])
+        self.transform.y_pixels = int(f.variables['image_original_shape'][1])
         self.transform.pixel_aspectratio = f.variables['image_original_pixel_aspect'].data[()]
 
         try:
-            self.transform.offset = f.variables['image_offset'][:]
+            self.transform.offset = np.array(f.variables['image_offset'][:])
         except KeyError:
             pass
 
         try:
-            self.model_normals = f.variables['ModelNormals'].data.astype(np.float32)
+            self.model_normals = get_data(f.variables['ModelNormals'])
         except KeyError:
             self.model_normals = None
 
+        if 'FeatureIndex' in f.variables:
+            if lazy:
+                self.feature_index = _memmap_nc_variable(filename,f.variables['FeatureIndex'])
+            else:
+                self.feature_index = np.array(f.variables['FeatureIndex'].data,dtype=np.int16)
+            self.feature_names = json.loads(f.feature_names.decode('utf-8'))
+
         try:
             self.history = f.history.decode('utf-8')
             self.fullchip = f.fullchip
             if not self.fullchip:
+                self.fullchip = False
                 self.binning = None
             elif self.fullchip != True:
                 self.fullchip = self.fullchip.decode('utf-8')
@@ -415,8 +914,14 @@ class RayData:
                 else:                
                     self.fullchip = True
 
-        self.x = f.variables['PixelXLocation'].data
-        self.y = f.variables['PixelYLocation'].data
+        if 'PixelXLocation' in f.variables:
+            self.x = get_data(f.variables['PixelXLocation'])
+            self.y = get_data(f.variables['PixelYLocation'])
+        else:
+            xaxis = np.array(f.variables['PixelXAxis'].data,dtype=np.float32)
+            yaxis = np.array(f.variables['PixelYAxis'].data,dtype=np.float32)
+            self.x = np.broadcast_to(xaxis[np.newaxis,:],(yaxis.size,xaxis.size))
+            self.y = np.broadcast_to(yaxis[:,np.newaxis],(yaxis.size,xaxis.size))
 
         f.close()
 
@@ -443,17 +948,10 @@ class RayData:
 
             if self.crop is not None:
 
-                dx = self.crop[0] - self.native_geometry[2][0]
-                dy = self.crop[1] - self.native_geometry[2][1]
-
-                ox, oy = self.transform.display_to_original_coords(self.x, self.y)
-                ox = ox + dx
-                oy = oy + dy
+                _,self.x,self.y = self._get_native_geometry()
 
                 self.transform.x_pixels,self.transform.y_pixels,self.transform.offset = self.native_geometry
 
-                self.x,self.y = self.transform.original_to_display_coords(ox,oy)
-
                 del self.native_geometry
 
                 self.crop_inds = None
@@ -505,6 +1003,107 @@ class RayData:
             raise ValueError('Cannot understand detector window; should be None or (Left,Top,Width,Height)')
 
 
+    # Get the image geometry and pixel coordinates corresponding to the native (uncropped)
+    # detector window, without changing the current detector window.
+    # Returns the coordinate transformer, x and y pixel coordinates.
+    def _get_native_geometry(self):
+
+        if self.crop is None:
+            return self.transform,self.x,self.y
+
+        dx = self.crop[0] - self.native_geometry[2][0]
+        dy = self.crop[1] - self.native_geometry[2][1]
+
+        ox, oy = self.transform.display_to_original_coords(self.x, self.y)
+        ox = ox + dx
+        oy = oy + dy
+
+        transform = copy.copy(self.transform)
+        transform.x_pixels,transform.y_pixels,transform.offset = self.native_geometry
+
+        x,y = transform.original_to_display_coords(ox,oy)
+
+        return transform,x,y
+
+
+    # Get a per-pixel quantity either for every casted sight-line (within the current detector window)
+    # or for the sight-lines nearest the given pixel coordinates. get_values is a function which is passed
+    # a function for selecting the required pixels from the ray data arrays, and returns the quantity
+    # for those pixels. This way, only the required pixels are read from lazy loaded ray data.
+    def _get_pixel_values(self,get_values,x,y,im_position_tol,coords):
+
+        if x is None and y is None:
+
+            if self.crop is None:
+                values = get_values(lambda data : data)
+            elif self.fullchip:
+                values = get_values(lambda data : data[self.crop_inds[0]][:,self.crop_inds[1]])
+            else:
+                values = get_values(lambda data : data[self.crop_inds[0]][self.crop_inds[1]])
+
+            if self.fullchip and coords.lower() != 'display':
+                values = self.transform.display_to_original_image(values)
+
+            return values
+
+        if self.x is None or self.y is None:
+            raise Exception('This ray data does not have x and y pixel indices!')
+        if np.shape(x) != np.shape(y):
+            raise ValueError('x and y arrays must be the same shape!')
+
+        if coords.lower() == 'original':
+            x,y = self.transform.original_to_display_coords(x,y)
+
+        oldshape = np.shape(x)
+        x = np.reshape(x,np.size(x),order='F').astype(float)
+        y = np.reshape(y,np.size(y),order='F').astype(float)
+
+        valid = np.isfinite(x) & np.isfinite(y)
+
+        inds,dist = self._find_pixels(x[valid],y[valid])
+
+        if np.any(dist > im_position_tol):
+            badind = np.argwhere(dist > im_position_tol)[0][0]
+            raise Exception('No ray-traced pixel within im_position_tol of requested pixel ({:.1f},{:.1f})!'.format(x[valid][badind],y[valid][badind]))
+
+        values = np.asarray(get_values(lambda data : data[inds]))
+
+        out = np.full((x.size,) + values.shape[1:],np.nan)
+        out[valid] = values
+
+        return np.reshape(out,oldshape + values.shape[1:],order='F')
+
+
+    # Find the casted sight-lines nearest to given (1D arrays of) display pixel coordinates.
+    # Returns a tuple of index arrays for indexing the ray data arrays, and an array of the distances
+    # in pixels between the requested and nearest casted pixel positions.
+    def _find_pixels(self,x,y):
+
+        # For full chip ray data, the pixel positions are usually a regular grid
+        # aligned with the array axes, so we can look up the rows and columns separately.
+        if self.fullchip and self.x.ndim == 2 and np.array_equal(self.x[0,:],self.x[-1,:]) and np.array_equal(self.y[:,0],self.y[:,-1]):
+
+            colinds,dx = _nearest_1d(np.array(self.x[0,:]),x)
+            rowinds,dy = _nearest_1d(np.array(self.y[:,0]),y)
+
+            return (rowinds,colinds), np.sqrt(dx**2 + dy**2)
+
+        # Otherwise, use a KD tree of all the casted pixel positions, which we keep
+        # for as long as the pixel coordinates don't change.
+        if getattr(self,'_pixel_tree',None) is None or self._pixel_tree[0] is not self.x or self._pixel_tree[1] is not self.y:
+
+            xflat = np.ravel(self.x)
+            yflat = np.ravel(self.y)
+            tree_inds = np.argwhere(np.isfinite(xflat) & np.isfinite(yflat))[:,0]
+            from scipy.spatial import cKDTree
+            self._pixel_tree = (self.x,self.y,cKDTree(np.stack((xflat[tree_inds],yflat[tree_inds]),axis=-1)),tree_inds)
+
+        dist,nearest = self._pixel_tree[2].query(np.stack((x,y),axis=-1))
+
+        return np.unravel_index(self._pixel_tree[3][nearest],np.shape(self.x)), dist
+
+
+
     def get_ray_start(self,x=None,y=None,im_position_tol = 1,coords='Display'):
         '''
         Get the 3D x,y,z coordinates of the "start" of the casted rays / sightlines.
@@ -529,58 +1128,7 @@ class RayData:
                                       dimension added which contains the  [X,Y,Z] 3D coordinates. Otherwise the shape\
                                       is (h x w x 3) where w and h are the image width and height (in display coords).
         '''
-        if x is None and y is None:
-            if self.fullchip:
-                if coords.lower() == 'display':
-                    if self.crop is None:
-                        return self.ray_start_coords
-                    else:
-                        return self.ray_start_coords[self.crop_inds[0],:,:][:,self.crop_inds[1],:]
-                else:
-                    if self.crop is None:
-                        return self.transform.display_to_original_image(self.ray_start_coords)
-                    else:
-                        return self.transform.display_to_original_image(self.ray_start_coords[self.crop_inds[0],:,:][:,self.crop_inds[1],:])
-            else:
-                if self.crop is None:
-                    return self.ray_start_coords
-                else:
-                    return self.ray_start_coords[self.crop_inds[0],:][self.crop_inds[1],:]
-        else:
-            if self.x is None or self.y is None:
-                raise Exception('This ray data does not have x and y pixel indices!')
-            if np.shape(x) != np.shape(y):
-                raise ValueError('x and y arrays must be the same shape!')
-            else:
-
-                if coords.lower() == 'original':
-                    x,y = self.transform.original_to_display_coords(x,y)
-
-                oldshape = np.shape(x)
-                x = np.reshape(x,np.size(x),order='F')
-                y = np.reshape(y,np.size(y),order='F')
-                [start_X,start_Y,start_Z] = np.split(self.ray_start_coords,3,-1)
-                start_X = start_X.flatten()
-                start_Y = start_Y.flatten()
-                start_Z = start_Z.flatten()
-                xflat = self.x.flatten()
-                yflat = self.y.flatten()
-                Xout = np.zeros(np.shape(x))
-                Yout = np.zeros(np.shape(x))
-                Zout = np.zeros(np.shape(x))
-                for pointno in range(x.size):
-                    deltaX = xflat - x[pointno]
-                    deltaY = yflat - y[pointno]
-                    deltaR = np.sqrt(deltaX**2 + deltaY**2)
-                    if np.min(deltaR) <= im_position_tol:
-                        Xout[pointno] = start_X[np.argmin(deltaR)]
-                        Yout[pointno] = start_Y[np.argmin(deltaR)]
-                        Zout[pointno] = start_Z[np.argmin(deltaR)]
-                    else:
-                        raise Exception('No ray-traced pixel within im_position_tol of requested pixel ({:.1f},{:.1f})!'.format(x[pointno],y[pointno]))
-                out = np.hstack([Xout,Yout,Zout])
-
-                return np.reshape(out,oldshape + (3,),order='F')
+        return self._get_pixel_values(lambda select : select(self.ray_start_coords),x,y,im_position_tol,coords)
 
 
     def get_ray_end(self,x=None,y=None,im_position_tol = 1,coords='Display'):
@@ -608,58 +1156,7 @@ class RayData:
                                       is (h x w x 3) where w and h are the image width and height (in display coords).
 
         '''
-        if x is None and y is None:
-            if self.fullchip:
-                if coords.lower() == 'display':
-                    if self.crop is None:
-                        return self.ray_end_coords
-                    else:
-                        return self.ray_end_coords[self.crop_inds[0],:,:][:,self.crop_inds[1],:]
-                else:
-                    if self.crop is None:
-                        return self.transform.display_to_original_image(self.ray_end_coords)
-                    else:
-                        return self.transform.display_to_original_image(self.ray_end_coords[self.crop_inds[0],:,:][:, self.crop_inds[1],:])
-            else:
-                if self.crop is None:
-                    return self.ray_end_coords
-                else:
-                    return self.ray_end_coords[self.crop_inds[0],:][self.crop_inds[1],:]
-        else:
-            if self.x is None or self.y is None:
-                raise Exception('This ray data does not have x and y pixel indices!')
-            if np.shape(x) != np.shape(y):
-                raise ValueError('x and y arrays must be the same shape!')
-            else:
-
-                if coords.lower() == 'original':
-                    x,y = self.transform.original_to_display_coords(x,y)
-
-                oldshape = np.shape(x)
-                x = np.reshape(x,np.size(x),order='F')
-                y = np.reshape(y,np.size(y),order='F')
-                [end_X,end_Y,end_Z] = np.split(self.ray_end_coords,3,-1)
-                end_X = end_X.flatten()
-                end_Y = end_Y.flatten()
-                end_Z = end_Z.flatten()
-                xflat = self.x.flatten()
-                yflat = self.y.flatten()
-                Xout = np.zeros(np.shape(x))
-                Yout = np.zeros(np.shape(x))
-                Zout = np.zeros(np.shape(x))
-                for pointno in range(x.size):
-                    deltaX = xflat - x[pointno]
-                    deltaY = yflat - y[pointno]
-                    deltaR = np.sqrt(deltaX**2 + deltaY**2)
-                    if np.min(deltaR) <= im_position_tol:
-                        Xout[pointno] = end_X[np.argmin(deltaR)]
-                        Yout[pointno] = end_Y[np.argmin(deltaR)]
-                        Zout[pointno] = end_Z[np.argmin(deltaR)]
-                    else:
-                        raise Exception('No ray-traced pixel within im_position_tol of requested pixel!')
-                out = np.hstack([Xout,Yout,Zout])
-
-                return np.reshape(out,oldshape + (3,),order='F')
+        return self._get_pixel_values(lambda select : select(self.ray_end_coords),x,y,im_position_tol,coords)
 
 
     def get_model_normals(self,x=None,y=None,im_position_tol = 1,coords='Display'):
@@ -692,58 +1189,8 @@ class RayData:
         if self.model_normals is None:
             raise Exception('Model normals were not calculated when doing the ray-cast. To use this function you must use raycast_sightlines() with calc_normals=True.')
 
-        if x is None and y is None:
-            if self.fullchip:
-                if coords.lower() == 'display':
-                    if self.crop is None:
-                        return self.model_normals
-                    else:
-                        return self.model_normals[self.crop_inds[0],:,:][:,self.crop_inds[1],:]
-                else:
-                    if self.crop is None:
-                        return self.transform.display_to_original_image(self.model_normals)
-                    else:
-                        return self.transform.display_to_original_image(self.model_normals[self.crop_inds[0],:,:][:, self.crop_inds[1],:])
-            else:
-                if self.crop is None:
-                    return self.model_normals
-                else:
-                    return self.model_normals[self.crop_inds[0],:][self.crop_inds[1],:]
-        else:
-            if self.x is None or self.y is None:
-                raise Exception('This ray data does not have x and y pixel indices!')
-            if np.shape(x) != np.shape(y):
-                raise ValueError('x and y arrays must be the same shape!')
-            else:
+        return self._get_pixel_values(lambda select : select(self.model_normals),x,y,im_position_tol,coords)
 
-                if coords.lower() == 'original':
-                    x,y = self.transform.original_to_display_coords(x,y)
-
-                oldshape = np.shape(x)
-                x = np.reshape(x,np.size(x),order='F')
-                y = np.reshape(y,np.size(y),order='F')
-                [norm_X,norm_Y,norm_Z] = np.split(self.model_normals,3,-1)
-                norm_X = norm_X.flatten()
-                norm_Y = norm_Y.flatten()
-                norm_Z = norm_Z.flatten()
-                xflat = self.x.flatten()
-                yflat = self.y.flatten()
-                Xout = np.zeros(np.shape(x))
-                Yout = np.zeros(np.shape(x))
-                Zout = np.zeros(np.shape(x))
-                for pointno in range(x.size):
-                    deltaX = xflat - x[pointno]
-                    deltaY = yflat - y[pointno]
-                    deltaR = np.sqrt(deltaX**2 + deltaY**2)
-                    if np.min(deltaR) <= im_position_tol:
-                        Xout[pointno] = norm_X[np.argmin(deltaR)]
-                        Yout[pointno] = norm_Y[np.argmin(deltaR)]
-                        Zout[pointno] = norm_Z[np.argmin(deltaR)]
-                    else:
-                        raise Exception('No ray-traced pixel within im_position_tol of requested pixel!')
-                out = np.hstack([Xout,Yout,Zout])
-
-                return np.reshape(out,oldshape + (3,),order='F')
 
     def get_ray_lengths(self,x=None,y=None,im_position_tol = 1,coords='Display'):
         '''
@@ -767,73 +1214,12 @@ class RayData:
                                       (h x w) where w nd h are the image width and height. Otherwise it will \
                                       be the same shape as the input x and y coordinates.
         '''
-        
-        # Work out ray lengths for all raytraced pixels
-        raylength = np.sqrt(np.sum( (self.ray_end_coords - self.ray_start_coords) **2,axis=-1))
-        
-        # If no x and y given, return them all
-        if x is None and y is None:
-            if self.fullchip:
-                if coords.lower() == 'display':
-                    if self.crop is None:
-                        return raylength
-                    else:
-                        return raylength[self.crop_inds[0],:][:,self.crop_inds[1]]
-                else:
-                    if self.crop is None:
-                        return self.transform.display_to_original_image(raylength)
-                    else:
-                        return self.transform.display_to_original_image(raylength[self.crop_inds[0],:][:,self.crop_inds[1]])
-            else:
-                if self.crop is None:
-                    return raylength
-                else:
-                    return raylength[self.crop_inds[0]][self.crop_inds[1]]
-        else:
-            if self.x is None or self.y is None:
-                raise Exception('This ray data does not have x and y pixel indices!')
 
-            # Otherwise, return the ones at given x and y pixel coords.
-            if np.shape(x) != np.shape(y):
-                raise ValueError('x and y arrays must be the same shape!')
-            else:
-
-                if coords.lower() == 'original':
-                    x,y = self.transform.original_to_display_coords(x,y)
-
-                orig_shape = np.shape(x)
-                x = np.reshape(x,np.size(x),order='F')
-                y = np.reshape(y,np.size(y),order='F')
-                RL = np.zeros(np.shape(x))
-
-                if not self.fullchip:
-                    raylength = raylength.flatten()
-                    xflat = self.x.flatten()
-                    yflat = self.y.flatten()
-
-                for pointno in range(x.size):
-                    if np.isnan(x[pointno]) or np.isnan(y[pointno]):
-                        RL[pointno] = np.nan
-                        continue
-
-                    if self.fullchip:
-                        xind = np.argmin(np.abs(self.x[0,:] - x[pointno]))
-                        yind = np.argmin(np.abs(self.y[:,0] - y[pointno]))
-                        deltaR = np.sqrt( (self.x[0,xind]-x[pointno])**2 + (self.y[yind,0]-y[pointno])**2)
-                        if deltaR < im_position_tol:
-                            RL[pointno] = raylength[yind,xind]
-                        else:
-                            raise Exception('No ray-traced pixel within im_position_tol of requested pixel ({:.1f},{:.1f})!'.format(x[pointno], y[pointno]))
-                    else:
-                        # This can be very slow if xflat and yflat are big arrays!
-                        deltaR = np.sqrt( (xflat - x[pointno])**2 + (yflat - y[pointno])**2 )
-                        if np.nanmin(deltaR) <= im_position_tol:
-                            RL[pointno] = raylength[np.nanargmin(deltaR)]
-                        else:
-                            raise Exception('No ray-traced pixel within im_position_tol of requested pixel!')
-
-                return np.reshape(RL,orig_shape,order='F')
+        # Work out ray lengths only for the sight-lines we need
+        def get_lengths(select):
+            return np.sqrt(np.sum( (select(self.ray_end_coords) - select(self.ray_start_coords)) **2,axis=-1))
 
+        return self._get_pixel_values(get_lengths,x,y,im_position_tol,coords)
 
 
     def get_ray_directions(self,x=None,y=None,im_position_tol=1,coords='Display'):
@@ -861,59 +1247,407 @@ class RayData:
                                       (h x w x 3) where w nd h are the image width and height. Otherwise it will \
                                       be the same shape as the input x and y coordinates plus an extra dimension.
         '''
-        vectors = (self.ray_end_coords - self.ray_start_coords)
-        lengths = np.sqrt(np.sum(vectors**2,axis=-1))
-        dirs =  vectors / np.repeat(lengths.reshape(np.shape(lengths)+(1,)),3,axis=-1)
 
-        if x is None and y is None:
-            if self.fullchip:
-                if coords.lower() == 'display':
-                    if self.crop is None:
-                        return dirs
-                    else:
-                        return dirs[self.crop_inds[0],:,:][:,self.crop_inds[1],:]
-                else:
-                    if self.crop is None:
-                        return self.transform.display_to_original_image(dirs)
-                    else:
-                        return self.transform.display_to_original_image(dirs[self.crop_inds[0],:,:][:, self.crop_inds[1],:])
-            else:
-                if self.crop is None:
-                    return dirs
-                else:
-                    return dirs[self.crop_inds[0]][self.crop_inds[1]]
+        def get_directions(select):
+            vectors = select(self.ray_end_coords) - select(self.ray_start_coords)
+            lengths = np.sqrt(np.sum(vectors**2,axis=-1))
+            return vectors / np.repeat(lengths.reshape(np.shape(lengths)+(1,)),3,axis=-1)
+
+        return self._get_pixel_values(get_directions,x,y,im_position_tol,coords)
+
+
+
+    def get_feature_index(self,x=None,y=None,im_position_tol=1,coords='Display'):
+        '''
+        Get which CAD model feature each sight-line intersects, as indices in to the list of \
+        feature names in this object's feature_names attribute.
+
+        Parameters:
+
+            x,y (array-like)        : Image pixel coordinates at which to get the feature indices. \
+                                      If not specified, the feature indices for all casted sight lines will be returned.
+            im_position_tol (float) : If x and y are specified but no sight-line was cast at exactly the \
+                                      input coordinates, the nearest casted sight-line will be returned \
+                                      instead provided the pixel coordinates wre within this many pixels of \
+                                      the requested coordinates.
+            coords (str)            : Either ``Display`` or ``Original``, specifies what orientation the input x \
+                                      and y correspond to or orientation of the returned array.
+
+        Returns:
+
+            np.ndarray              : Integer array containing the index in feature_names of the feature each sight-line \
+                                      intersects, or -1 for sight-lines which do not intersect the CAD model. If the ray cast \
+                                      was for the full detector and x and y are not specified, the array shape will be \
+                                      (h x w) where w nd h are the image width and height. Otherwise it will \
+                                      be the same shape as the input x and y coordinates.
+        '''
+        if self.feature_index is None:
+            raise Exception('This ray data does not contain information about which CAD model features were hit. It was either made with an older version of Calcam or by ray casting with only the wall contour.')
+
+        feature_index = self._get_pixel_values(lambda select : select(self.feature_index),x,y,im_position_tol,coords)
+
+        # If looking up specific pixels, invalid pixel coordinates come back as NaN.
+        if x is not None:
+            feature_index = np.where(np.isfinite(feature_index),feature_index,-1)
+
+        return np.asarray(feature_index).astype(np.int16)
+
+
+    def get_feature_mask(self,features,x=None,y=None,im_position_tol=1,coords='Display'):
+        '''
+        Get a mask of which sight-lines intersect the given CAD model feature(s). This can be used \
+        to select the parts of an image looking at particular parts of the model using a single \
+        ray cast with all the features of interest enabled.
+
+        Parameters:
+
+            features (str or list of str) : Name(s) of the feature(s) and/or group(s) of features to \
+                                            get the mask for.
+            x,y (array-like)              : Image pixel coordinates at which to get the mask. \
+                                            If not specified, the mask for all casted sight lines will be returned.
+            im_position_tol (float)       : If x and y are specified but no sight-line was cast at exactly the \
+                                            input coordinates, the nearest casted sight-line will be used \
+                                            instead provided the pixel coordinates wre within this many pixels of \
+                                            the requested coordinates.
+            coords (str)                  : Either ``Display`` or ``Original``, specifies what orientation the input x \
+                                            and y correspond to or orientation of the returned array.
+
+        Returns:
+
+            np.ndarray                    : Boolean array which is True for sight-lines which intersect one of the \
+                                            given features, with the same shape as returned by get_feature_index().
+        '''
+        if type(features) is not list:
+            features = [features]
+
+        feature_index = self.get_feature_index(x,y,im_position_tol,coords)
+
+        selected = []
+        for requested in features:
+            matches = [i for i,fname in enumerate(self.feature_names) if fname == requested or fname.startswith(requested + '/')]
+            if len(matches) == 0:
+                raise ValueError('Feature or group "{:s}" was not enabled for this ray cast!'.format(requested))
+            selected = selected + matches
+
+        return np.isin(feature_index,selected)
+
+
+
+def get_wall_coords(raydata,wall_contour,coords='Display'):
+    '''
+    Get the position along the wall contour (s coordinate), toroidal angle and distance from the
+    wall contour of the points where camera sight-lines hit the wall, for every pixel at once.
+    Positions are mapped on to the nearest point of the R,Z wall contour.
+
+    Results are cached, so getting the wall coordinates for the same ray data and wall contour
+    again (e.g. for every frame of a video from the same camera) does not re-calculate them.
+    See ``calcam.raycast.wall_coords_cache_size`` for the cache size.
+
+    Parameters:
+
+        raydata (calcam.RayData or np.ndarray)        : Ray casting results to get the wall coordinates for, or an array \
+                                                        of 3D X,Y,Z coordinates (in metres) with shape (...,3).
+
+        wall_contour (np.ndarray or calcam.CADModel)  : Nx2 array of R,Z wall contour coordinates in metres, or a CAD model \
+                                                        whose wall contour to use. The contour is taken to be closed, and s \
+                                                        coordinates are measured along it starting from its first point.
+
+        coords (str)                                  : If raydata is a RayData object, either ``Display`` or ``Original`` to \
+                                                        specify the orientation of the returned arrays.
+
+    Returns:
+
+        Multiple return values:
+            - np.ndarray : s coordinates, i.e. distances along the wall contour, in metres.
+            - np.ndarray : Toroidal angles in degrees, from 0 to 360.
+            - np.ndarray : Distances from the wall contour in the R,Z plane, in metres.
+
+        Each array has the same shape as the RayData's ray end coordinates or the input coordinate array, \
+        excluding the last dimension. Values are NaN where the input coordinates are NaN.
+    '''
+    if isinstance(raydata,RayData):
+        points = raydata.get_ray_end(coords=coords)
+    else:
+        points = np.asarray(raydata)
+        if points.shape[-1] != 3:
+            raise ValueError('Coordinate array must have shape (...,3)!')
+
+    if hasattr(wall_contour,'wall_contour'):
+        if wall_contour.wall_contour is None:
+            raise ValueError('CAD model "{:s}" does not have a wall contour!'.format(wall_contour.machine_name))
+        wall_contour = wall_contour.wall_contour
+
+    wall_contour = np.ascontiguousarray(wall_contour,dtype=np.float64)
+    points = np.ascontiguousarray(points,dtype=np.float64)
+
+    cache_key = (hashlib.sha1(points).hexdigest(),points.shape,hashlib.sha1(wall_contour).hexdigest(),wall_contour.shape)
+    if cache_key in _wall_coords_cache:
+        _wall_coords_cache.move_to_end(cache_key)
+        return tuple([values.copy() for values in _wall_coords_cache[cache_key]])
+
+    out_shape = points.shape[:-1]
+    points = points.reshape(-1,3)
+
+    s = np.full(points.shape[0],np.nan)
+    dist = np.full(points.shape[0],np.nan)
+
+    phi = np.arctan2(points[:,1],points[:,0]) * 180 / np.pi
+    phi[phi < 0] = phi[phi < 0] + 360.
+
+    valid = np.all(np.isfinite(points),axis=1)
+    rz = np.stack((np.sqrt(points[valid,0]**2 + points[valid,1]**2),points[valid,2]),axis=-1)
+
+    _,seg_vec,seg_s,_,_,_ = _get_contour_index(wall_contour)
+    seg_inds,t_seg,dist[valid] = _nearest_contour_segments(rz,wall_contour)
+    seg_len = np.sqrt(np.sum(seg_vec**2,axis=-1))
+    s[valid] = np.mod(seg_s[seg_inds] + t_seg * seg_len[seg_inds],seg_s[-1] + seg_len[-1])
+
+    results = (s.reshape(out_shape),phi.reshape(out_shape),dist.reshape(out_shape))
+
+    if wall_coords_cache_size > 0:
+        _wall_coords_cache[cache_key] = tuple([values.copy() for values in results])
+        while len(_wall_coords_cache) > wall_coords_cache_size:
+            _wall_coords_cache.popitem(last=False)
+
+    return results
+
+
+# Get a spatial index of the segments of a closed R,Z wall contour. The segments are split in to
+# pieces no longer than a typical segment, and the piece mid-points put in a KD tree. Since any
+# point on a piece is within half a piece length of its mid-point, searching the KD tree gives a
+# short list of candidates for the nearest segment to a point, which is guaranteed to contain it
+# if the furthest candidate is at least half a piece length further away than the nearest segment.
+# Returns arrays of the segment start coordinates, segment vectors and s coordinates of the segment starts,
+# the KD tree, an array of which segment each piece belongs to and the maximum piece length.
+def _get_contour_index(contour):
+
+    key = (hashlib.sha1(np.ascontiguousarray(contour,dtype=np.float64)).hexdigest(),contour.shape)
+    if key in _contour_index_cache:
+        _contour_index_cache.move_to_end(key)
+        return _contour_index_cache[key]
+
+    from scipy.spatial import cKDTree
+
+    seg_start = np.array(contour,dtype=np.float64)
+    if np.abs(seg_start[0,:] - seg_start[-1,:]).max() < 1e-15:
+        seg_start = seg_start[:-1]
+    seg_vec = np.roll(seg_start,-1,axis=0) - seg_start
+    seg_len = np.sqrt(np.sum(seg_vec**2,axis=1))
+    seg_s = np.concatenate(([0.],np.cumsum(seg_len)[:-1]))
+
+    piece_length = np.median(seg_len)
+    n_pieces = np.maximum(1,np.ceil(seg_len / piece_length).astype(int))
+    piece_segs = np.repeat(np.arange(seg_start.shape[0]),n_pieces)
+    piece_pos = (np.arange(piece_segs.size) - np.repeat(np.cumsum(n_pieces) - n_pieces,n_pieces) + 0.5) / n_pieces[piece_segs]
+    piece_mids = seg_start[piece_segs] + piece_pos[:,np.newaxis] * seg_vec[piece_segs]
+
+    index = (seg_start,seg_vec,seg_s,cKDTree(piece_mids),piece_segs,(seg_len/n_pieces).max())
+
+    _contour_index_cache[key] = index
+    while len(_contour_index_cache) > wall_coords_cache_size:
+        _contour_index_cache.popitem(last=False)
+
+    return index
+
+
+# Find the nearest segments of a closed R,Z wall contour to an Nx2 array of R,Z points.
+# Returns arrays of the segment indices, the positions along the segments (from 0 to 1)
+# of the nearest points on them, and the distances to them.
+def _nearest_contour_segments(points,contour,n_candidates=4):
+
+    seg_start,seg_vec,_,tree,piece_segs,piece_length = _get_contour_index(contour)
+
+    segs = np.zeros(points.shape[0],dtype=int)
+    t = np.zeros(points.shape[0])
+    dist = np.zeros(points.shape[0])
+
+    # Start by checking the segments of a few of the nearest pieces to each point. For any points
+    # where the nearest segment might not have been among them, look at more pieces.
+    todo = np.arange(points.shape[0])
+    while todo.size > 0:
+
+        n_candidates = min(n_candidates,piece_segs.size)
+        piece_dist,pieces = tree.query(points[todo],k=n_candidates)
+        piece_dist = piece_dist.reshape(todo.size,n_candidates)
+        candidates = piece_segs[pieces.reshape(todo.size,n_candidates)]
+
+        start = seg_start[candidates]
+        vec = seg_vec[candidates]
+        offset = points[todo,np.newaxis,:] - start
+        cand_t = np.clip(np.nan_to_num(np.sum(offset * vec,axis=-1) / np.sum(vec**2,axis=-1)),0.,1.)
+        cand_dist = np.sqrt(np.sum((offset - cand_t[...,np.newaxis] * vec)**2,axis=-1))
+
+        nearest = np.argmin(cand_dist,axis=1)
+        rows = np.arange(todo.size)
+        segs[todo] = candidates[rows,nearest]
+        t[todo] = cand_t[rows,nearest]
+        dist[todo] = cand_dist[rows,nearest]
+
+        if n_candidates == piece_segs.size:
+            break
+
+        todo = todo[piece_dist[:,-1] < dist[todo] + piece_length/2]
+        n_candidates = n_candidates * 4
+
+    return segs,t,dist
+
+
+# Get a read-only memory map of a variable in a netCDF file which has been opened
+# with mmap=True. Unlike the variable's own data array, this does not depend on the
+# netcdf_file object, so the file can be closed cleanly.
+def _memmap_nc_variable(filename,variable):
+
+    data = variable.data
+
+    # Find the start of the memory mapped buffer the variable data lives in
+    buf = data
+    while isinstance(buf,np.ndarray):
+        buf = buf.base
+    offset = data.__array_interface__['data'][0] - np.frombuffer(buf,dtype=np.uint8).__array_interface__['data'][0]
+
+    return np.memmap(filename,dtype=data.dtype,mode='r',offset=offset,shape=data.shape)
+
+
+# Iterate over slices along the first axis of an array with the given shape,
+# with each slice containing roughly block_size array elements.
+def _block_slices(shape,block_size=1048576):
+
+    rows_per_block = max(1,block_size // max(1,int(np.prod(shape[1:]))))
+
+    for start in range(0,shape[0],rows_per_block):
+        yield slice(start,start+rows_per_block)
+
+
+# Copy data in to a netCDF variable a block at a time, to avoid making full size
+# temporary copies when converting the data. If given, convert is a function which
+# takes blocks of each of the data arrays and returns a block of data to save.
+def _copy_blocks(variable,*data,convert=None):
+
+    for rows in _block_slices(data[0].shape):
+        blocks = [array[rows] for array in data]
+        if convert is None:
+            variable[rows] = blocks[0]
         else:
-            if self.x is None or self.y is None:
-                raise Exception('This ray data does not have x and y pixel indices!')
-            if np.shape(x) != np.shape(y):
-                raise ValueError('x and y arrays must be the same shape!')
-            else:
+            variable[rows] = convert(*blocks)
 
-                if coords.lower() == 'original':
-                    x,y = self.transform.original_to_display_coords(x,y)
-
-                oldshape = np.shape(x)
-                x = np.reshape(x,np.size(x),order='F')
-                y = np.reshape(y,np.size(y),order='F')
-                [dirs_X,dirs_Y,dirs_Z] = np.split(dirs,3,-1)
-                dirs_X = dirs_X.flatten()
-                dirs_Y = dirs_Y.flatten()
-                dirs_Z = dirs_Z.flatten()
-                xflat = self.x.flatten()
-                yflat = self.y.flatten()
-                Xout = np.zeros(np.shape(x))
-                Yout = np.zeros(np.shape(x))
-                Zout = np.zeros(np.shape(x))
-                for pointno in range(x.size):
-                    deltaX = xflat - x[pointno]
-                    deltaY = yflat - y[pointno]
-                    deltaR = np.sqrt(deltaX**2 + deltaY**2)
-                    if np.min(deltaR) <= im_position_tol:
-                        Xout[pointno] = dirs_X[np.argmin(deltaR)]
-                        Yout[pointno] = dirs_Y[np.argmin(deltaR)]
-                        Zout[pointno] = dirs_Z[np.argmin(deltaR)]
-                    else:
-                        raise Exception('No ray-traced pixel within im_position_tol of requested pixel!')
-                out = np.hstack([Xout,Yout,Zout])
-
-                return np.reshape(out,oldshape + (3,),order='F')
+
+# Get the (min,max) range of the finite values of some data, a block at a time.
+# If given, func is a function which takes blocks of the data arrays and returns
+# the values to get the range of.
+def _finite_range(func,*data):
+
+    data_range = [np.inf,-np.inf]
+
+    for rows in _block_slices(data[0].shape):
+        blocks = [array[rows] for array in data]
+        values = blocks[0] if func is None else func(*blocks)
+        values = values[np.isfinite(values)]
+        if values.size > 0:
+            data_range = [min(data_range[0],values.min()),max(data_range[1],values.max())]
+
+    if not np.isfinite(data_range[0]):
+        data_range = [0.,0.]
+
+    return data_range
+
+
+# Create a netCDF variable to store data as integers at a given resolution, using the
+# CF conventions scale_factor, add_offset and _FillValue attributes (NaNs are saved as
+# the fill value). Returns the variable and a function to encode data to save in it.
+def _create_quantised_variable(f,name,dims,data_range,resolution):
+
+    centre = (data_range[0] + data_range[1]) / 2.
+
+    if (data_range[1] - data_range[0]) / resolution <= 65534:
+        dtype = np.int16
+    elif (data_range[1] - data_range[0]) / resolution <= 2**32 - 2:
+        dtype = np.int32
+    else:
+        raise ValueError('Quantisation resolution {:.1e} is too fine for the data range!'.format(resolution))
+
+    fill_value = np.iinfo(dtype).min
+
+    variable = f.createVariable(name,dtype,dims)
+    variable.scale_factor = resolution
+    variable.add_offset = centre
+    variable._FillValue = dtype(fill_value)
+
+    def encode(data):
+        encoded = np.round((data - centre) / resolution)
+        encoded[np.isfinite(encoded) == False] = fill_value
+        return encoded.astype(dtype)
+
+    return variable,encode
+
+
+# Read data saved by a variable made with _create_quantised_variable() as float32.
+def _dequantise(variable):
+
+    data = variable.data
+    out = np.empty(data.shape,dtype=np.float32)
+
+    for rows in _block_slices(data.shape):
+        block = data[rows]
+        out[rows] = block * variable.scale_factor + variable.add_offset
+        out[rows][block == variable._FillValue] = np.nan
+
+    return out
+
+
+# Find the distinct ray start coordinates in an array of ray start coordinates.
+# Returns a tuple of an Nx3 array of the distinct start positions, and an array of
+# which of these each ray uses (-1 for rays without a start position), or None if
+# there are too many distinct start positions for this to be worth doing.
+def _find_pupils(start_coords,max_pupils=127):
+
+    pupils = []
+    index = np.full(start_coords.shape[:-1],-1,dtype=np.int8)
+
+    for rows in _block_slices(start_coords.shape):
+
+        block = np.asarray(start_coords[rows])
+        block_index = index[rows]
+
+        for pupil_ind,pupil in enumerate(pupils):
+            block_index[np.all(block == pupil,axis=-1)] = pupil_ind
+
+        unassigned = np.all(np.isfinite(block),axis=-1) & (block_index < 0)
+        while np.any(unassigned):
+            if len(pupils) == max_pupils:
+                return None
+            pupils.append(block[unassigned][0])
+            matches = np.all(block == pupils[-1],axis=-1)
+            block_index[matches] = len(pupils) - 1
+            unassigned[matches] = False
+
+    if len(pupils) == 0:
+        return None
+
+    return np.array(pupils,dtype=np.float64),index
+
+
+# Expand pupil positions and indices made by _find_pupils() back to an array of ray start coordinates.
+# If all rays start at the same position, this is a read-only view which does not use any memory.
+def _expand_pupils(pupils,index):
+
+    pupils = np.array(pupils,dtype=np.float32)
+    index = np.array(index)
+
+    if pupils.shape[0] == 1 and np.all(index == 0):
+        return np.broadcast_to(pupils[0],index.shape + (3,))
+    else:
+        return np.concatenate((pupils,np.full((1,3),np.nan,dtype=np.float32)))[index]
+
+
+# Find the nearest elements of a 1D array of coordinates to given values.
+# Returns the indices of the nearest elements and the absolute differences.
+def _nearest_1d(coords,values):
+
+    order = np.argsort(coords)
+    sorted_coords = coords[order]
+
+    inds = np.clip(np.searchsorted(sorted_coords,values),1,max(1,sorted_coords.size - 1))
+    use_lower = np.abs(values - sorted_coords[inds - 1]) <= np.abs(values - sorted_coords[np.minimum(inds,sorted_coords.size - 1)])
+    inds = np.where(use_lower,inds - 1,np.minimum(inds,sorted_coords.size - 1))
+
+    return order[inds],np.abs(values - sorted_coords[inds])
@@ -19,6 +19,12 @@
   permissions and limitations under the Licence.
 '''
 
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
 import vtk
 import cv2
 from vtk.util.numpy_support import vtk_to_numpy
@@ -26,7 +32,9 @@ import numpy as np
 import time
 from .raycast import raycast_sightlines, RayData
 import copy
-from .misc import bin_image, get_contour_intersection, LoopProgPrinter, ColourCycle
+from . import config
+from .cadmodel import CADModel, ModelFeature, polydata_to_lines
+from .misc import bin_image, get_contour_intersection, LoopProgPrinter, ProgressReporter, ColourCycle, record_timing
 from .calibration import Calibration
 from matplotlib.cm import get_cmap
 
@@ -187,18 +195,138 @@ def render_cam_view(cadmodel,calibration,extra_actors=[],filename=None,oversampl
         np.ndarray                          : Array containing the rendered 8-bit per channel RGB (h x w x 3) or RGBA (h x w x 4) image.\
                                               Also saves the result to disk if the filename parameter is set.
     '''
+    _check_render_settings(calibration,oversampling,interpolation)
+
+    if verbose:
+        tstart = time.time()
+        print('[Calcam Renderer] Preparing...')
+
+    renderer = _CamViewRenderer(cadmodel,extra_actors,aa)
+
+    try:
+        output = renderer.render(calibration,oversampling=oversampling,transparency=transparency,coords=coords,interpolation=interpolation,verbose=verbose)
+    finally:
+        # Tidy up after ourselves!
+        renderer.close()
+
+    if verbose:
+        print('[Calcam Renderer] Completed in {:.1f} s.'.format(time.time() - tstart))
+
+    # Save the image if given a filename
+    if filename is not None:
+        _save_render(output,filename,transparency,verbose)
+
+    return output
+
+
+
+def render_cam_views(cadmodel,calibrations,extra_actors=[],filenames=None,oversampling=1,aa=1,transparency=False,depth=False,verbose=True,coords='display',interpolation='cubic'):
+    '''
+    Render images of a given CAD model from the points of view of a sequence of calibrations, e.g. many different cameras or
+    movement-corrected versions of the same camera calibration for many shots.
+
+    This is much faster than calling :func:`calcam.render_cam_view` for each calibration, because the CAD model is only added to a
+    single render window which is re-used for every image. This is a generator which renders each image as it is requested,
+    so the results can be processed or saved to disk one at a time without keeping all of them in memory.
+
+    Parameters:
+
+        cadmodel (calcam.CADModel)          : CAD model of scene
+        calibrations (iterable)             : Sequence of :class:`calcam.Calibration` objects whose point-of-view to render from. This can \
+                                              itself be a generator.
+        extra_actors (list of vtk.vtkActor) : List containing any additional vtkActors to add to the scene \
+                                              in addition to the CAD model.
+        filenames (list of str or str)      : Filenames to which to save the resulting images. Can be a list with one filename per calibration \
+                                              (entries can be None to not save that image), or a single string containing a format field which will \
+                                              be formatted with the index of the calibration e.g. ``'render_{:03d}.png'``. If not given, no files \
+                                              are saved. If rendering depth maps, these are saved in NumPy .npy format.
+        oversampling (float)                : Used to render the images at higher (if > 1) or lower (if < 1) resolution than the \
+                                              calibrated cameras. Must be an integer if > 1 or if <1, 1/oversampling must be a \
+                                              factor of both image width and height.
+        aa (int)                            : Anti-aliasing factor, 1 = no anti-aliasing.
+        transparency (bool)                 : If true, empty areas of the images are set transparent. Otherwise they are black.
+        depth (bool)                        : If True, instead of rendering RGB images, produce depth maps containing the distance in metres from the \
+                                              camera pupil to the CAD model surface seen by each pixel (NaN where there is no surface).
+        verbose (bool)                      : Whether to print status updates, including rendering speed in frames per second, while rendering.
+        coords (str)                        : Either ``Display`` or ``Original``, the image orientation in which to return the images.
+        interpolation(str)                  : Either ``nearest`` or ``cubic``, inerpolation used when applying lens distortion. \
+                                              Depth maps always use nearest-neighbour interpolation.
+
+    Yields:
+
+        np.ndarray                          : For each calibration, an array containing the rendered 8-bit per channel RGB (h x w x 3) or RGBA (h x w x 4) \
+                                              image, or a float32 (h x w) depth map if depth = True.
+    '''
+    if depth and transparency:
+        raise ValueError('Transparency cannot be used when rendering depth maps.')
+
+    try:
+        n_calibrations = len(calibrations)
+    except TypeError:
+        n_calibrations = None
+
+    if isinstance(filenames,str):
+        filename_format = filenames
+        filenames = None
+    else:
+        filename_format = None
+        if filenames is not None and n_calibrations is not None and len(filenames) != n_calibrations:
+            raise ValueError('Length of filenames list ({:d}) does not match the number of calibrations ({:d})!'.format(len(filenames),n_calibrations))
+
+    if verbose:
+        print('[Calcam Renderer] Preparing...')
+
+    renderer = _CamViewRenderer(cadmodel,extra_actors,aa)
+
+    n_done = 0
+    tstart = time.time()
+
+    try:
+        for i,calibration in enumerate(calibrations):
+
+            _check_render_settings(calibration,oversampling,interpolation)
+
+            output = renderer.render(calibration,oversampling=oversampling,transparency=transparency,coords=coords,interpolation=interpolation,depth=depth)
+
+            if filename_format is not None:
+                filename = filename_format.format(i)
+            elif filenames is not None:
+                filename = filenames[i]
+            else:
+                filename = None
+
+            if filename is not None:
+                if depth:
+                    np.save(filename,output)
+                else:
+                    _save_render(output,filename,transparency,verbose=False)
+
+            n_done += 1
+            if verbose:
+                if n_calibrations is None:
+                    print('[Calcam Renderer] Rendered image {:d} ({:.2f} fps)'.format(n_done,n_done/(time.time() - tstart)))
+                else:
+                    print('[Calcam Renderer] Rendered image {:d}/{:d} ({:.2f} fps)'.format(n_done,n_calibrations,n_done/(time.time() - tstart)))
+
+            yield output
+
+    finally:
+        renderer.close()
+        if verbose and n_done > 0:
+            print('[Calcam Renderer] Rendered {:d} images in {:.1f} s ({:.2f} fps).'.format(n_done,time.time() - tstart,n_done/(time.time() - tstart)))
+
+
+
+def _check_render_settings(calibration,oversampling,interpolation):
+    '''
+    Check rendering settings are valid for a given calibration, raising a ValueError if not.
+    '''
     if np.any(calibration.view_models) is None:
         raise ValueError('This calibration object does not contain any fit results! Cannot render an image without a calibration fit.')
 
-    if interpolation.lower() == 'nearest':
-        interp_method = cv2.INTER_NEAREST
-    elif interpolation.lower() == 'cubic':
-        interp_method = cv2.INTER_CUBIC
-    else:
+    if interpolation.lower() not in ['nearest','cubic']:
         raise ValueError('Invalid interpolation method "{:s}": must be "nearest" or "cubic".'.format(interpolation))
 
-    aa = int(max(aa,1))
-
     if oversampling > 1:
         if int(oversampling) - oversampling > 1e-5:
             raise ValueError('If using oversampling > 1, oversampling must be an integer!')
@@ -211,206 +339,488 @@ def render_cam_view(cadmodel,calibration,extra_actors=[],filename=None,oversampl
         if abs(int(undersample_x) - undersample_x) > 1e-5 or abs(int(undersample_y) - undersample_y) > 1e-5:
             raise ValueError('If using oversampling < 1, 1/oversampling must be a common factor of the display image width and height ({:d}x{:d})'.format(shape[0],shape[1]))
 
-    if verbose:
-        tstart = time.time()
-        print('[Calcam Renderer] Preparing...')
 
-    # This will be our result. To start with we always render in display coords.
-    orig_display_shape = calibration.geometry.get_display_shape()
-    output = np.zeros([int(orig_display_shape[1]*oversampling),int(orig_display_shape[0]*oversampling),3+transparency],dtype='uint8')
-
-    # The un-distorted FOV is over-rendered to allow for distortion.
-    # FOV_factor is how much to do this by; too small and image edges might be cut off.
-    models = []
-    for view_model in calibration.view_models:
-        try:
-            models.append(view_model.model)
-        except AttributeError:
-            pass
-    if np.any( np.array(models) == 'fisheye'):
-        fov_factor = 3.
-    else:
-        fov_factor = 1.5
 
-    x_pixels = orig_display_shape[0]
-    y_pixels = orig_display_shape[1]
+def _save_render(output,filename,transparency,verbose):
+    '''
+    Save a rendered RGB(A) image to disk.
+    '''
+    # If we have transparency, we can only save as PNG.
+    if transparency and filename[-3:].lower() != 'png':
+        print('[Calcam Renderer] Images with transparency can only be saved as PNG! Overriding output file type to PNG.')
+        filename = filename[:-3] + 'png'
+
+    # Re-shuffle the colour channels for saving (openCV needs BGR / BGRA)
+    save_im = copy.copy(output)
+    save_im[:,:,:3] = save_im[:,:,2::-1]
+    result = cv2.imwrite(filename,save_im)
+    if verbose and result:
+        print('[Calcam Renderer] Result saved as {:s}'.format(filename))
+    if not result:
+        print('[Calcam Renderer] WARNING: Could not write to image file {:s}'.format(filename))
+
+
+
+class _CamViewRenderer():
+    '''
+    Off-screen render window containing a CAD model and any extra actors, which
+    can be used to render images from the point of view of any number of calibrations.
+    Call close() when finished with it to remove everything from the render window.
+    '''
+    def __init__(self,cadmodel,extra_actors=[],aa=1):
+
+        self.cadmodel = cadmodel
+        self.extra_actors = extra_actors
+        self.aa = int(max(aa,1))
+        self.distortion_maps = {}
 
-    renwin = vtk.vtkRenderWindow()
-    renwin.OffScreenRenderingOn()
-    renwin.SetBorders(0)
+        self.renwin = vtk.vtkRenderWindow()
+        self.renwin.OffScreenRenderingOn()
+        self.renwin.SetBorders(0)
 
-    # Set up render window for initial, un-distorted window
-    renderer = vtk.vtkRenderer()
-    renwin.AddRenderer(renderer)
-    camera = renderer.GetActiveCamera()
+        # Set up render window for initial, un-distorted window
+        self.renderer = vtk.vtkRenderer()
+        self.renwin.AddRenderer(self.renderer)
+        self.camera = self.renderer.GetActiveCamera()
 
-    cad_linewidths = np.array(cadmodel.get_linewidth())
-    cadmodel.set_linewidth(list(cad_linewidths*aa))
-    cadmodel.add_to_renderer(renderer)
+        self.cad_linewidths = np.array(cadmodel.get_linewidth())
+        cadmodel.set_linewidth(list(self.cad_linewidths*self.aa))
+        cadmodel.add_to_renderer(self.renderer)
+
+        for actor in extra_actors:
+            self._scale_linewidth(actor,self.aa)
+            self.renderer.AddActor(actor)
+
+
+    def _scale_linewidth(self,actor,factor):
 
-    for actor in extra_actors:
         if isinstance(actor,vtk.vtkAssembly):
             actors = actor.GetParts()
+            actors.InitTraversal()
             while True:
                 part = actors.GetNextProp3D()
                 if part is not None:
-                    part.GetProperty().SetLineWidth( actor.GetProperty().GetLineWidth() * aa)
+                    part.GetProperty().SetLineWidth( part.GetProperty().GetLineWidth() * factor)
                 else:
                     break
         else:
-            actor.GetProperty().SetLineWidth( actor.GetProperty().GetLineWidth() * aa)
+            actor.GetProperty().SetLineWidth( actor.GetProperty().GetLineWidth() * factor)
 
-        renderer.AddActor(actor)
 
-    # We need a field mask the same size as the output
-    fieldmask = cv2.resize(calibration.get_subview_mask(coords='Display'),(int(x_pixels*oversampling),int(y_pixels*oversampling)),interpolation=cv2.INTER_NEAREST)
+    def render(self,calibration,oversampling=1,transparency=False,coords='display',interpolation='cubic',depth=False,verbose=False,timings=None):
+        '''
+        Render an image from the point of view of a calibration. Arguments are as for render_cam_view(), plus:
 
-    for field in range(calibration.n_subviews):
+            depth (bool)   : If True, return a float32 map of distance from the camera pupil to the \
+                             surface seen by each pixel instead of an RGB image. Pixels where there \
+                             is no surface are NaN.
+            timings (list) : If given, a timing record for the render is added to this list.
+        '''
+        with record_timing([] if timings is None else timings,'render',calibration=calibration.filename,oversampling=oversampling,depth=depth):
+            return self._render(calibration,oversampling=oversampling,transparency=transparency,coords=coords,interpolation=interpolation,depth=depth,verbose=verbose)
 
-        render_shrink_factor = 1
 
-        if calibration.view_models[field] is None:
-            continue
+    def _render(self,calibration,oversampling=1,transparency=False,coords='display',interpolation='cubic',depth=False,verbose=False):
 
-        cx = calibration.view_models[field].cam_matrix[0,2]
-        cy = calibration.view_models[field].cam_matrix[1,2]
-        fy = calibration.view_models[field].cam_matrix[1,1]
+        if interpolation.lower() == 'nearest' or depth:
+            interp_method = cv2.INTER_NEAREST
+        else:
+            interp_method = cv2.INTER_CUBIC
 
-        vtk_win_im = vtk.vtkWindowToImageFilter()
-        vtk_win_im.SetInput(renwin)
+        aa = self.aa
+        camera = self.camera
+        renwin = self.renwin
 
-        # Width and height - initial render will be put optical centre in the window centre
-        width = int(2 * fov_factor * max(cx, x_pixels - cx))
-        height = int(2 * fov_factor * max(cy, y_pixels - cy))
-
-        # To avoid trying to render an image larger than the available OpenGL texture buffer,
-        # check if the image will be too big and if it will, first try reducing the AA, and if
-        # that isn't enough we will render a smaller image and then resize it afterwards.
-        # Not ideal but avoids ending up with black images. What would be nicer, is if
-        # VTK could fix their large image rendering code to preserve the damn field of view properly!
-        longest_side = max(width,height)*aa*oversampling
-
-        while longest_side > max_render_dimension and aa > 1:
-            aa = aa - 1
-            longest_side = max(width, height) * aa * oversampling
-
-        while longest_side > max_render_dimension:
-            render_shrink_factor = render_shrink_factor + 1
-            longest_side = max(width,height)*aa*oversampling/render_shrink_factor
-
-        renwin.SetSize(int(width*aa*oversampling/render_shrink_factor),int(height*aa*oversampling/render_shrink_factor))
-
-        # Set up CAD camera
-        fov_y = 360 * np.arctan( height / (2*fy) ) / 3.14159
-        cam_pos = calibration.get_pupilpos(subview=field)
-        cam_tar = calibration.get_los_direction(cx,cy,subview=field) + cam_pos
-        upvec = -1.*calibration.get_cam_to_lab_rotation(subview=field)[:,1]
-        camera.SetPosition(cam_pos)
-        camera.SetViewAngle(fov_y)
-        camera.SetFocalPoint(cam_tar)
-        camera.SetViewUp(upvec)
-
-        if verbose:
-            print('[Calcam Renderer] Rendering (Sub-view {:d}/{:d})...'.format(field + 1,calibration.n_subviews))
-
-        # Do the render and grab an image
-        renwin.Render()
+        # This will be our result. To start with we always render in display coords.
+        orig_display_shape = calibration.geometry.get_display_shape()
+        if depth:
+            output = np.full([int(orig_display_shape[1]*oversampling),int(orig_display_shape[0]*oversampling)],np.nan,dtype=np.float32)
+        else:
+            output = np.zeros([int(orig_display_shape[1]*oversampling),int(orig_display_shape[0]*oversampling),3+transparency],dtype='uint8')
 
-        # Make sure the light lights up the whole model without annoying shadows or falloff.
-        light = renderer.GetLights().GetItemAsObject(0)
-        light.PositionalOn()
-        light.SetConeAngle(180)
+        # The un-distorted FOV is over-rendered to allow for distortion.
+        # FOV_factor is how much to do this by; too small and image edges might be cut off.
+        models = []
+        for view_model in calibration.view_models:
+            try:
+                models.append(view_model.model)
+            except AttributeError:
+                pass
+        if np.any( np.array(models) == 'fisheye'):
+            fov_factor = 3.
+        else:
+            fov_factor = 1.5
 
-        # Do the render and grab an image
-        renwin.Render()
+        x_pixels = orig_display_shape[0]
+        y_pixels = orig_display_shape[1]
 
-        vtk_win_im.Update()
+        # We need a field mask the same size as the output
+        fieldmask = cv2.resize(calibration.get_subview_mask(coords='Display'),(int(x_pixels*oversampling),int(y_pixels*oversampling)),interpolation=cv2.INTER_NEAREST)
 
-        vtk_image = vtk_win_im.GetOutput()
-        vtk_array = vtk_image.GetPointData().GetScalars()
-        dims = vtk_image.GetDimensions()
+        for field in range(calibration.n_subviews):
 
-        im = np.flipud(vtk_to_numpy(vtk_array).reshape(dims[1], dims[0] , 3))
+            render_shrink_factor = 1
 
-        # If we have had to do a smaller render for graphics driver reasons, scale the render up to the resolution
-        # we really wanted.
-        if render_shrink_factor > 1:
-            im = cv2.resize(im,(width*aa*oversampling,height*aa*oversampling),interpolation=cv2.INTER_NEAREST)
+            if calibration.view_models[field] is None:
+                continue
 
-        if transparency:
-            alpha = 255 * np.ones([np.shape(im)[0],np.shape(im)[1]],dtype='uint8')
-            alpha[np.sum(im,axis=2) == 0] = 0
-            im = np.dstack((im,alpha))
+            cx = calibration.view_models[field].cam_matrix[0,2]
+            cy = calibration.view_models[field].cam_matrix[1,2]
+            fy = calibration.view_models[field].cam_matrix[1,1]
 
-        if verbose:
-            print('[Calcam Renderer] Applying lens distortion (Sub-view {:d}/{:d})...'.format(field + 1,calibration.n_subviews))
+            vtk_win_im = vtk.vtkWindowToImageFilter()
+            vtk_win_im.SetInput(renwin)
+            if depth:
+                vtk_win_im.SetInputBufferTypeToZBuffer()
+
+            # Width and height - initial render will be put optical centre in the window centre
+            width = int(2 * fov_factor * max(cx, x_pixels - cx))
+            height = int(2 * fov_factor * max(cy, y_pixels - cy))
+
+            # To avoid trying to render an image larger than the available OpenGL texture buffer,
+            # check if the image will be too big and if it will, first try reducing the AA, and if
+            # that isn't enough we will render a smaller image and then resize it afterwards.
+            # Not ideal but avoids ending up with black images. What would be nicer, is if
+            # VTK could fix their large image rendering code to preserve the damn field of view properly!
+            longest_side = max(width,height)*aa*oversampling
+
+            while longest_side > max_render_dimension and aa > 1:
+                aa = aa - 1
+                longest_side = max(width, height) * aa * oversampling
+
+            while longest_side > max_render_dimension:
+                render_shrink_factor = render_shrink_factor + 1
+                longest_side = max(width,height)*aa*oversampling/render_shrink_factor
+
+            renwin.SetSize(int(width*aa*oversampling/render_shrink_factor),int(height*aa*oversampling/render_shrink_factor))
+
+            # Set up CAD camera
+            fov_y = 360 * np.arctan( height / (2*fy) ) / 3.14159
+            cam_pos = calibration.get_pupilpos(subview=field)
+            cam_tar = calibration.get_los_direction(cx,cy,subview=field) + cam_pos
+            upvec = -1.*calibration.get_cam_to_lab_rotation(subview=field)[:,1]
+            camera.SetPosition(cam_pos)
+            camera.SetViewAngle(fov_y)
+            camera.SetFocalPoint(cam_tar)
+            camera.SetViewUp(upvec)
 
-        # Pixel locations we want on the final image
-        [xn,yn] = np.meshgrid(np.linspace(0,x_pixels-1,int(x_pixels*oversampling*aa)),np.linspace(0,y_pixels-1,int(y_pixels*oversampling*aa)))
+            if verbose:
+                print('[Calcam Renderer] Rendering (Sub-view {:d}/{:d})...'.format(field + 1,calibration.n_subviews))
 
-        xn,yn = calibration.normalise(xn,yn,field)
+            # The renderer only creates its light on the first render, so
+            # if we're re-using the render window we don't need to render twice.
+            if self.renderer.GetLights().GetNumberOfItems() == 0:
+                renwin.Render()
 
-        # Transform back to pixel coords where we want to sample the un-distorted render.
-        # Both x and y are divided by Fy because the initial render always has Fx = Fy.
-        xmap = (xn * fy * oversampling * aa) + (width * oversampling * aa - 1)/2
-        ymap = (yn * fy * oversampling * aa) + (height * oversampling * aa - 1)/2
-        xmap = xmap.astype('float32')
-        ymap = ymap.astype('float32')
+            # Make sure the light lights up the whole model without annoying shadows or falloff.
+            light = self.renderer.GetLights().GetItemAsObject(0)
+            light.PositionalOn()
+            light.SetConeAngle(180)
 
-        # Actually apply distortion
-        im  = cv2.remap(im,xmap,ymap,interp_method)
+            # Do the render and grab an image
+            renwin.Render()
 
-        # Anti-aliasing by binning
-        if aa > 1:
-            im = bin_image(im,aa,np.mean)
+            vtk_win_im.Update()
 
-        output[fieldmask == field,:] = im[fieldmask == field,:]
+            vtk_image = vtk_win_im.GetOutput()
+            vtk_array = vtk_image.GetPointData().GetScalars()
+            dims = vtk_image.GetDimensions()
 
+            if depth:
+                # Convert the Z buffer to distance from the camera along the view direction.
+                im = np.flipud(vtk_to_numpy(vtk_array).reshape(dims[1], dims[0]))
+                near,far = camera.GetClippingRange()
+                # Background is set to inf rather than NaN while processing the depth map, so that it is ignored
+                # when taking the nearest surface for anti-aliasing, and converted to NaN at the end.
+                background = im >= 1.
+                im = (2 * near * far / (far + near - (2*im - 1)*(far - near))).astype(np.float32)
+                im[background] = np.inf
+            else:
+                im = np.flipud(vtk_to_numpy(vtk_array).reshape(dims[1], dims[0] , 3))
 
-    if coords.lower() == 'original':
-        output = calibration.geometry.display_to_original_image(output,interpolation=interpolation)
-    
-    if verbose:
-        print('[Calcam Renderer] Completed in {:.1f} s.'.format(time.time() - tstart))
+            # If we have had to do a smaller render for graphics driver reasons, scale the render up to the resolution
+            # we really wanted.
+            if render_shrink_factor > 1:
+                im = cv2.resize(im,(width*aa*oversampling,height*aa*oversampling),interpolation=cv2.INTER_NEAREST)
 
-    # Save the image if given a filename
-    if filename is not None:
+            if transparency:
+                alpha = 255 * np.ones([np.shape(im)[0],np.shape(im)[1]],dtype='uint8')
+                alpha[np.sum(im,axis=2) == 0] = 0
+                im = np.dstack((im,alpha))
 
-        # If we have transparency, we can only save as PNG.
-        if transparency and filename[-3:].lower() != 'png':
-            print('[Calcam Renderer] Images with transparency can only be saved as PNG! Overriding output file type to PNG.')
-            filename = filename[:-3] + 'png'
+            if verbose:
+                print('[Calcam Renderer] Applying lens distortion (Sub-view {:d}/{:d})...'.format(field + 1,calibration.n_subviews))
 
-        # Re-shuffle the colour channels for saving (openCV needs BGR / BGRA)
-        save_im = copy.copy(output)
-        save_im[:,:,:3] = save_im[:,:,2::-1]
-        result = cv2.imwrite(filename,save_im)
-        if verbose and result:
-            print('[Calcam Renderer] Result saved as {:s}'.format(filename))
-        if not result:
-            print('[Calcam Renderer] WARNING: Could not write to image file {:s}'.format(filename))
+            # The distortion maps only depend on the camera intrinsics, so when rendering many
+            # calibrations (e.g. the same camera at different positions) we can re-use them.
+            view_model = calibration.view_models[field]
+            map_key = (view_model.model,view_model.cam_matrix.tobytes(),np.array(view_model.kc).tobytes(),x_pixels,y_pixels,width,height,oversampling,aa)
 
+            if map_key not in self.distortion_maps:
 
-    # Tidy up after ourselves!
-    cadmodel.set_linewidth(list(cad_linewidths))
-    cadmodel.remove_from_renderer(renderer)
+                # Pixel locations we want on the final image
+                [xn,yn] = np.meshgrid(np.linspace(0,x_pixels-1,int(x_pixels*oversampling*aa)),np.linspace(0,y_pixels-1,int(y_pixels*oversampling*aa)))
 
-    for actor in extra_actors:
-        if isinstance(actor,vtk.vtkAssembly):
-            actors = actor.GetParts()
-            while True:
-                part = actors.GetNextProp3D()
-                if part is not None:
-                    part.GetProperty().SetLineWidth( actor.GetProperty().GetLineWidth() / aa )
-                else:
-                    break
-        else:
-            actor.GetProperty().SetLineWidth( actor.GetProperty().GetLineWidth() / aa )
-        renderer.RemoveActor(actor)
+                xn,yn = calibration.normalise(xn,yn,field)
 
-    renwin.Finalize()
+                # Transform back to pixel coords where we want to sample the un-distorted render.
+                # Both x and y are divided by Fy because the initial render always has Fx = Fy.
+                xmap = (xn * fy * oversampling * aa) + (width * oversampling * aa - 1)/2
+                ymap = (yn * fy * oversampling * aa) + (height * oversampling * aa - 1)/2
+                xmap = xmap.astype('float32')
+                ymap = ymap.astype('float32')
 
-    return output
+                # Ratio of distance along each sight line to distance along the view direction
+                ray_length_factor = np.sqrt(1 + xn**2 + yn**2).astype(np.float32)
+
+                if len(self.distortion_maps) >= 16:
+                    self.distortion_maps.clear()
+                self.distortion_maps[map_key] = (xmap,ymap,ray_length_factor)
+
+            xmap,ymap,ray_length_factor = self.distortion_maps[map_key]
+
+            # Actually apply distortion. For depth maps, anywhere outside the render has no surface.
+            if depth:
+                im = cv2.remap(im,xmap,ymap,interp_method,borderMode=cv2.BORDER_CONSTANT,borderValue=np.inf)
+            else:
+                im  = cv2.remap(im,xmap,ymap,interp_method)
+
+            if depth:
+                # Distance along the view direction -> distance along each sight line.
+                # Anti-aliasing takes the nearest surface in each bin.
+                im = im * ray_length_factor
+                if aa > 1:
+                    im = bin_image(im,aa,np.min)
+            elif aa > 1:
+                # Anti-aliasing by binning
+                im = bin_image(im,aa,np.mean)
+
+            output[fieldmask == field] = im[fieldmask == field]
+
+        # Pixels with no surface are NaN in the returned depth map.
+        if depth:
+            output[np.isinf(output)] = np.nan
+
+        if coords.lower() == 'original':
+            output = calibration.geometry.display_to_original_image(output,interpolation='nearest' if depth else interpolation)
+
+        return output
+
+
+    def close(self):
+
+        self.cadmodel.set_linewidth(list(self.cad_linewidths))
+        self.cadmodel.remove_from_renderer(self.renderer)
+
+        for actor in self.extra_actors:
+            self._scale_linewidth(actor,1/self.aa)
+            self.renderer.RemoveActor(actor)
+
+        self.renwin.Finalize()
+
+
+
+# Convert display pixel coordinates to pixel coordinates in a render_cam_view() image made
+# with the given oversampling and anti-aliasing, following the pixel positions used there.
+def _display_to_render_coords(calibration,coords,oversampling,aa):
+
+    display_shape = np.array(calibration.geometry.get_display_shape())
+    n_samples = np.round(display_shape * oversampling * aa)
+
+    return (coords * (n_samples - 1) / (display_shape - 1) - (aa - 1) / 2.) / aa
+
+
+
+class _WireframeProjector():
+    '''
+    Makes quick, approximate wireframe images of a CAD model by projecting its feature edges
+    on to the image with Calibration.project_points() instead of rendering. This takes a small
+    fraction of the time of render_cam_view(), so can be used for live previews while fitting.
+
+    Hidden edges are removed using a depth map from an earlier full render (see set_depth_map()),
+    so if the camera has moved a long way since then the hidden line removal will be wrong.
+    '''
+    def __init__(self,cadmodel,max_segment_length=None):
+
+        points = [np.zeros((0,3))]
+        pieces = [np.zeros((0,2),dtype=int)]
+        n_points = 0
+
+        for fname in cadmodel.get_enabled_features():
+
+            edge_points,cells = polydata_to_lines(cadmodel.features[fname].get_edges())
+            if cells.shape[0] == 0:
+                continue
+
+            points.append(edge_points.astype(np.float64))
+            pieces.append(cells.astype(int) + n_points)
+            n_points = n_points + points[-1].shape[0]
+
+        points = np.concatenate(points)
+        pieces = np.concatenate(pieces)
+
+        # Chop long edges up in to shorter pieces, so that lens distortion and hidden
+        # line removal can be applied along their length.
+        if max_segment_length is None:
+            model_extent = cadmodel.get_extent()
+            max_segment_length = (model_extent[1::2] - model_extent[::2]).max() / 100.
+
+        lengths = np.sqrt(np.sum((points[pieces[:,1]] - points[pieces[:,0]])**2,axis=1))
+        n_pieces = np.maximum(1,np.ceil(lengths/max_segment_length)).astype(int)
+        long_edges = np.where(n_pieces > 1)[0]
+
+        if long_edges.size > 0:
+
+            n_pieces = n_pieces[long_edges]
+            start = pieces[long_edges,0]
+            end = pieces[long_edges,1]
+
+            # Add the new points along the long edges
+            new_edge = np.repeat(np.arange(long_edges.size),n_pieces - 1)
+            first_new = np.cumsum(n_pieces - 1) - (n_pieces - 1)
+            t = (np.arange(new_edge.size) - first_new[new_edge] + 1) / n_pieces[new_edge]
+            new_points = points[start[new_edge]] + t[:,np.newaxis] * (points[end[new_edge]] - points[start[new_edge]])
+
+            # And join them up
+            piece_edge = np.repeat(np.arange(long_edges.size),n_pieces)
+            j = np.arange(piece_edge.size) - (np.cumsum(n_pieces) - n_pieces)[piece_edge]
+            new_index = points.shape[0] + first_new[piece_edge] + j
+            new_pieces = np.stack( (np.where(j == 0,start[piece_edge],new_index - 1), np.where(j == n_pieces[piece_edge] - 1,end[piece_edge],new_index)) ,axis=1)
+
+            points = np.concatenate((points,new_points))
+            pieces = np.concatenate((np.delete(pieces,long_edges,axis=0),new_pieces))
+
+        self.points = points
+        self.pieces = pieces
+        self.visible = np.ones(self.points.shape[0],dtype=bool)
+
+
+    def set_depth_map(self,calibration,depth_map,tol=0.02,aa=1):
+        '''
+        Work out which edge points are hidden, using a depth map from render_cam_view() with depth=True.
+
+        Parameters:
+
+            calibration (calcam.Calibration) : Calibration the depth map was rendered with.
+            depth_map (np.ndarray)           : Depth map in display coordinates. Can be oversampled, i.e. at a multiple \
+                                               of the calibration's image resolution.
+            tol (float)                      : Fractional distance tolerance for deciding whether a point is hidden.
+            aa (int)                         : Anti-aliasing factor the depth map was rendered with.
+        '''
+        # Points near silhouettes can land on either side of the edge, so compare
+        # with the furthest surface in the surrounding pixels.
+        depth = depth_map.astype(np.float32)
+        depth[np.isnan(depth)] = np.inf
+        depth = cv2.dilate(depth,np.ones((3,3),dtype=np.uint8))
+
+        self.visible = np.ones(self.points.shape[0],dtype=bool)
+
+        oversampling = depth.shape[1] / calibration.geometry.get_display_shape()[0]
+
+        for subview in range(calibration.n_subviews):
+
+            p2d,in_view = self._project(calibration,subview,margin=1.)
+            in_view[in_view] = calibration.subview_lookup(p2d[in_view,0],p2d[in_view,1]) == subview
+
+            p2d = _display_to_render_coords(calibration,p2d[in_view],oversampling,aa)
+            x = np.clip(np.round(p2d[:,0]).astype(int),0,depth.shape[1]-1)
+            y = np.clip(np.round(p2d[:,1]).astype(int),0,depth.shape[0]-1)
+
+            distance = np.sqrt(np.sum((self.points[in_view] - calibration.get_pupilpos(subview=subview))**2,axis=1))
+
+            self.visible[in_view] = distance <= depth[y,x] * (1 + tol)
+
+
+    def project(self,calibration,linewidth=1,oversampling=1,aa=1):
+        '''
+        Make an image of the wireframe seen by a given calibration.
+
+        Parameters:
+
+            calibration (calcam.Calibration) : Calibration to use.
+            linewidth (int)                  : Line width in pixels of the output image.
+            oversampling (int)               : Make the image at this many times the calibration's image resolution.
+            aa (int)                         : Anti-aliasing factor, as for render_cam_view(). With the same oversampling \
+                                               and aa, the lines match those in a render_cam_view() image.
+
+        Returns:
+
+            np.ndarray                       : RGBA image (h x w x 4) in display coordinates with white lines and \
+                                               transparent background, like render_cam_view() with transparency = True.
+        '''
+        w,h = calibration.geometry.get_display_shape()
+        w = int(w * oversampling * aa)
+        h = int(h * oversampling * aa)
+
+        output = np.zeros((h,w),dtype=np.uint8)
+
+        if calibration.n_subviews > 1:
+            subview_mask = cv2.resize(calibration.get_subview_mask(coords='Display').astype(np.int16),(w,h),interpolation=cv2.INTER_NEAREST)
+
+        for subview in range(calibration.n_subviews):
+
+            # Include points a bit outside the image, so lines crossing the image edge are drawn.
+            p2d,ok = self._project(calibration,subview,margin=1.5)
+            ok = ok & self.visible
+
+            pieces = self.pieces[ok[self.pieces[:,0]] & ok[self.pieces[:,1]]]
+
+            # Fixed point coordinates with 4 fractional bits for sub-pixel line drawing
+            lines = np.round(_display_to_render_coords(calibration,p2d[pieces],oversampling*aa,1) * 16).astype(np.int32)
+
+            # Anti-aliased OpenCV lines come out about a pixel wider than the thickness given
+            thickness = max(1,linewidth*aa - 1)
+
+            if calibration.n_subviews > 1:
+                im = np.zeros((h,w),dtype=np.uint8)
+                cv2.polylines(im,lines,False,255,thickness,cv2.LINE_AA,4)
+                output[subview_mask == subview] = im[subview_mask == subview]
+            else:
+                cv2.polylines(output,lines,False,255,thickness,cv2.LINE_AA,4)
+
+        # Anti-aliasing by binning, like in the full render
+        if aa > 1:
+            output = np.round(bin_image(output,aa,np.mean)).astype(np.uint8)
+
+        rgba = np.zeros(output.shape + (4,),dtype=np.uint8)
+        rgba[output > 0,:3] = 255
+        rgba[:,:,3] = output
+
+        return rgba
+
+
+    def _project(self,calibration,subview,margin):
+        '''
+        Project the edge points on to the image for one sub-view. Only points in front of the
+        camera and within the field of view (expanded by the given factor) are projected, both
+        for speed and because lens distortion models go haywire far outside the field of view.
+        Returns the Nx2 image coordinates (NaN for points not projected) and a mask of which were.
+        '''
+        p2d = np.full((self.points.shape[0],2),np.nan)
+        ok = np.zeros(self.points.shape[0],dtype=bool)
+
+        if calibration.view_models[subview] is None:
+            return p2d,ok
+
+        # Point coordinates in the camera frame
+        rotation = np.asarray(calibration.get_cam_to_lab_rotation(subview=subview))
+        cam_coords = np.matmul(self.points - calibration.get_pupilpos(subview=subview),rotation)
+
+        # Field of view limits, from the normalised coordinates around the image edge
+        w,h = calibration.geometry.get_display_shape()
+        edge_x = np.concatenate((np.linspace(0,w-1,32),np.full(32,w-1),np.linspace(0,w-1,32),np.zeros(32)))
+        edge_y = np.concatenate((np.zeros(32),np.linspace(0,h-1,32),np.full(32,h-1),np.linspace(0,h-1,32)))
+        xn,yn = calibration.normalise(edge_x,edge_y,subview)
+        lim = margin * np.array([np.abs(xn).max(),np.abs(yn).max()])
+
+        ok = cam_coords[:,2] > 0
+        if np.all(np.isfinite(lim)):
+            ok = ok & np.all(np.abs(cam_coords[:,:2]) < lim * cam_coords[:,2:],axis=1)
+
+        if np.any(ok):
+            p2d[ok] = np.reshape(calibration.view_models[subview].project_points(self.points[ok]),(-1,2))
+
+        return p2d,ok
 
 
 
@@ -735,8 +1145,8 @@ def get_wall_coverage_actor(cal,cadmodel=None,image=None,imagecoords='Original',
             isnan = np.isnan(image.sum(axis=2))
 
     if verbose:
-        lp = LoopProgPrinter()
-        lp.update('Constructing 3D mesh...')
+        progress = ProgressReporter(LoopProgPrinter().update)
+        progress.status('Constructing 3D mesh...')
         i = -1
         tot_px = (ray_end.shape[1]-1) * (ray_end.shape[0] - 1)
 
@@ -748,7 +1158,7 @@ def get_wall_coverage_actor(cal,cadmodel=None,image=None,imagecoords='Original',
 
             if verbose:
                 i += 1
-                lp.update(i/tot_px)
+                progress.update(i/tot_px)
 
             # Don't map any pixels which are NaN
             if image is not None:
@@ -812,8 +1222,7 @@ def get_wall_coverage_actor(cal,cadmodel=None,image=None,imagecoords='Original',
                     colours.InsertNextTypedTuple(fr[yi,xi,:])
 
     if verbose:
-        lp.update(1.)
-        del lp
+        progress.update(1.)
 
     # Put it all togetehr in a vtkPolyDataActor
     polydata = vtk.vtkPolyData()
@@ -1116,11 +1525,14 @@ def get_image_actor(image_array,clim=None,actortype='vtkImageActor',scaling=1):
 
 
 
-def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_opacity=0.7,w=None,theta_start=90,phi_start=0,progress_callback=LoopProgPrinter().update,cancel=lambda : False,theta_steps=18,phi_steps=360,r_equiscale=None,extra_actors=[],filename=None):
+def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_opacity=0.7,w=None,theta_start=90,phi_start=0,progress_callback=LoopProgPrinter().update,cancel=lambda : False,theta_steps=18,phi_steps=360,r_equiscale=None,extra_actors=[],filename=None,n_processes=None,cache_dir=None):
     """
     Render an image of the tokamak wall "flattened" out. Creates an image where the horizontal direction is the toroidal direction and
     vertical direction is poloidal.
 
+    The image is built up from (theta_steps x phi_steps) rendered tiles, which are rendered in parallel by several worker processes
+    each with their own off-screen render window.
+
     Parameters:
 
         cadmodel (calcam.CADModel)                  : CAD Model to render. The CAD model must have an R, Z wall contour embedded in it (this is \
@@ -1151,8 +1563,16 @@ def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_o
                                                       radius. This parameter sets at what major radius objects appear at their correct shape. If not specified, the \
                                                       centre of the wall contour is used so objects on the inboard side appear "fatter" than in real life and objects on the \
                                                       outboard side will be "skinnier".
+        extra_actors (list of vtk.vtkActor)         : List of any additional vtkActors to add to the scene. Since VTK actors cannot be passed between processes, \
+                                                      giving any extra actors means the whole render is done in the calling process and the tile cache is not used.
         filename (string)                           : If provided, the result will be saved to an image file with this name in addition to being returned as an array. \
                                                       Must include file extension.
+        n_processes (int)                           : Number of worker processes to use for rendering tiles and calculating the calibration wall coverage. \
+                                                      Default is to use calcam.config.n_cpus. If set to 1, everything is done in the calling process.
+        cache_dir (str)                             : Path to a directory in which to keep a persistent cache of rendered tiles and calibration wall coverage. \
+                                                      If given, repeated renders with the same model and settings re-use the cached results, and only tiles \
+                                                      whose content has changed (e.g. where a newly added calibration is visible) are re-rendered. \
+                                                      Interrupted renders can also be resumed in this way.
     Returns:
 
         A NumPy array of size ( h * w * 3 ) and dtype uint8 containing the RGB image result.
@@ -1160,7 +1580,10 @@ def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_o
     if cadmodel.wall_contour is None:
         raise Exception('[render_unfolded_wall] This CAD model does not have a wall contour included. This function can only be used with CAD models which have wall contours.')
 
-    cal_actors = []
+    if n_processes is None:
+        n_processes = config.n_cpus
+
+    cal_colours = []
     legend_items = []
     if len(calibrations) > 0:
         if len(labels) > 0:
@@ -1172,165 +1595,212 @@ def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_o
         else:
             ccycle = ColourCycle()
 
-        for i,calib in enumerate(calibrations):
-            try:
-                progress_callback('Calculating high-res wall coverage for calibration {:s}'.format(labels[i] if len(labels) > 0 else '...{:s}'.format(calib.filename[-16:])))
-            except Exception:
-                print('Calculating high-res wall coverage for calibration {:s}'.format(labels[i] if len(labels) > 0 else '...{:s}'.format(calib.filename[-16:])))
-            actor = get_wall_coverage_actor(calib,cadmodel,verbose=True)
-            actor.GetProperty().SetOpacity(cal_opacity)
+        for i in range(len(calibrations)):
             if colours is not None:
                 col = colours[i]
             else:
                 col = next(ccycle)
-            actor.GetProperty().SetColor(col)
-            cal_actors.append(actor)
+            cal_colours.append(tuple(col))
             if len(labels) > 0:
                 legend_items.append((labels[i], col))
 
+    # Extra actors can't be sent to the worker processes or included in the tile cache keys,
+    # so if we have any we have to do everything here and without the tile cache.
+    parallel = n_processes > 1 and len(extra_actors) == 0
+    use_tile_cache = cache_dir is not None and len(extra_actors) == 0
 
-    # The camera will be placed in the centre of the R, Z wall contour
-    r_min = cadmodel.wall_contour[:,0].min()
-    r_max = cadmodel.wall_contour[:,0].max()
-    z_min = cadmodel.wall_contour[:,1].min()
-    z_max = cadmodel.wall_contour[:,1].max()
-    r_mid = (r_max + r_min) / 2
-    z_mid = (z_max + z_min) / 2
-
-    # Calculate image width for ~2mm / pixel if none is given
-    if w is None:
-        tor_len = 2*np.pi*r_mid
-        w = int(tor_len/2e-3)
-
-    if r_equiscale is None:
-        r_equiscale = r_mid
-
-    # Maximum line length which will be used for wall contour intersection tests.
-    linelength = np.sqrt((r_max - r_min)**2 + (z_max - z_min)**2)
-
-    # Theta and phi steps in radians
-    theta_step = 2*np.pi/theta_steps
-    phi_step = 2*np.pi/phi_steps
-
-    # Convert starting angles to radians
-    theta_start = theta_start / 180 * np.pi
-    phi_start = phi_start / 180 * np.pi
-
-    # Set up a VTK off screen window to do the image rendering
-    renwin = vtk.vtkRenderWindow()
-    renwin.OffScreenRenderingOn()
-    renwin.SetBorders(0)
-    renderer = vtk.vtkRenderer()
-    renwin.AddRenderer(renderer)
-    camera = renderer.GetActiveCamera()
-    camera.SetViewAngle(theta_step/np.pi * 180)
-    renderer.Render()
-    light = renderer.GetLights().GetItemAsObject(0)
-    light.SetPositional(True)
-
-    # Width of each tile in the horizontal direction
-    xsz = int(w/phi_steps)
-    w = phi_steps * xsz
-
-    cadmodel.add_to_renderer(renderer)
-
-    for actor in extra_actors:
-        renderer.AddActor(actor)
-
-    for actor in cal_actors:
-        renderer.AddActor(actor)
-
-    # Initialise an array for the output image.
-    out_im = np.empty((0,w,3),dtype=np.uint8)
-
-    # Update status callback if present
-    if callable(progress_callback):
-        try:
-            progress_callback('Rendering un-folded wall image ({:d} pixels width)...'.format(w))
-        except Exception:
-            print('Rendering un-folded wall image ({:d} pixels width)...'.format(w))
-        progress_callback(0.)
-        n = 0
-
-    # Outer loop over poloidal angle
-    for theta in np.linspace(theta_start + theta_step/2,theta_start + 2*np.pi - theta_step/2,theta_steps):
+    # Wall coverage actors and rendered tiles are passed around as files in the cache directory,
+    # or in a temporary directory if we aren't keeping a cache.
+    if cache_dir is None:
+        work_dir = tempfile.mkdtemp()
+    else:
+        work_dir = cache_dir
+    for subdir in ['coverage','tiles']:
+        os.makedirs(os.path.join(work_dir,subdir),exist_ok=True)
 
-        # See where a line from the camera position at this poloidal angle hits the wall contour
-        line_end = [linelength*np.cos(theta) + r_mid,linelength*np.sin(theta)+z_mid]
-        rtarg,ztarg = get_contour_intersection(cadmodel.wall_contour,[r_mid,z_mid],line_end)
+    model_state = _get_cadmodel_state(cadmodel)
+    model_key = _hash_object(model_state['key'])
 
-        # What aspect ratio the render window needs to be to cover the correct poloidal and toroidal angles
-        r = np.sqrt((rtarg - r_mid)**2 + (ztarg - z_mid)**2)
-        xangle = phi_step * rtarg / r
-        aspect = theta_step / xangle
-        ysz = int(xsz * aspect)
+    pool = None
+    out_im = np.empty((0,0,3),dtype=np.uint8)
 
-        # Camera upvec
-        view_up_rz = [np.cos(theta + np.pi/2), np.sin(theta + np.pi/2)]
+    try:
 
-        # Figure out what height this strip of image should be by normalising it with distance
-        # from the camera to the wall in that direction.
-        dr = theta_step*r
+        # Start up the worker processes first, so they can load the CAD model while we get on with other things.
+        if parallel:
+            pool = multiprocessing.Pool(n_processes,initializer=_unfolded_wall_worker_init,initargs=(model_state,))
 
-        height = int(dr/(r_equiscale*2*np.pi/w))
+        # Calculate wall coverage actors for any calibrations we don't already have them for.
+        coverage_keys = [_hash_object([model_key,_get_calib_key(calib)]) for calib in calibrations]
+        coverage_files = [os.path.join(work_dir,'coverage','{:s}.vtp'.format(key)) for key in coverage_keys]
+        to_calculate = [i for i in range(len(calibrations)) if not os.path.isfile(coverage_files[i])]
 
-        # This will be our horizontal strip of image corresponding to this poloidal angle
-        row = np.empty((height, 0, 3), dtype=np.uint8)
+        if parallel and len(to_calculate) > 1:
+            try:
+                progress_callback('Calculating high-res wall coverage for {:d} calibrations using {:d} processes...'.format(len(to_calculate),n_processes))
+            except Exception:
+                print('Calculating high-res wall coverage for {:d} calibrations using {:d} processes...'.format(len(to_calculate),n_processes))
 
-        # Set the render window size
-        renwin.SetSize(xsz,ysz)
+            for _ in pool.imap_unordered(_unfolded_wall_coverage_task,[(calibrations[i],coverage_files[i]) for i in to_calculate]):
+                if cancel():
+                    break
+        else:
+            for i in to_calculate:
+                try:
+                    progress_callback('Calculating high-res wall coverage for calibration {:s}'.format(labels[i] if len(labels) > 0 else '...{:s}'.format(calibrations[i].filename[-16:])))
+                except Exception:
+                    print('Calculating high-res wall coverage for calibration {:s}'.format(labels[i] if len(labels) > 0 else '...{:s}'.format(calibrations[i].filename[-16:])))
+                actor = get_wall_coverage_actor(calibrations[i],cadmodel,verbose=True)
+                _save_polydata(actor.GetMapper().GetInput(),coverage_files[i])
+                if cancel():
+                    break
 
-        # Inner loop is over toroidal angle
-        for phi in np.linspace(phi_start + phi_step/2,phi_start + 2*np.pi - phi_step/2,phi_steps):
+        # If cancelled while calculating wall coverage, some coverage files will be missing,
+        # so stop here rather than starting to render any tiles. The finally block tidies up.
+        if cancel():
+            return out_im
+
+        cal_actor_specs = [(coverage_files[i],cal_colours[i],cal_opacity) for i in range(len(calibrations))]
+
+        # The camera will be placed in the centre of the R, Z wall contour
+        r_min = cadmodel.wall_contour[:,0].min()
+        r_max = cadmodel.wall_contour[:,0].max()
+        z_min = cadmodel.wall_contour[:,1].min()
+        z_max = cadmodel.wall_contour[:,1].max()
+        r_mid = (r_max + r_min) / 2
+        z_mid = (z_max + z_min) / 2
+
+        # Calculate image width for ~2mm / pixel if none is given
+        if w is None:
+            tor_len = 2*np.pi*r_mid
+            w = int(tor_len/2e-3)
+
+        if r_equiscale is None:
+            r_equiscale = r_mid
+
+        # Maximum line length which will be used for wall contour intersection tests.
+        linelength = np.sqrt((r_max - r_min)**2 + (z_max - z_min)**2)
+
+        # Theta and phi steps in radians
+        theta_step = 2*np.pi/theta_steps
+        phi_step = 2*np.pi/phi_steps
+
+        # Convert starting angles to radians
+        theta_start = theta_start / 180 * np.pi
+        phi_start = phi_start / 180 * np.pi
+
+        # Width of each tile in the horizontal direction
+        xsz = int(w/phi_steps)
+        w = phi_steps * xsz
+
+        # Work out the camera geometry for each row of tiles, i.e. each poloidal angle
+        rows = []
+        for theta in np.linspace(theta_start + theta_step/2,theta_start + 2*np.pi - theta_step/2,theta_steps):
+
+            # See where a line from the camera position at this poloidal angle hits the wall contour
+            line_end = [linelength*np.cos(theta) + r_mid,linelength*np.sin(theta)+z_mid]
+            rtarg,ztarg = get_contour_intersection(cadmodel.wall_contour,[r_mid,z_mid],line_end)
+
+            # What aspect ratio the render window needs to be to cover the correct poloidal and toroidal angles
+            r = np.sqrt((rtarg - r_mid)**2 + (ztarg - z_mid)**2)
+            xangle = phi_step * rtarg / r
+            aspect = theta_step / xangle
+            ysz = int(xsz * aspect)
+
+            # Figure out what height this strip of image should be by normalising it with distance
+            # from the camera to the wall in that direction.
+            dr = theta_step*r
+            height = int(dr/(r_equiscale*2*np.pi/w))
+
+            rows.append({'theta':theta,'rtarg':rtarg,'ztarg':ztarg,'centre':(r_mid,z_mid),'view_angle':theta_step/np.pi * 180,
+                         'view_up_rz':(np.cos(theta + np.pi/2), np.sin(theta + np.pi/2)),'xsz':xsz,'ysz':ysz,'height':height})
+
+        phis = np.linspace(phi_start + phi_step/2,phi_start + 2*np.pi - phi_step/2,phi_steps)
+
+        # Initialise an array for the output image. Each row of tiles is stacked on top
+        # of the previous ones and each tile to the left of the previous one.
+        heights = [row['height'] for row in rows]
+        row_offsets = [int(np.sum(heights[i+1:])) for i in range(theta_steps)]
+        out_im = np.zeros((int(np.sum(heights)),w,3),dtype=np.uint8)
+
+        # To know which tiles need re-rendering, work out which tiles each calibration's wall coverage could appear in.
+        if use_tile_cache:
+            footprints = []
+            for cov_file in coverage_files:
+                points = _get_polydata_points(_load_polydata(cov_file))
+                footprints.append(_get_unfolded_tile_footprint(points,rows,theta_start,phi_start,phi_steps))
+
+        # Update status callback if present
+        if callable(progress_callback):
+            try:
+                progress_callback('Rendering un-folded wall image ({:d} pixels width)...'.format(w))
+            except Exception:
+                print('Rendering un-folded wall image ({:d} pixels width)...'.format(w))
+            progress_callback(0.)
+
+        # Get any tiles we can from the cache, and split the rest in to chunks for the workers.
+        n_done = 0
+        chunk_size = max(1,int(np.ceil(theta_steps * phi_steps / (8*n_processes))))
+        tasks = []
+        for i,row in enumerate(rows):
+            to_render = []
+            for j,phi in enumerate(phis):
+                tile_file = None
+                if use_tile_cache:
+                    visible_cals = [[coverage_keys[k],cal_colours[k],cal_opacity] for k in range(len(calibrations)) if footprints[k][i,j]]
+                    tile_key = _hash_object([model_key,row,phi,visible_cals])
+                    tile_file = os.path.join(work_dir,'tiles','{:s}.png'.format(tile_key))
+                    im = cv2.imread(tile_file) if os.path.isfile(tile_file) else None
+                    if im is not None and im.shape == (row['height'],row['xsz'],3):
+                        out_im[row_offsets[i]:row_offsets[i] + row['height'],(phi_steps - j - 1)*xsz:(phi_steps - j)*xsz,:] = im[:,:,::-1]
+                        n_done += 1
+                        continue
+                to_render.append((j,phi,tile_file))
 
-            # Shuffle the camera and light around toroidally and point them at the right place on the wall
-            camera.SetPosition(r_mid*np.cos(phi),r_mid*np.sin(phi),z_mid)
-            light.SetPosition(r_mid*np.cos(phi),r_mid*np.sin(phi),z_mid)
-            upvec = [np.cos(phi)*view_up_rz[0],np.sin(phi)*view_up_rz[0],view_up_rz[1]]
-            camera.SetViewUp(upvec)
-            camera.SetFocalPoint(rtarg*np.cos(phi),rtarg*np.sin(phi),ztarg)
+            for start in range(0,len(to_render),chunk_size):
+                tasks.append((i,row,to_render[start:start+chunk_size]))
 
-            # Render the image tile
-            renwin.Render()
-            vtk_win_im = vtk.vtkWindowToImageFilter()
-            vtk_win_im.SetInput(renwin)
-            vtk_win_im.Update()
-            vtk_image = vtk_win_im.GetOutput()
-            vtk_array = vtk_image.GetPointData().GetScalars()
-            dims = vtk_image.GetDimensions()
-            im = np.flipud(vtk_to_numpy(vtk_array).reshape(dims[1], dims[0] , 3))
+        if parallel and len(tasks) > 0:
+            results = pool.imap_unordered(_unfolded_wall_tile_task,[(task,cal_actor_specs) for task in tasks])
+            tile_renderer = None
+        else:
+            cal_actors = [_load_coverage_actor(*spec) for spec in cal_actor_specs]
+            tile_renderer = _UnfoldedWallRenderer(cadmodel,cal_actors + extra_actors)
+            results = (tile_renderer.render_tiles(task) for task in tasks)
 
-            # Squash or stretch it vertically to get the poloidal scale right, as calculated earlier.
-            im = cv2.resize(im,(xsz,height))
+        for i,tiles in results:
 
-            # Glue it on to the output
-            row = np.hstack((im,row))
+            # Glue the tiles on to the output
+            for j,im in tiles:
+                out_im[row_offsets[i]:row_offsets[i] + rows[i]['height'],(phi_steps - j - 1)*xsz:(phi_steps - j)*xsz,:] = im
 
             # Update the status callback, if present
             if callable(progress_callback):
-                n += 1
-                progress_callback(n/(theta_steps*phi_steps))
+                n_done += len(tiles)
+                progress_callback(n_done/(theta_steps*phi_steps))
+
             # Stop if cancellation has been requested
             if cancel():
                 break
 
-        if cancel():
-            break
+        if tile_renderer is not None:
+            tile_renderer.close()
 
-        # Stick this image strip on to the output.
-        out_im = np.vstack((row,out_im))
+    finally:
+        if pool is not None:
+            if cancel():
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        if cache_dir is None:
+            shutil.rmtree(work_dir,ignore_errors=True)
 
 
     if callable(progress_callback):
         progress_callback(1.)
 
-    cadmodel.remove_from_renderer(renderer)
-    for cal_actor in cal_actors:
-        renderer.RemoveActor(cal_actor)
-
-    for actor in extra_actors:
-        renderer.RemoveActor(actor)
-
     if len(legend_items) > 0 and not cancel():
 
         longest_name = max([len(item[0]) for item in legend_items])
@@ -1359,6 +1829,11 @@ def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_o
 
         legend.GetPositionCoordinate().SetValue(0,0)
 
+        renwin = vtk.vtkRenderWindow()
+        renwin.OffScreenRenderingOn()
+        renwin.SetBorders(0)
+        renderer = vtk.vtkRenderer()
+        renwin.AddRenderer(renderer)
         renderer.AddActor(legend)
         renwin.SetSize(legend_width,abs_height)
         renwin.Render()
@@ -1376,7 +1851,7 @@ def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_o
 
         out_im[y_offs:y_offs + legend_im.shape[0],x_offs:x_offs + legend_im.shape[1],:] = out_im[y_offs:y_offs + legend_im.shape[0],x_offs:x_offs + legend_im.shape[1],:] * (1-alpha) + alpha * legend_im
 
-    renwin.Finalize()
+        renwin.Finalize()
 
 
 
@@ -1398,4 +1873,540 @@ def render_unfolded_wall(cadmodel,calibrations=[],labels = [],colours=None,cal_o
             except Exception:
                 print('Warning: could not write to image file {:s}'.format(filename))
 
-    return out_im
\ No newline at end of file
+    return out_im
+
+
+
+class _UnfoldedWallRenderer():
+    '''
+    Off-screen renderer for rendering tiles of an unfolded wall image.
+    Each worker process used by render_unfolded_wall() has one of these
+    with its own render window.
+    '''
+    def __init__(self,cadmodel,actors):
+
+        self.renwin = vtk.vtkRenderWindow()
+        self.renwin.OffScreenRenderingOn()
+        self.renwin.SetBorders(0)
+        self.renderer = vtk.vtkRenderer()
+        self.renwin.AddRenderer(self.renderer)
+        self.camera = self.renderer.GetActiveCamera()
+        self.renderer.Render()
+        self.light = self.renderer.GetLights().GetItemAsObject(0)
+        self.light.SetPositional(True)
+
+        self.cadmodel = cadmodel
+        self.actors = actors
+
+        self.cadmodel.add_to_renderer(self.renderer)
+        for actor in self.actors:
+            self.renderer.AddActor(actor)
+
+
+    def render_tiles(self,task):
+        '''
+        Render a set of tiles from the same row of the unfolded wall image.
+
+        Parameters:
+
+            task (tuple) : (row index, row geometry dictionary, list of (tile index, toroidal angle, cache filename or None))
+
+        Returns:
+
+            Row index and list of (tile index, tile image) tuples.
+        '''
+        i,row,tiles = task
+
+        r_mid,z_mid = row['centre']
+        view_up_rz = row['view_up_rz']
+
+        self.camera.SetViewAngle(row['view_angle'])
+        self.renwin.SetSize(row['xsz'],row['ysz'])
+
+        output = []
+        for j,phi,tile_file in tiles:
+
+            # Shuffle the camera and light around toroidally and point them at the right place on the wall
+            self.camera.SetPosition(r_mid*np.cos(phi),r_mid*np.sin(phi),z_mid)
+            self.light.SetPosition(r_mid*np.cos(phi),r_mid*np.sin(phi),z_mid)
+            upvec = [np.cos(phi)*view_up_rz[0],np.sin(phi)*view_up_rz[0],view_up_rz[1]]
+            self.camera.SetViewUp(upvec)
+            self.camera.SetFocalPoint(row['rtarg']*np.cos(phi),row['rtarg']*np.sin(phi),row['ztarg'])
+
+            # Render the image tile
+            self.renwin.Render()
+            vtk_win_im = vtk.vtkWindowToImageFilter()
+            vtk_win_im.SetInput(self.renwin)
+            vtk_win_im.Update()
+            vtk_image = vtk_win_im.GetOutput()
+            vtk_array = vtk_image.GetPointData().GetScalars()
+            dims = vtk_image.GetDimensions()
+            im = np.flipud(vtk_to_numpy(vtk_array).reshape(dims[1], dims[0] , 3))
+
+            # Squash or stretch it vertically to get the poloidal scale right
+            im = cv2.resize(im,(row['xsz'],row['height']))
+
+            if tile_file is not None:
+                _save_image_atomic(tile_file,im[:,:,::-1])
+
+            output.append((j,im))
+
+        return i,output
+
+
+    def close(self):
+
+        self.cadmodel.remove_from_renderer(self.renderer)
+        for actor in self.actors:
+            self.renderer.RemoveActor(actor)
+        self.renwin.Finalize()
+
+
+
+# State of each render_unfolded_wall() worker process
+_unfolded_wall_worker = {}
+
+def _unfolded_wall_worker_init(model_state):
+
+    vtk.vtkObject.GlobalWarningDisplayOff()
+    _unfolded_wall_worker['cadmodel'] = _cadmodel_from_state(model_state)
+    _unfolded_wall_worker['renderer'] = None
+
+
+def _unfolded_wall_coverage_task(args):
+
+    calib,coverage_file = args
+    actor = get_wall_coverage_actor(calib,_unfolded_wall_worker['cadmodel'])
+    _save_polydata(actor.GetMapper().GetInput(),coverage_file)
+
+    return coverage_file
+
+
+def _unfolded_wall_tile_task(args):
+
+    task,actor_specs = args
+
+    if _unfolded_wall_worker['renderer'] is None:
+        actors = [_load_coverage_actor(*spec) for spec in actor_specs]
+        _unfolded_wall_worker['renderer'] = _UnfoldedWallRenderer(_unfolded_wall_worker['cadmodel'],actors)
+
+    return _unfolded_wall_worker['renderer'].render_tiles(task)
+
+
+
+def _get_unfolded_tile_footprint(points,rows,theta_start,phi_start,phi_steps):
+    '''
+    Work out which tiles of an unfolded wall image a set of 3D points could appear in.
+    This errs on the side of including too many tiles rather than too few, since it is
+    used to decide which cached tiles are still valid.
+
+    Parameters:
+
+        points (np.ndarray) : Nx3 array of 3D point coordinates
+        rows (list)         : List of dictionaries describing the geometry of each row of tiles.
+        theta_start (float) : Poloidal angle of the image top & bottom, in radians.
+        phi_start (float)   : Toroidal angle of the image left & right, in radians.
+        phi_steps (int)     : Number of tiles in the toroidal direction.
+
+    Returns:
+
+        np.ndarray          : (theta_steps x phi_steps) boolean array which is True for tiles the points could appear in.
+    '''
+    theta_steps = len(rows)
+    theta_step = 2*np.pi/theta_steps
+    phi_step = 2*np.pi/phi_steps
+
+    footprint = np.zeros((theta_steps,phi_steps),dtype=bool)
+
+    points = points[np.all(np.isfinite(points),axis=1),:]
+    if points.shape[0] == 0:
+        return footprint
+
+    r_mid,z_mid = rows[0]['centre']
+
+    # Positions of the points in the poloidal plane relative to the camera position
+    R = np.sqrt(points[:,0]**2 + points[:,1]**2)
+    phi = np.arctan2(points[:,1],points[:,0])
+    dr = R - r_mid
+    dz = points[:,2] - z_mid
+    rho = np.sqrt(dr**2 + dz**2)
+
+    # Which tile each point is "behind" in each direction
+    itheta = np.floor(((np.arctan2(dz,dr) - theta_start) % (2*np.pi)) / theta_step).astype(int) % theta_steps
+    iphi = np.floor(((phi - phi_start) % (2*np.pi)) / phi_step).astype(int) % phi_steps
+
+    for i,row in enumerate(rows):
+
+        # Points can only appear in their own row of tiles or the adjacent ones.
+        in_row = ((itheta - i) % theta_steps <= 1) | ((i - itheta) % theta_steps <= 1)
+        if not np.any(in_row):
+            continue
+
+        # How far the points can be toroidally from the camera and still be in the field of view,
+        # with plenty of margin.
+        tan_half_fov = np.tan(row['view_angle'] * np.pi / 360) * row['xsz'] / row['ysz']
+        with np.errstate(divide='ignore',invalid='ignore'):
+            sin_dphi = 1.5 * tan_half_fov * rho[in_row] / R[in_row]
+
+        if np.any(np.logical_not(sin_dphi < 1)):
+            footprint[i,:] = True
+            continue
+
+        n_tiles = np.ceil( (np.arcsin(sin_dphi) + phi_step) / phi_step ).astype(int)
+
+        if np.any(2*n_tiles + 1 >= phi_steps):
+            footprint[i,:] = True
+            continue
+
+        # Mark the range of tiles around each point, allowing for wrapping around toroidally.
+        counts = np.zeros(3*phi_steps + 1,dtype=int)
+        np.add.at(counts,iphi[in_row] - n_tiles + phi_steps,1)
+        np.add.at(counts,iphi[in_row] + n_tiles + 1 + phi_steps,-1)
+        footprint[i,:] = (np.cumsum(counts)[:-1] > 0).reshape(3,phi_steps).any(axis=0)
+
+    return footprint
+
+
+
+def _get_cadmodel_state(cadmodel):
+    '''
+    Get a picklable description of the current state of a CAD model, which
+    can be used to re-create it in another process with _cadmodel_from_state(),
+    and a key describing what it looks like which can be used for caching.
+    '''
+    if cadmodel.def_file is not None:
+        source = [cadmodel.def_file.filename,os.path.getmtime(cadmodel.def_file.filename)]
+    else:
+        source = None
+
+    features = {}
+    key_features = {}
+    for fname,feature in cadmodel.features.items():
+
+        features[fname] = {'mesh_file':feature.filename,
+                           'default_enable':feature.enabled,
+                           'mesh_scale':feature.scale,
+                           'mesh_up_direction':feature.mesh_up,
+                           'rotate_toroidal':feature.toroidal_rotation,
+                           'coord_handedness':feature.coord_handedness,
+                           'colour':feature.default_colour,
+                           'current_colour':feature.colour,
+                           'linewidth':feature.linewidth,
+                           'mesh_id':feature.get_mesh_id()}
+
+        if feature.enabled:
+            key_features[fname] = dict(features[fname])
+            del key_features[fname]['mesh_id']
+            key_features[fname]['mesh_file'] = [os.path.split(feature.filename)[1],os.path.getsize(feature.filename)]
+            if source is None:
+                key_features[fname]['mesh_file'].append(os.path.getmtime(feature.filename))
+
+    state = {'machine_name':cadmodel.machine_name,
+             'model_variant':cadmodel.model_variant,
+             'wall_contour':cadmodel.wall_contour,
+             'flat_shading':cadmodel.flat_shading,
+             'edges':cadmodel.edges,
+             'features':features}
+
+    state['key'] = {'source':source,'model_variant':cadmodel.model_variant,'flat_shading':cadmodel.flat_shading,'edges':cadmodel.edges,'features':key_features}
+
+    return state
+
+
+
+def _cadmodel_from_state(state):
+    '''
+    Create a CAD model object from a state description from _get_cadmodel_state().
+    The mesh files are loaded directly from their current locations rather than
+    re-opening the model definition file.
+    '''
+    cadmodel = CADModel(status_callback=None)
+    cadmodel.machine_name = state['machine_name']
+    cadmodel.model_variant = state['model_variant']
+    cadmodel.wall_contour = state['wall_contour']
+
+    for fname,feature_def in state['features'].items():
+
+        if len(fname.split('/')) > 1:
+            group = fname.split('/')[0]
+            if group not in cadmodel.groups.keys():
+                cadmodel.groups[group] = [fname]
+            else:
+                cadmodel.groups[group].append(fname)
+
+        cadmodel.features[fname] = ModelFeature(cadmodel,feature_def,abs_path=True)
+        cadmodel.features[fname].colour = feature_def['current_colour']
+        cadmodel.features[fname].linewidth = feature_def['linewidth']
+        cadmodel.features[fname].mesh_id = feature_def.get('mesh_id',None)
+
+    cadmodel.flat_shading = state['flat_shading']
+    cadmodel.edges = state['edges']
+
+    return cadmodel
+
+
+
+# CAD model kept loaded in a background worker process between render jobs.
+_worker_cadmodel = {'id':None,'cadmodel':None}
+
+def _get_worker_cadmodel(state):
+    '''
+    Get a CAD model matching a state description from _get_cadmodel_state(), for use
+    in a long-lived background worker process. If the model geometry is the same as the
+    last call, the already loaded model is re-used with its appearance updated to match
+    the state, so the mesh files only need to be loaded once.
+    '''
+    geometry = {'machine_name':state['machine_name'],'model_variant':state['model_variant'],'features':{}}
+    for fname,feature_def in state['features'].items():
+        geometry['features'][fname] = [feature_def[key] for key in ['mesh_file','mesh_scale','mesh_up_direction','rotate_toroidal','coord_handedness']]
+    model_id = _hash_object(geometry)
+
+    if model_id != _worker_cadmodel['id']:
+        if _worker_cadmodel['cadmodel'] is not None:
+            _worker_cadmodel['cadmodel'].unload()
+        _worker_cadmodel['cadmodel'] = _cadmodel_from_state(state)
+        _worker_cadmodel['id'] = model_id
+
+    cadmodel = _worker_cadmodel['cadmodel']
+
+    if cadmodel.edges != state['edges']:
+        # Changing this makes the model re-create its edge actors where needed.
+        cadmodel.set_wireframe(state['edges'])
+    cadmodel.flat_shading = state['flat_shading']
+
+    for fname,feature_def in state['features'].items():
+        feature = cadmodel.features[fname]
+        feature.enabled = feature_def['default_enable']
+        feature.set_colour(feature_def['current_colour'])
+        feature.set_linewidth(feature_def['linewidth'])
+        if feature.solid_actor is not None:
+            feature.solid_actor.GetProperty().SetLighting(not state['flat_shading'])
+
+    cadmodel.cell_locator = None
+
+    return cadmodel
+
+
+
+def _build_low_detail_meshes(state,cancel=lambda : False):
+    '''
+    Make reduced detail meshes for the enabled features of a CAD model described by a state
+    from _get_cadmodel_state(). This uses its own copy of the model, so it can be run in a
+    background thread while the original model is being displayed.
+    '''
+    cadmodel = _cadmodel_from_state(state)
+
+    try:
+        cadmodel.build_low_detail_meshes(cancel=cancel)
+    finally:
+        cadmodel.unload()
+
+
+
+def _get_actor_state(actor):
+    '''
+    Get a picklable description of a VTK actor (or assembly of actors) which can be
+    used to re-create it in another process with _actors_from_state(). Returns a list
+    with one entry per actor, since assemblies are flattened in to their parts.
+    '''
+    if isinstance(actor,vtk.vtkAssembly):
+        parts = vtk.vtkPropCollection()
+        actor.GetActors(parts)
+        states = []
+        for i in range(parts.GetNumberOfItems()):
+            part = parts.GetItemAsObject(i)
+            for state in _get_actor_state(part):
+                state['matrix'] = np.matmul(_vtk_matrix_to_numpy(actor.GetMatrix()),state['matrix'])
+                states.append(state)
+        return states
+
+    mapper = actor.GetMapper()
+    if mapper.GetInputAlgorithm() is not None:
+        mapper.GetInputAlgorithm().Update()
+
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetInputData(mapper.GetInput())
+    writer.WriteToOutputStringOn()
+    writer.SetDataModeToBinary()
+    writer.Write()
+
+    prop = actor.GetProperty()
+
+    return [{'polydata':writer.GetOutputString(),
+             'scalar_visibility':mapper.GetScalarVisibility(),
+             'colour_mode':mapper.GetColorMode(),
+             'scalar_mode':mapper.GetScalarMode(),
+             'colour':prop.GetColor(),
+             'opacity':prop.GetOpacity(),
+             'linewidth':prop.GetLineWidth(),
+             'pointsize':prop.GetPointSize(),
+             'lighting':prop.GetLighting(),
+             'representation':prop.GetRepresentation(),
+             'visibility':actor.GetVisibility(),
+             'matrix':_vtk_matrix_to_numpy(actor.GetMatrix())}]
+
+
+
+def _actors_from_state(states):
+    '''
+    Re-create VTK actors from a list of actor descriptions from _get_actor_state().
+    '''
+    actors = []
+    for state in states:
+
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.ReadFromInputStringOn()
+        reader.SetInputString(state['polydata'])
+        reader.Update()
+
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(reader.GetOutput())
+        mapper.SetScalarVisibility(state['scalar_visibility'])
+        mapper.SetColorMode(state['colour_mode'])
+        mapper.SetScalarMode(state['scalar_mode'])
+
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+
+        prop = actor.GetProperty()
+        prop.SetColor(state['colour'])
+        prop.SetOpacity(state['opacity'])
+        prop.SetLineWidth(state['linewidth'])
+        prop.SetPointSize(state['pointsize'])
+        prop.SetLighting(state['lighting'])
+        prop.SetRepresentation(state['representation'])
+        actor.SetVisibility(state['visibility'])
+
+        matrix = vtk.vtkMatrix4x4()
+        for i in range(4):
+            for j in range(4):
+                matrix.SetElement(i,j,state['matrix'][i,j])
+        actor.SetUserMatrix(matrix)
+
+        actors.append(actor)
+
+    return actors
+
+
+
+def _vtk_matrix_to_numpy(matrix):
+
+    return np.array([[matrix.GetElement(i,j) for j in range(4)] for i in range(4)])
+
+
+
+def _render_cam_view_from_state(model_state,calibration,extra_actor_states=[],depth=False,**kwargs):
+    '''
+    Render a camera view in a background worker process, given a CAD model state from
+    _get_cadmodel_state() and extra actor descriptions from _get_actor_state().
+    Keyword arguments are passed through to render_cam_view(). If depth is True,
+    returns the image and a depth map at the calibration's display resolution.
+    '''
+    vtk.vtkObject.GlobalWarningDisplayOff()
+    cadmodel = _get_worker_cadmodel(model_state)
+    extra_actors = _actors_from_state(extra_actor_states)
+
+    if not depth:
+        return render_cam_view(cadmodel,calibration,extra_actors=extra_actors,verbose=False,**kwargs)
+
+    aa = kwargs.pop('aa',1)
+    _check_render_settings(calibration,kwargs.get('oversampling',1),kwargs.get('interpolation','cubic'))
+    renderer = _CamViewRenderer(cadmodel,extra_actors,aa)
+    try:
+        image = renderer.render(calibration,**kwargs)
+        depth_map = renderer.render(calibration,depth=True)
+    finally:
+        renderer.close()
+
+    return image,depth_map
+
+
+
+def _get_calib_key(calib):
+    '''
+    Get a JSON-serialisable description of the sight-line geometry of a calibration,
+    for use in cache keys.
+    '''
+    view_models = []
+    for view_model in calib.view_models:
+        if view_model is None:
+            view_models.append(None)
+        else:
+            view_models.append(view_model.get_dict())
+
+    geometry = [calib.geometry.transform_actions,calib.geometry.x_pixels,calib.geometry.y_pixels,calib.geometry.pixel_aspectratio,calib.geometry.offset]
+
+    return {'view_models':view_models,'geometry':geometry,'subview_mask':hashlib.sha1(np.ascontiguousarray(calib.subview_mask)).hexdigest()}
+
+
+
+def _hash_object(obj):
+    '''
+    Get a hex digest hash of a JSON-serialisable object (which may also contain NumPy arrays & scalars).
+    '''
+    def to_builtin(value):
+        if isinstance(value,np.ndarray):
+            return value.tolist()
+        elif isinstance(value,np.generic):
+            return value.item()
+        else:
+            raise TypeError('Cannot hash object of type {:}'.format(type(value)))
+
+    return hashlib.sha1(json.dumps(obj,sort_keys=True,default=to_builtin).encode('utf-8')).hexdigest()
+
+
+
+def _save_polydata(polydata,filename):
+
+    # Write to a temporary file and move it in to place, so we never leave a partially written file behind.
+    tmp_filename = '{:s}.{:d}.tmp'.format(filename,os.getpid())
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(tmp_filename)
+    writer.SetInputData(polydata)
+    writer.Write()
+    os.replace(tmp_filename,filename)
+
+
+def _load_polydata(filename):
+
+    reader = vtk.vtkXMLPolyDataReader()
+    reader.SetFileName(filename)
+    reader.Update()
+
+    return reader.GetOutput()
+
+
+def _get_polydata_points(polydata):
+
+    # Only include points which are actually part of a polygon
+    cleaner = vtk.vtkCleanPolyData()
+    cleaner.PointMergingOff()
+    cleaner.SetInputData(polydata)
+    cleaner.Update()
+
+    points = cleaner.GetOutput().GetPoints()
+    if points is None:
+        return np.zeros((0,3))
+    else:
+        return vtk_to_numpy(points.GetData())
+
+
+def _load_coverage_actor(filename,colour,opacity):
+
+    mapper = vtk.vtkPolyDataMapper()
+    mapper.SetInputData(_load_polydata(filename))
+
+    actor = vtk.vtkActor()
+    actor.SetMapper(mapper)
+    actor.GetProperty().LightingOff()
+    actor.GetProperty().SetOpacity(opacity)
+    actor.GetProperty().SetColor(colour)
+
+    return actor
+
+
+def _save_image_atomic(filename,image):
+
+    tmp_filename = '{:s}.{:d}.tmp.png'.format(filename[:-4],os.getpid())
+    if cv2.imwrite(tmp_filename,image):
+        os.replace(tmp_filename,filename)
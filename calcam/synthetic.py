@@ -0,0 +1,581 @@
+'''
+* Copyright 2015-2019 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+"""
+Tools for generating synthetic Calcam inputs: CAD models, calibrations and
+reconstruction grids for a procedurally generated tokamak-like machine.
+
+These are useful for testing and benchmarking Calcam at realistic scale
+without needing any real machine's CAD models or calibrations, e.g. to
+reproduce performance problems in a way which can be shared.
+"""
+
+import os
+import json
+import struct
+
+import numpy as np
+
+from . import misc
+from .io import ZipSaveFile
+
+
+def make_wall_contour(major_radius=1.,minor_radius=0.5,elongation=1.6,triangularity=0.3,n_points=128):
+    '''
+    Get a D-shaped wall contour, in the style of a tokamak first wall.
+
+    Parameters:
+
+        major_radius (float)  : Major radius of the wall centre in metres.
+        minor_radius (float)  : Minor radius (half-width in R) of the wall in metres.
+        elongation (float)    : Ratio of the wall half-height to the minor radius.
+        triangularity (float) : Triangularity of the D shape.
+        n_points (int)        : Number of points in the contour.
+
+    Returns:
+
+        np.ndarray : N x 2 array of R,Z coordinates of the wall contour.
+    '''
+    theta = np.linspace(0,2*np.pi,n_points,endpoint=False)
+
+    r = major_radius + minor_radius * np.cos(theta + triangularity*np.sin(theta))
+    z = elongation * minor_radius * np.sin(theta)
+
+    return np.stack([r,z],axis=1)
+
+
+
+def make_cadmodel(filename,n_triangles=200000,wall_contour=None,n_ports=8,machine_name='Synthetic Tokamak',status_callback=None):
+    '''
+    Create a Calcam CAD model definition (.ccm) file of a procedurally generated
+    tokamak-like machine. The model consists of a first wall made by revolving
+    the wall contour, split in to toroidal sectors each with a rectangular
+    port at the outboard mid-plane, and a set of limiter tiles between the ports.
+
+    Parameters:
+
+        filename (str)              : File name to save the model definition to. If it does \
+                                      not end with .ccm, the extension will be added.
+        n_triangles (int)           : Approximate total number of mesh triangles in the model.
+        wall_contour (np.ndarray)   : N x 2 array of R,Z coordinates of the wall. If not \
+                                      given, calcam.synthetic.make_wall_contour() is used.
+        n_ports (int)               : Number of toroidal sectors, each of which has one port.
+        machine_name (str)          : Machine name to put in the model definition.
+        status_callback (callable)  : Function to call with status messages, or None.
+
+    Returns:
+
+        str : Full path of the saved model definition file.
+    '''
+    if wall_contour is None:
+        wall_contour = make_wall_contour()
+
+    wall_contour = _open_contour(wall_contour)
+
+    if not filename.endswith('.ccm'):
+        filename = filename + '.ccm'
+
+    sector_size = 2*np.pi / n_ports
+    port = _get_port_geometry(wall_contour,n_ports,0)
+
+    # Most of the triangles go in to the first wall, with the rest in the limiter tiles.
+    n_quads = 0.9 * n_triangles / 2
+    perimeter = _get_perimeter(wall_contour)
+    n_phi = int(np.sqrt(n_quads * 2*np.pi*wall_contour[:,0].mean() / perimeter))
+    n_phi = max(4,int(np.round(n_phi / n_ports))) * n_ports
+    n_poloidal = max(8,int(np.round(n_quads / n_phi)))
+    mesh_contour = _resample_contour(wall_contour,n_poloidal)
+
+    n_tile_quads = 0.1 * n_triangles / 2 / (2 * n_ports)
+    n_tile_phi = max(2,int(np.sqrt(n_tile_quads)))
+    n_tile_poloidal = max(6,int(np.round(n_tile_quads / n_tile_phi)))
+
+    # Extra half-size of the port ducts so they cover the edges of the holes cut in the
+    # faceted wall mesh, which has the resolution of the mesh.
+    margin = np.array([port['r_wall'] * sector_size * n_ports / n_phi, perimeter / n_poloidal])
+
+    # Tiles sit on the outboard wall above and below the ports.
+    tile_z = port['z'] + np.array([-1.,1.]) * (port['half_size'][1] + 0.15 * (wall_contour[:,1].max() - wall_contour[:,1].min()))
+    minor_radius = (wall_contour[:,0].max() - wall_contour[:,0].min()) / 2.
+
+    features = {}
+
+    with ZipSaveFile(filename,'w') as def_file:
+
+        mesh_dir = os.path.join(def_file.get_temp_path(),'.large','default')
+        os.makedirs(mesh_dir)
+
+        for sector in range(n_ports):
+
+            if status_callback is not None:
+                status_callback('Generating CAD model sector {:d}/{:d}...'.format(sector+1,n_ports))
+
+            phi_start = sector * sector_size
+
+            # First wall for this sector, with the port hole cut out of it
+            triangles,centres = _revolve(mesh_contour,phi_start,phi_start + sector_size,n_phi // n_ports)
+            in_port = _in_port(centres,_get_port_geometry(wall_contour,n_ports,sector))
+            triangles = triangles[~in_port]
+
+            mesh_file = 'wall_sector_{:d}.stl'.format(sector + 1)
+            _write_stl(os.path.join(mesh_dir,mesh_file),triangles)
+            features['Wall/Sector {:d}'.format(sector + 1)] = {'mesh_file':mesh_file,'default_enable':True,'mesh_scale':1.,'colour':[0.75,0.75,0.75]}
+
+            # Port duct
+            mesh_file = 'port_{:d}.stl'.format(sector + 1)
+            _write_stl(os.path.join(mesh_dir,mesh_file),_port_duct(_get_port_geometry(wall_contour,n_ports,sector),margin))
+            features['Ports/Port {:d}'.format(sector + 1)] = {'mesh_file':mesh_file,'default_enable':True,'mesh_scale':1.,'colour':[0.6,0.6,0.65]}
+
+            # Limiter tiles, mid-way between this sector's port and the next
+            for i,z in enumerate(tile_z):
+                r = _get_outboard_r(wall_contour,z) - 0.06 * minor_radius
+                theta = np.linspace(0,2*np.pi,n_tile_poloidal,endpoint=False)
+                tile_contour = np.stack([r + 0.05*minor_radius*np.cos(theta),z + 0.1*minor_radius*np.sin(theta)],axis=1)
+                tile_phi = phi_start + sector_size
+                tile_width = 0.15 * sector_size
+                triangles,_ = _revolve(tile_contour,tile_phi - tile_width,tile_phi + tile_width,n_tile_phi,caps=True)
+
+                mesh_file = 'tile_{:d}_{:d}.stl'.format(sector + 1,i + 1)
+                _write_stl(os.path.join(mesh_dir,mesh_file),triangles)
+                features['Limiter Tiles/Tile {:d}'.format(2*sector + i + 1)] = {'mesh_file':mesh_file,'default_enable':True,'mesh_scale':1.,'colour':[0.8,0.45,0.3]}
+
+        r_max = wall_contour[:,0].max()
+        z_max = wall_contour[:,1].max()
+        views = {
+                    'Overview': {'cam_pos':[0.,-3.*r_max,2.*z_max],'target':[0.,0.,0.],'y_fov':50.,'xsection':None,'roll':0.,'projection':'perspective'},
+                    'Interior': {'cam_pos':[0.95*port['r_wall'],0.,port['z']],'target':[0.,r_max,0.],'y_fov':70.,'xsection':None,'roll':0.,'projection':'perspective'}
+                }
+
+        model_def = {
+                        'machine_name':machine_name,
+                        'views':views,
+                        'initial_view':'Overview',
+                        'default_variant':'Default',
+                        'mesh_path_roots':{'Default':'.large/default'},
+                        'features':{'Default':features}
+                    }
+
+        with def_file.open_file('model.json','w') as f:
+            json.dump(model_def,f,indent=4,sort_keys=True)
+
+        np.savetxt(os.path.join(def_file.get_temp_path(),'wall_contour.txt'),wall_contour,fmt='%.4f')
+
+        if status_callback is not None:
+            status_callback('Saving CAD model definition...')
+
+    if status_callback is not None:
+        status_callback(None)
+
+    return os.path.abspath(filename)
+
+
+
+def make_calibration(wall_contour=None,n_ports=8,port=0,image_size=(640,480),n_subviews=1,y_fov=60.,model='rectilinear',dist_coeffs=None,cadmodel=None,n_pointpairs=50,seed=0):
+    '''
+    Create a synthetic fitted calibration of a camera looking in to the vessel through
+    a port of a CAD model made by calcam.synthetic.make_cadmodel(). The camera can have
+    several sub-views side by side on the detector, each looking in a different direction,
+    and has realistic lens distortion.
+
+    Parameters:
+
+        wall_contour (np.ndarray)  : N x 2 array of R,Z coordinates of the wall. This, and n_ports, \
+                                     must be the same as used to make the CAD model. If not given, the \
+                                     wall contour of the given CAD model is used if there is one, or \
+                                     calcam.synthetic.make_wall_contour() if not.
+        n_ports (int)              : Number of ports the CAD model was made with.
+        port (int)                 : Index of the port the camera looks through.
+        image_size (tuple)         : Detector (width,height) in pixels.
+        n_subviews (int)           : Number of sub-views, which are arranged side by side on the detector.
+        y_fov (float)              : Vertical field of view of the camera in degrees (ignoring distortion).
+        model (str)                : Lens model to use: 'rectilinear' or 'fisheye'.
+        dist_coeffs (sequence)     : Distortion coefficients in OpenCV format for the given model. If not \
+                                     given, a typical amount of barrel distortion is used.
+        cadmodel (calcam.CADModel) : CAD model the camera is looking at. If given, the calibration image \
+                                     will be a rendered image of this model, and point pairs on the model \
+                                     are included.
+        n_pointpairs (int)         : Approximate number of point pairs to include if a CAD model is given.
+        seed (int)                 : Seed for the random numbers used to choose point pairs and add noise \
+                                     to their image coordinates.
+
+    Returns:
+
+        calcam.Calibration : The synthetic calibration.
+    '''
+    from .calibration import Calibration, ViewModel
+    from .coordtransformer import CoordTransformer
+    from .pointpairs import PointPairs
+
+    if wall_contour is None:
+        if cadmodel is not None and cadmodel.wall_contour is not None:
+            wall_contour = cadmodel.wall_contour
+        else:
+            wall_contour = make_wall_contour()
+
+    if model not in ['rectilinear','fisheye']:
+        raise ValueError('Unknown lens model "{:s}"; must be "rectilinear" or "fisheye".'.format(model))
+
+    if dist_coeffs is None:
+        if model == 'rectilinear':
+            dist_coeffs = [-0.2,0.05,2e-4,-1e-4,0.]
+        else:
+            dist_coeffs = [0.02,-5e-3,1e-3,0.]
+
+    port_geometry = _get_port_geometry(_open_contour(wall_contour),n_ports,port)
+    e_r,e_phi = port_geometry['e_r'],port_geometry['e_phi']
+
+    cal = Calibration(cal_type='fit')
+
+    nx,ny = image_size
+    cal.geometry = CoordTransformer(orig_x=nx,orig_y=ny)
+
+    subview_mask = np.zeros((ny,nx),dtype=np.int8)
+    edges = np.round(np.linspace(0,nx,n_subviews + 1)).astype(int)
+    for subview in range(n_subviews):
+        subview_mask[:,edges[subview]:edges[subview+1]] = subview
+
+    if n_subviews > 1:
+        cal.set_subview_mask(subview_mask,subview_names=['View {:d}'.format(i+1) for i in range(n_subviews)])
+        yaws = np.linspace(-40,40,n_subviews)
+    else:
+        cal.set_subview_mask(subview_mask,subview_names=['Image'])
+        yaws = [20.]
+
+    f = ny / 2. / np.tan(y_fov/2. * np.pi/180)
+
+    history = 'Synthetic calibration generated by {:s} on {:s} at {:s}'.format(misc.username,misc.hostname,misc.get_formatted_time())
+
+    for subview in range(n_subviews):
+
+        yaw = yaws[subview] * np.pi / 180
+        pitch = -5. * np.pi / 180
+
+        view_dir = np.cos(pitch) * (-np.cos(yaw)*e_r + np.sin(yaw)*e_phi) + np.array([0.,0.,np.sin(pitch)])
+
+        coeffs_dict = {
+                        'model':model,
+                        'fx':f,
+                        'fy':f,
+                        'cx':(edges[subview] + edges[subview+1]) / 2.,
+                        'cy':ny / 2.,
+                        'dist_coeffs':list(dist_coeffs),
+                        'reprojection_error':0.,
+                        'fit_options':[]
+                      }
+        coeffs_dict['rvec'],coeffs_dict['tvec'] = _get_extrinsics(port_geometry['camera_pos'],view_dir)
+
+        cal.view_models[subview] = ViewModel.from_dict(coeffs_dict)
+        cal.history['fit'][subview] = history
+
+    if cadmodel is not None:
+
+        from .render import render_cam_view
+
+        image = render_cam_view(cadmodel,cal,verbose=False)
+        cal.set_image(image[:,:,:3],'Synthetic image rendered from CAD model "{:s}"'.format(cadmodel.machine_name),coords='Original',subview_mask=subview_mask,subview_names=cal.subview_names)
+
+        # Point pairs are chosen from randomly selected vertices of the wall mesh, since they
+        # lie exactly on the CAD model surface.
+        rng = np.random.RandomState(seed)
+        points_3d = _get_mesh_points(cadmodel)
+        points_3d = points_3d[rng.permutation(points_3d.shape[0])[:20*n_pointpairs]]
+
+        points_2d = cal.project_points(points_3d,coords='Display',check_occlusion_with=cadmodel)
+
+        # Image coordinates of the point pairs have a little random noise added, like real ones.
+        pointpairs = PointPairs()
+        errors = [[] for subview in range(n_subviews)]
+        for i in range(points_3d.shape[0]):
+
+            im_points = [None] * n_subviews
+            for subview in range(n_subviews):
+                if not np.any(np.isnan(points_2d[subview][i])):
+                    error = rng.normal(0.,0.25,size=2)
+                    im_points[subview] = points_2d[subview][i] + error
+                    errors[subview].append(error)
+
+            if any([p is not None for p in im_points]):
+                pointpairs.add_pointpair(points_3d[i],im_points)
+
+            if pointpairs.get_n_pointpairs() == n_pointpairs:
+                break
+
+        if pointpairs.get_n_pointpairs() > 0:
+            cal.set_pointpairs(pointpairs,src='Synthetic point pairs generated from CAD model "{:s}"'.format(cadmodel.machine_name))
+
+        # The re-projection error is then the RMS of the added noise.
+        for subview in range(n_subviews):
+            if len(errors[subview]) > 0:
+                cal.view_models[subview].reprojection_error = np.sqrt(np.mean(np.sum(np.array(errors[subview])**2,axis=1)))
+
+    return cal
+
+
+
+def make_grid(n_cells,wall_contour=None,cell_type='square'):
+    '''
+    Create a reconstruction grid with approximately a given number of cells
+    covering the inside of a wall contour.
+
+    Parameters:
+
+        n_cells (int)             : Desired number of grid cells.
+        wall_contour (np.ndarray) : N x 2 array of R,Z coordinates of the wall. If not \
+                                    given, calcam.synthetic.make_wall_contour() is used.
+        cell_type (str)           : Type of grid cells: 'square' or 'triangle'. Triangular \
+                                    grids need the "triangle" package.
+
+    Returns:
+
+        calcam.gm.PoloidalVolumeGrid : The generated grid.
+    '''
+    from .gm import squaregrid, trigrid
+
+    if wall_contour is None:
+        wall_contour = make_wall_contour()
+
+    wall_contour = _open_contour(wall_contour)
+
+    # Polygon area of the wall contour
+    area = 0.5 * np.abs(np.dot(wall_contour[:,0],np.roll(wall_contour[:,1],1)) - np.dot(wall_contour[:,1],np.roll(wall_contour[:,0],1)))
+
+    if cell_type == 'square':
+        make = lambda size: squaregrid(wall_contour,size)
+        cell_size = np.sqrt(area / n_cells)
+    elif cell_type == 'triangle':
+        make = lambda size: trigrid(wall_contour,size)
+        cell_size = np.sqrt(area / n_cells / np.sqrt(2))
+    else:
+        raise ValueError('Unknown cell type "{:s}"; must be "square" or "triangle".'.format(cell_type))
+
+    # The number of cells we get isn't exactly predictable from the cell size,
+    # so adjust the cell size a few times to get close to the requested number.
+    grid = make(cell_size)
+    for _ in range(3):
+        if abs(grid.n_cells - n_cells) < 0.05 * n_cells:
+            break
+        cell_size = cell_size * np.sqrt(grid.n_cells / n_cells)
+        grid = make(cell_size)
+
+    return grid
+
+
+
+# Remove the last point of a wall contour if it is the same as the first.
+def _open_contour(contour):
+
+    contour = np.array(contour,dtype=float)
+    if np.abs(contour[0,:] - contour[-1,:]).max() < 1e-15:
+        contour = contour[:-1]
+
+    return contour
+
+
+# Total length of a closed contour
+def _get_perimeter(contour):
+    return np.sqrt(np.sum( (np.roll(contour,-1,axis=0) - contour)**2,axis=1)).sum()
+
+
+# Re-sample a closed contour to a given number of points, equally spaced along the contour.
+def _resample_contour(contour,n_points):
+
+    closed = np.concatenate([contour,contour[:1]])
+    distance = np.concatenate([[0.],np.cumsum(np.sqrt(np.sum(np.diff(closed,axis=0)**2,axis=1)))])
+    new_distance = np.linspace(0,distance[-1],n_points,endpoint=False)
+
+    return np.stack([np.interp(new_distance,distance,closed[:,0]),np.interp(new_distance,distance,closed[:,1])],axis=1)
+
+
+# Get the R coordinate of the outboard side of a wall contour at a given Z
+def _get_outboard_r(contour,z):
+
+    r_mid = (contour[:,0].max() + contour[:,0].min()) / 2.
+    closed = np.concatenate([contour,contour[:1]])
+
+    r_out = []
+    for i in range(contour.shape[0]):
+        z0,z1 = closed[i,1],closed[i+1,1]
+        if min(z0,z1) <= z <= max(z0,z1) and z0 != z1:
+            r = closed[i,0] + (z - z0) * (closed[i+1,0] - closed[i,0]) / (z1 - z0)
+            if r > r_mid:
+                r_out.append(r)
+
+    if len(r_out) == 0:
+        raise ValueError('Wall contour has no outboard side at Z = {:.3f} m'.format(z))
+
+    return max(r_out)
+
+
+# Get the geometry of a given port: the port is at the outboard mid-plane
+# in the middle of each of n_ports toroidal sectors. The camera is set back in
+# the port far enough to be outside reconstruction grids covering the vessel, and
+# a little above the mid-plane so its sight-lines are not degenerate with the
+# machine's (and reconstruction grids') up-down symmetry.
+def _get_port_geometry(contour,n_ports,port):
+
+    phi = (port + 0.5) * 2*np.pi / n_ports
+
+    z = contour[np.argmax(contour[:,0]),1]
+    r_wall = _get_outboard_r(contour,z)
+
+    minor_radius = (contour[:,0].max() - contour[:,0].min()) / 2.
+    half_size = np.array([min(0.45*minor_radius,0.4*r_wall*np.pi/n_ports) , 0.25*(contour[:,1].max() - contour[:,1].min())/2.])
+
+    e_r = np.array([np.cos(phi),np.sin(phi),0.])
+    e_phi = np.array([-np.sin(phi),np.cos(phi),0.])
+
+    return {
+            'phi':phi,
+            'z':z,
+            'r_wall':r_wall,
+            'half_size':half_size,
+            'r_inner':min([_get_outboard_r(contour,z + dz) for dz in [-1.5*half_size[1],1.5*half_size[1]]]) - 0.02*minor_radius,
+            'depth':0.5*minor_radius,
+            'e_r':e_r,
+            'e_phi':e_phi,
+            'camera_pos':(r_wall + 0.2*minor_radius) * e_r + np.array([0.,0.,z + 0.137*half_size[1]]),
+            }
+
+
+# Check which points, given as an N x 3 array, are inside the given port opening
+def _in_port(points,port):
+
+    r = np.sqrt(points[:,0]**2 + points[:,1]**2)
+    phi = np.arctan2(points[:,1],points[:,0])
+    dphi = (phi - port['phi'] + np.pi) % (2*np.pi) - np.pi
+
+    return (np.abs(dphi * port['r_wall']) < port['half_size'][0]) & (np.abs(points[:,2] - port['z']) < port['half_size'][1]) & (r > port['r_wall'] - port['depth'])
+
+
+# Make the triangles of a port duct: a rectangular box open on the vessel side,
+# extending from just inside the wall around the port to the port depth behind it.
+def _port_duct(port,margin,n_div=8):
+
+    hw,hh = port['half_size'] + margin
+    r_start = port['r_inner']
+    r_end = port['r_wall'] + port['depth']
+    e_r,e_phi,e_z = port['e_r'],port['e_phi'],np.array([0.,0.,1.])
+    centre = port['z'] * e_z
+
+    # Each face as an origin and two edge vectors
+    faces = [
+                (centre + r_start*e_r - hw*e_phi - hh*e_z, (r_end - r_start)*e_r, 2*hw*e_phi),
+                (centre + r_start*e_r - hw*e_phi + hh*e_z, 2*hw*e_phi, (r_end - r_start)*e_r),
+                (centre + r_start*e_r - hw*e_phi - hh*e_z, 2*hh*e_z, (r_end - r_start)*e_r),
+                (centre + r_start*e_r + hw*e_phi - hh*e_z, (r_end - r_start)*e_r, 2*hh*e_z),
+                (centre + r_end*e_r - hw*e_phi - hh*e_z, 2*hw*e_phi, 2*hh*e_z),
+            ]
+
+    u,v = np.meshgrid(np.linspace(0,1,n_div+1),np.linspace(0,1,n_div+1),indexing='ij')
+
+    triangles = []
+    for origin,edge1,edge2 in faces:
+        points = origin + u[:,:,np.newaxis]*edge1 + v[:,:,np.newaxis]*edge2
+        triangles.append(_quads_to_triangles(points[:-1,:-1],points[1:,:-1],points[1:,1:],points[:-1,1:]).reshape(-1,3,3))
+
+    return np.concatenate(triangles)
+
+
+# Split quadrilaterals with corners given by arrays p0..p3 (in order around
+# the quad) in to pairs of triangles. Returns an array of shape (...,2,3,3).
+def _quads_to_triangles(p0,p1,p2,p3):
+    return np.stack([ np.stack([p0,p1,p2],axis=-2), np.stack([p0,p2,p3],axis=-2) ],axis=-3)
+
+
+# Make the surface of revolution of a closed R,Z contour between two toroidal angles.
+# Returns an (M,3,3) array of triangles and an (M,3) array of the centres of the quads
+# each triangle is part of. If caps=True the ends are closed with flat polygons.
+def _revolve(contour,phi_start,phi_end,n_phi,caps=False):
+
+    phi = np.linspace(phi_start,phi_end,n_phi + 1)
+    points = np.empty((n_phi + 1,contour.shape[0],3))
+    points[:,:,0] = contour[np.newaxis,:,0] * np.cos(phi)[:,np.newaxis]
+    points[:,:,1] = contour[np.newaxis,:,0] * np.sin(phi)[:,np.newaxis]
+    points[:,:,2] = contour[np.newaxis,:,1]
+
+    next_points = np.roll(points,-1,axis=1)
+
+    triangles = _quads_to_triangles(points[:-1],next_points[:-1],next_points[1:],points[1:])
+    centres = (points[:-1] + next_points[:-1] + next_points[1:] + points[1:]) / 4.
+
+    triangles = triangles.reshape(-1,3,3)
+    centres = np.repeat(centres.reshape(-1,3),2,axis=0)
+
+    if caps:
+        cap_triangles = []
+        for end in [points[0],points[-1]]:
+            centre = np.tile(end.mean(axis=0),(end.shape[0],1))
+            cap_triangles.append(np.stack([centre,end,np.roll(end,-1,axis=0)],axis=1))
+        cap_triangles = np.concatenate(cap_triangles)
+        triangles = np.concatenate([triangles,cap_triangles])
+        centres = np.concatenate([centres,cap_triangles.mean(axis=1)])
+
+    return triangles,centres
+
+
+# Write an array of triangles with shape (N,3,3) to a binary STL file.
+def _write_stl(filename,triangles):
+
+    triangles = np.asarray(triangles,dtype=np.float32).reshape(-1,3,3)
+
+    normals = np.cross(triangles[:,1,:] - triangles[:,0,:],triangles[:,2,:] - triangles[:,0,:])
+    lengths = np.sqrt(np.sum(normals**2,axis=1))
+    lengths[lengths == 0] = 1.
+    normals = normals / lengths[:,np.newaxis]
+
+    records = np.zeros(triangles.shape[0],dtype=[('normal','<f4',(3,)),('vertices','<f4',(3,3)),('attributes','<u2')])
+    records['normal'] = normals
+    records['vertices'] = triangles
+
+    with open(filename,'wb') as stl_file:
+        stl_file.write(b'Calcam synthetic CAD model mesh'.ljust(80))
+        stl_file.write(struct.pack('<I',triangles.shape[0]))
+        records.tofile(stl_file)
+
+
+# Calculate rotation and translation vectors (OpenCV convention) for a
+# camera at a given position looking in a given direction, with zero roll.
+def _get_extrinsics(campos,view_dir):
+
+    from .calibration import Calibration
+
+    virtual_cal = Calibration(cal_type='virtual')
+    virtual_cal.set_pinhole_intrinsics(1.,1.,0.,0.,1,1)
+    virtual_cal.set_extrinsics(campos,view_dir=view_dir,cam_roll=0.)
+
+    return list(np.squeeze(virtual_cal.view_models[0].rvec)),list(np.squeeze(virtual_cal.view_models[0].tvec))
+
+
+# Get the mesh vertex coordinates of the enabled features of a CAD model
+# whose names start with "Wall", as an N x 3 array.
+def _get_mesh_points(cadmodel):
+
+    from vtk.util.numpy_support import vtk_to_numpy
+
+    points = []
+    for feature in cadmodel.get_enabled_features():
+        if feature.lower().startswith('wall'):
+            points.append(vtk_to_numpy(cadmodel.features[feature].get_polydata().GetPoints().GetData()))
+
+    if len(points) == 0:
+        raise ValueError('CAD model has no enabled wall features to choose point pairs from!')
+
+    return np.unique(np.concatenate(points),axis=0).astype(float)
@@ -0,0 +1,122 @@
+'''
+* Copyright 2015-2021 European Atomic Energy Community (EURATOM)
+*
+* Licensed under the EUPL, Version 1.1 or - as soon they
+  will be approved by the European Commission - subsequent
+  versions of the EUPL (the "Licence");
+* You may not use this work except in compliance with the
+  Licence.
+* You may obtain a copy of the Licence at:
+*
+* https://joinup.ec.europa.eu/software/page/eupl
+*
+* Unless required by applicable law or agreed to in
+  writing, software distributed under the Licence is
+  distributed on an "AS IS" basis,
+* WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+  express or implied.
+* See the Licence for the specific language governing
+  permissions and limitations under the Licence.
+'''
+
+
+"""
+Tests for calcam.io save files.
+"""
+
+import os
+import zipfile
+
+import pytest
+
+from calcam import io
+
+
+# Write some files to a new save file, using compress_large_files for the .large files.
+def make_save_file(filename,contents,compress_large_files):
+
+    io.compress_large_files = compress_large_files
+    with io.ZipSaveFile(filename,'w') as save_file:
+        for fname,data in contents.items():
+            os.makedirs(os.path.dirname(os.path.join(save_file.get_temp_path(),fname)),exist_ok=True)
+            with save_file.open_file(fname,'wb') as f:
+                f.write(data)
+
+
+# Get the contents and compression type of each file in a zip file.
+def read_zip(filename):
+
+    with zipfile.ZipFile(filename,'r') as zf:
+        assert zf.testzip() is None
+        return dict([(zinfo.filename,(zf.read(zinfo),zinfo.compress_type)) for zinfo in zf.infolist()])
+
+
+@pytest.fixture
+def contents():
+
+    original_setting = io.compress_large_files
+    yield {'model.json':b'{"name": "test"}','.large/mesh.stl':b'solid test\n' * 10000,'.large/other.stl':b'solid other\n' * 10000}
+    io.compress_large_files = original_setting
+
+
+@pytest.mark.parametrize('raw_copy',[True,False])
+def test_round_trip(tmp_path,contents,monkeypatch,raw_copy):
+
+    filename = str(tmp_path / 'test.zip')
+    make_save_file(filename,contents,compress_large_files=False)
+
+    if not raw_copy:
+        monkeypatch.setattr(io,'_copy_raw_member',lambda src_zip,dst_zip,zinfo: False)
+
+    # Change one file and add another, with the opposite compression setting to before
+    io.compress_large_files = True
+    with io.ZipSaveFile(filename,'rw') as save_file:
+        with save_file.open_file('.large/mesh.stl','wb') as f:
+            f.write(b'solid changed\n' * 10000)
+        with save_file.open_file('.large/new.stl','wb') as f:
+            f.write(b'solid new\n' * 10000)
+
+    saved = read_zip(filename)
+
+    assert saved['model.json'] == (contents['model.json'],zipfile.ZIP_DEFLATED)
+    assert saved['.large/other.stl'] == (contents['.large/other.stl'],zipfile.ZIP_STORED)
+    assert saved['.large/mesh.stl'] == (b'solid changed\n' * 10000,zipfile.ZIP_DEFLATED)
+    assert saved['.large/new.stl'] == (b'solid new\n' * 10000,zipfile.ZIP_DEFLATED)
+
+    # And it can be opened again with the new contents
+    with io.ZipSaveFile(filename,'r') as save_file:
+        assert sorted(save_file.list_contents()) == sorted(saved.keys())
+        assert not save_file.is_modified()
+        for fname,(data,_) in saved.items():
+            with save_file.open_file(fname,'rb') as f:
+                assert f.read() == data
+
+
+def test_unchanged_not_rewritten(tmp_path,contents):
+
+    filename = str(tmp_path / 'test.zip')
+    make_save_file(filename,contents,compress_large_files=True)
+    mtime = os.stat(filename).st_mtime_ns
+
+    # Re-writing a file with the same contents does not count as a change
+    with io.ZipSaveFile(filename,'rw') as save_file:
+        with save_file.open_file('model.json','wb') as f:
+            f.write(contents['model.json'])
+        assert not save_file.is_modified()
+
+    assert os.stat(filename).st_mtime_ns == mtime
+
+
+def test_recompress(tmp_path,contents):
+
+    filename = str(tmp_path / 'test.zip')
+    make_save_file(filename,contents,compress_large_files=True)
+
+    io.compress_large_files = False
+    with io.ZipSaveFile(filename,'rw') as save_file:
+        save_file.update(recompress=True)
+
+    saved = read_zip(filename)
+
+    for fname,data in contents.items():
+        assert saved[fname] == (data,zipfile.ZIP_STORED if fname.startswith('.large/') else zipfile.ZIP_DEFLATED)